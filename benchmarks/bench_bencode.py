@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Compares the Bencode codec with the original, recursive one.
+
+Usage: python benchmarks/bench_bencode.py [SECONDS]
+
+The original is the one still shipped with the vendored upstream copy in
+entangled/entangled. Each payload is encoded and decoded repeatedly for about
+SECONDS per codec and direction.
+"""
+
+import os
+import sys
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import entangled.kademlia.encoding
+
+import imp
+import random
+import time
+
+upstream = imp.load_source('upstream_encoding',
+    os.path.join(root, 'entangled', 'entangled', 'kademlia', 'encoding.py'))
+
+
+def randomString(rng, length):
+  return ''.join([chr(rng.randint(0, 255)) for i in range(length)])
+
+def message(rng, payload):
+  """A response message as the kademlia message format builds it."""
+  return {0: 1, 1: randomString(rng, 20), 2: randomString(rng, 20), 3: payload}
+
+def payloads():
+  rng = random.Random(1919)
+  contacts = [[randomString(rng, 20), '127.0.0.1', 4000 + i] for i in range(20)]
+  return [
+    ('findNode (20 contacts)', message(rng, contacts)),
+    ('findValue (64KB value)',
+        message(rng, {randomString(rng, 20): randomString(rng, 65536)})),
+    ('findValue (1000 values)',
+        message(rng, {randomString(rng, 20):
+            [randomString(rng, 64) for i in range(1000)]})),
+  ]
+
+def throughput(function, argument, seconds):
+  """Returns calls per second."""
+  calls = 0
+  started = time.time()
+  while True:
+    function(argument)
+    calls += 1
+    elapsed = time.time() - started
+    if elapsed >= seconds:
+      return calls / elapsed
+
+
+if __name__ == '__main__':
+  seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+  codecs = [
+    ('original', upstream.Bencode()),
+    ('current', entangled.kademlia.encoding.Bencode()),
+  ]
+  for name, payload in payloads():
+    encoded = codecs[1][1].encode(payload)
+    if codecs[0][1].encode(payload) != encoded:
+      raise RuntimeError('Encoders disagree on %s' % name)
+    print('%s, %d bytes:' % (name, len(encoded)))
+    for codecName, codec in codecs:
+      encodeRate = throughput(codec.encode, payload, seconds)
+      decodeRate = throughput(codec.decode, encoded, seconds)
+      print('  %-8s encode %9.1f/s %7.2fMB/s  decode %9.1f/s %7.2fMB/s' % (
+          codecName, encodeRate, encodeRate * len(encoded) / 1e6,
+          decodeRate, decodeRate * len(encoded) / 1e6))
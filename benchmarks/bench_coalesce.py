@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Counts the datagrams of bursts of small RPCs to the same node, with and
+without coalescing them into envelopes.
+
+Usage: python benchmarks/bench_coalesce.py [BURSTS] [RPCS] [--coalesce|--no-coalesce]
+
+Each burst sends RPCS pings (default 8) to one node at once, as a lookup or
+republish does. Without a mode flag both modes are run, each in its own
+process since the Twisted reactor can't be restarted.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import entangled.kademlia.contact
+import twisted.internet.defer
+import twisted.internet.reactor
+
+from bench_sessions import makeNode
+
+import subprocess
+import time
+
+
+def run(bursts, rpcs, coalesce):
+  reactor = twisted.internet.reactor
+  nodeA = makeNode('bench-a', True)
+  nodeB = makeNode('bench-b', True)
+  for node in (nodeA, nodeB):
+    if not coalesce:
+      node._protocol._coalescer = None
+  portA = reactor.listenUDP(0, nodeA._protocol)
+  portB = reactor.listenUDP(0, nodeB._protocol)
+  nodeA.keyCache[nodeB.id] = nodeB.rsaKey.publickey()
+  contact = entangled.kademlia.contact.Contact(
+      nodeB.id, '127.0.0.1', portB.getHost().port, nodeA._protocol)
+  result = {'datagrams': 0, 'times': []}
+
+  def countingWrite(protocol):
+    write = protocol._scheduler._write
+    def _write(data, address):
+      result['datagrams'] += 1
+      write(data, address)
+    protocol._scheduler._write = _write
+  countingWrite(nodeA._protocol)
+  countingWrite(nodeB._protocol)
+
+  @twisted.internet.defer.inlineCallbacks
+  def benchmark():
+    try:
+      # Let both sides learn about each other (and their envelope support).
+      yield contact.ping()
+      yield contact.ping()
+      result['datagrams'] = 0
+      for i in range(bursts):
+        started = time.time()
+        yield twisted.internet.defer.gatherResults(
+            [contact.ping() for j in range(rpcs)])
+        result['times'].append(time.time() - started)
+    except Exception, e:
+      result['error'] = str(e)
+    reactor.stop()
+
+  reactor.callWhenRunning(benchmark)
+  reactor.run(installSignalHandlers = False)
+  for name, node in (('node A', nodeA), ('node B', nodeB)):
+    if node._protocol._coalescer is not None:
+      result[name] = node._protocol._coalescer.stats()
+  portA.stopListening()
+  portB.stopListening()
+  return result
+
+
+if __name__ == '__main__':
+  args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+  bursts = int(args[0]) if args else 50
+  rpcs = int(args[1]) if len(args) > 1 else 8
+  if '--coalesce' not in sys.argv and '--no-coalesce' not in sys.argv:
+    for mode in ('--no-coalesce', '--coalesce'):
+      subprocess.check_call([sys.executable, os.path.abspath(__file__),
+          str(bursts), str(rpcs), mode])
+    sys.exit(0)
+  coalesce = '--coalesce' in sys.argv
+  result = run(bursts, rpcs, coalesce)
+  if 'error' in result:
+    print('RPC failed: %s' % result['error'])
+    sys.exit(1)
+  times = result['times']
+  print('%s: %d bursts of %d pings, %d datagrams (%.2f per RPC), '
+      'mean burst time %.2fms' % (
+      'coalescing' if coalesce else 'no coalescing', bursts, rpcs,
+      result['datagrams'], float(result['datagrams']) / (bursts * rpcs),
+      sum(times) * 1000 / len(times)))
+  for side in ('node A', 'node B'):
+    if side in result:
+      print('  %s: %d datagrams saved, %d envelopes, delay added: mean %.2fms, '
+          'max %.2fms' % (side, result[side]['saved'], result[side]['envelopes'],
+          result[side]['meanDelay'] * 1000, result[side]['maxDelay'] * 1000))
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Measures store/findValue of a large value between two local nodes, with
+and without payload compression.
+
+Usage: python benchmarks/bench_compression.py [ROUNDS] [--compression|--no-compression]
+
+The value is an Entangled-style inverted index. Without a mode flag both modes
+are run, each in its own process since the Twisted reactor can't be restarted.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import entangled.kademlia.contact
+import twisted.internet.defer
+import twisted.internet.reactor
+
+from bench_sessions import makeNode
+
+import hashlib
+import random
+import subprocess
+import time
+
+
+def makeIndex(entries = 1000):
+  """A keyword index, as EntangledNode publishes it: a list of names."""
+  rng = random.Random(1919)
+  words = ['alpha', 'beta', 'gamma', 'delta', 'report', 'photo', 'notes',
+      'draft', 'final', 'summer', 'winter', '2011', '2012']
+  return ['%s %s.%s' % (' '.join(rng.sample(words, 3)), rng.randint(1, 999),
+      rng.choice(['txt', 'jpg', 'pdf'])) for i in range(entries)]
+
+def run(rounds, compression):
+  reactor = twisted.internet.reactor
+  nodeA = makeNode('bench-a', True)
+  nodeB = makeNode('bench-b', True)
+  for node in (nodeA, nodeB):
+    node._protocol._compression = compression
+  portA = reactor.listenUDP(0, nodeA._protocol)
+  portB = reactor.listenUDP(0, nodeB._protocol)
+  nodeA.keyCache[nodeB.id] = nodeB.rsaKey.publickey()
+  contact = entangled.kademlia.contact.Contact(
+      nodeB.id, '127.0.0.1', portB.getHost().port, nodeA._protocol)
+  index = makeIndex()
+  key = hashlib.sha1('index').digest()
+  result = {'bytes': 0, 'datagrams': 0}
+
+  def countingSend(protocol):
+    send = protocol._send
+    limit = protocol.msgSizeLimit
+    def _send(data, rpcID, address, *args):
+      result['bytes'] += len(data)
+      result['datagrams'] += (len(data) + limit - 1) / limit
+      return send(data, rpcID, address, *args)
+    protocol._send = _send
+  countingSend(nodeA._protocol)
+  countingSend(nodeB._protocol)
+
+  @twisted.internet.defer.inlineCallbacks
+  def benchmark():
+    try:
+      # Let both sides learn about each other first.
+      yield contact.ping()
+      result['bytes'] = result['datagrams'] = 0
+      started = time.time()
+      for i in range(rounds):
+        yield contact.store(key, index, nodeA.id, 0)
+        found = yield contact.findValue(key)
+        if found != {key: index}:
+          raise RuntimeError('findValue returned a different value')
+      result['seconds'] = time.time() - started
+    except Exception, e:
+      result['error'] = str(e)
+    reactor.stop()
+
+  reactor.callWhenRunning(benchmark)
+  reactor.run(installSignalHandlers = False)
+  result['node A'] = nodeA._protocol._translator.compressor.stats()
+  result['node B'] = nodeB._protocol._translator.compressor.stats()
+  portA.stopListening()
+  portB.stopListening()
+  return result
+
+
+if __name__ == '__main__':
+  args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+  rounds = int(args[0]) if args else 20
+  if '--compression' not in sys.argv and '--no-compression' not in sys.argv:
+    for mode in ('--no-compression', '--compression'):
+      subprocess.check_call(
+          [sys.executable, os.path.abspath(__file__), str(rounds), mode])
+    sys.exit(0)
+  compression = '--compression' in sys.argv
+  result = run(rounds, compression)
+  if 'error' in result:
+    print('RPC failed: %s' % result['error'])
+    sys.exit(1)
+  print('%s: %d store+findValue rounds in %.2fs, %d bytes in %d datagrams' % (
+      'compression' if compression else 'no compression', rounds,
+      result['seconds'], result['bytes'], result['datagrams']))
+  for side in ('node A', 'node B'):
+    for kind, counter in sorted(result[side].items()):
+      if not counter['compressed'] and not counter['decompressed']:
+        continue
+      print('  %-8s %-8s %3d compressed, ratio %.2f, %.2fms compressing, '
+            '%.2fms decompressing' % (
+          side, kind, counter['compressed'], counter['ratio'],
+          counter['compressSeconds'] * 1000,
+          counter['decompressSeconds'] * 1000))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Compares finding the k-bucket of a key by bisection with the original
+linear scan over the k-buckets.
+
+Usage: python benchmarks/bench_kbuckets.py [SECONDS]
+
+The routing table is filled with k contacts at each of a number of distances
+from its node, which splits it into about that many k-buckets. Keys are
+looked up for about SECONDS per table size and method: the IDs of the
+contacts, as on every datagram received from them, and random keys, as
+when looking up values.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import entangled.kademlia.constants
+import entangled.kademlia.contact
+import entangled.kademlia.routingtable
+
+import random
+import time
+
+
+def linearIndex(table, key):
+  """The original TreeRoutingTable._kbucketIndex."""
+  valKey = long(key.encode('hex'), 16)
+  i = 0
+  for bucket in table._buckets:
+    if bucket.keyInRange(valKey):
+      return i
+    else:
+      i += 1
+  return i
+
+def makeTable(distances, rng):
+  """Returns a routing table, and the IDs of its contacts."""
+  nodeID = '%040x' % rng.getrandbits(160)
+  table = entangled.kademlia.routingtable.TreeRoutingTable(nodeID.decode('hex'))
+  parentID = long(nodeID, 16)
+  contactIDs = []
+  for bit in range(160 - distances, 160):
+    for i in range(entangled.kademlia.constants.k):
+      contactID = ('%040x' % (parentID ^ (1 << bit) ^ i)).decode('hex')
+      table.addContact(entangled.kademlia.contact.Contact(
+          contactID, '127.0.0.1', 4000, None))
+      contactIDs.append(contactID)
+  return table, contactIDs
+
+def throughput(function, table, keys, seconds):
+  """Returns lookups per second."""
+  calls = 0
+  started = time.time()
+  while True:
+    for key in keys:
+      function(table, key)
+    calls += len(keys)
+    elapsed = time.time() - started
+    if elapsed >= seconds:
+      return calls / elapsed
+
+
+if __name__ == '__main__':
+  seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+  rng = random.Random(2424)
+  bisected = entangled.kademlia.routingtable.TreeRoutingTable._kbucketIndex
+  for distances in (20, 100, 160):
+    table, contactIDs = makeTable(distances, rng)
+    randomKeys = [('%040x' % rng.getrandbits(160)).decode('hex')
+        for i in range(1000)]
+    for key in contactIDs + randomKeys:
+      assert linearIndex(table, key) == bisected(table, key)
+    print('%d k-buckets:' % len(table._buckets))
+    for name, keys in (('contact IDs', contactIDs), ('random keys', randomKeys)):
+      linear = throughput(linearIndex, table, keys, seconds)
+      bisection = throughput(bisected, table, keys, seconds)
+      print('  %-12s linear %6.2fus  bisect %6.2fus  (%.1fx)' % (
+          name, 1e6 / linear, 1e6 / bisection, bisection / linear))
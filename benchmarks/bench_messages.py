@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Compares message sizes and codec throughput of the two message formats.
+
+Usage: python benchmarks/bench_messages.py [SECONDS]
+
+Bencode wrapping pickles (TintangledDefaultFormat) is compared with the binary
+format (TintangledBinaryFormat with BinaryEncoding), translating and encoding
+typical RPC messages and back, for about SECONDS each. Signatures and MACs
+are random bytes of the right size; no cryptography is timed.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import entangled.kademlia.encoding
+import Crypto.PublicKey.RSA
+
+import binaryencoding
+import constants
+import msgformat
+import msgtypes
+import util
+
+import time
+
+
+def messages():
+  rsaKey = Crypto.PublicKey.RSA.generate(constants.RSA_BITS).publickey()
+  nodeID = util.keyFingerprint(rsaKey)
+  x = util.bin2int(util.generateRandomString(20))
+  signature = (util.bin2int(util.generateRandomString(constants.RSA_BITS / 8)),)
+  key = util.generateRandomString(20)
+  contacts = [(util.generateRandomString(20), '10.0.%d.%d' % (i, i), 4000 + i)
+      for i in range(20)]
+
+  def request(method, args, **fields):
+    msg = msgtypes.RequestMessage(nodeID, method, args, rsaKey, x)
+    return finish(msg, **fields)
+
+  def response(result, **fields):
+    msg = msgtypes.ResponseMessage(
+        util.generateRandomString(20), nodeID, rsaKey, x, result)
+    return finish(msg, **fields)
+
+  def finish(msg, includeKey = False, mac = True):
+    msg.keyFingerprint = nodeID
+    msg.includeKey = includeKey
+    if mac:
+      msg.mac = util.generateRandomString(20)
+    else:
+      msg.signedValue = signature
+    return msg
+
+  return [
+    ('ping, first contact', request('ping', (), includeKey = True, mac = False)),
+    ('ping', request('ping', ())),
+    ('findNode', request('findNode', (key,))),
+    ('findNode response', response(contacts)),
+    ('store 1KB', request('store',
+        (key, util.generateRandomString(1024), nodeID, 0))),
+    ('findValue response 1KB',
+        response({key: util.generateRandomString(1024)})),
+  ]
+
+def roundTrip(encoder, translator, msg):
+  data = encoder.encode(translator.toPrimitive(msg))
+  translator.fromPrimitive(encoder.decode(data))
+  return data
+
+def throughput(encoder, translator, msg, seconds):
+  """Returns round trips per second."""
+  calls = 0
+  started = time.time()
+  while True:
+    roundTrip(encoder, translator, msg)
+    calls += 1
+    elapsed = time.time() - started
+    if elapsed >= seconds:
+      return calls / elapsed
+
+
+if __name__ == '__main__':
+  seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+  formats = [
+    ('bencode+pickle', entangled.kademlia.encoding.Bencode(),
+        msgformat.TintangledDefaultFormat()),
+    ('binary', binaryencoding.BinaryEncoding(),
+        msgformat.TintangledBinaryFormat()),
+  ]
+  for name, msg in messages():
+    print('%s:' % name)
+    for formatName, encoder, translator in formats:
+      size = len(roundTrip(encoder, translator, msg))
+      rate = throughput(encoder, translator, msg, seconds)
+      print('  %-15s %6d bytes %9.1f msgs/s' % (formatName, size, rate))
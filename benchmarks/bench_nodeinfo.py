@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Compares the size and decode time of findNode results per encoding.
+
+Usage: python benchmarks/bench_nodeinfo.py [SECONDS]
+
+A result of k contact triples is encoded as vanilla kademlia bencodes it, as
+TintangledDefaultFormat pickles it, with BinaryEncoding tagging each triple
+(a tuple of triples) and with BinaryEncoding packing the list in bulk.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import entangled.kademlia.encoding
+
+import binaryencoding
+import util
+
+import pickle
+import time
+
+
+def triples(k, ipv6 = False):
+  if ipv6:
+    address = '2001:db8::%x'
+  else:
+    address = '10.0.0.%d'
+  return [(util.generateRandomString(20), address % (i + 1), 4000 + i)
+      for i in range(k)]
+
+def throughput(function, argument, seconds):
+  """Returns calls per second."""
+  calls = 0
+  started = time.time()
+  while True:
+    function(argument)
+    calls += 1
+    elapsed = time.time() - started
+    if elapsed >= seconds:
+      return calls / elapsed
+
+
+if __name__ == '__main__':
+  seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+  bencode = entangled.kademlia.encoding.Bencode()
+  binary = binaryencoding.BinaryEncoding()
+  for k, ipv6 in ((8, False), (20, False), (8, True), (20, True)):
+    result = triples(k, ipv6)
+    encodings = [
+      ('bencode', bencode.encode([list(triple) for triple in result]),
+          bencode.decode),
+      ('bencode+pickle', bencode.encode(pickle.dumps(result)),
+          lambda data: pickle.loads(bencode.decode(data))),
+      ('binary, per triple', binary.encode(tuple(result)), binary.decode),
+      ('binary, packed', binary.encode(result), binary.decode),
+    ]
+    print('k = %d, %s:' % (k, 'IPv6' if ipv6 else 'IPv4'))
+    for name, data, decode in encodings:
+      rate = throughput(decode, data, seconds)
+      print('  %-20s %5d bytes  decode %7.2fus' % (name, len(data), 1e6 / rate))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Measures findValue of a large value between two local nodes over a lossy
+link, with and without selective retransmission of lost packets.
+
+Usage: python benchmarks/bench_retransmit.py [ROUNDS] [LOSS] [--retransmit|--no-retransmit]
+
+LOSS is the fraction of the value's packets that is dropped (default 0.05);
+other datagrams always go through. Without a mode flag both modes are run,
+each in its own process since the Twisted reactor can't be restarted.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import entangled.kademlia.contact
+import entangled.kademlia.protocol
+import twisted.internet.defer
+import twisted.internet.reactor
+
+from bench_compression import makeIndex
+from bench_sessions import makeNode
+
+import hashlib
+import random
+import subprocess
+import time
+
+
+def run(rounds, loss, retransmit):
+  reactor = twisted.internet.reactor
+  nodeA = makeNode('bench-a', True)
+  nodeB = makeNode('bench-b', True)
+  for node in (nodeA, nodeB):
+    node._protocol._compression = False
+    node._protocol._selectiveRetransmission = retransmit
+  portA = reactor.listenUDP(0, nodeA._protocol)
+  portB = reactor.listenUDP(0, nodeB._protocol)
+  nodeA.keyCache[nodeB.id] = nodeB.rsaKey.publickey()
+  contact = entangled.kademlia.contact.Contact(
+      nodeB.id, '127.0.0.1', portB.getHost().port, nodeA._protocol)
+  index = makeIndex()
+  key = hashlib.sha1('index').digest()
+  rng = random.Random(1919)
+  result = {'dropped': 0, 'failed': 0, 'times': []}
+  lossy = [False]
+
+  def lossyWrite(protocol):
+    write = protocol._scheduler._write
+    def _write(data, address):
+      if (lossy[0] and data[0] == '\x00' and
+          data[25] == entangled.kademlia.protocol.fragmentData and
+          rng.random() < loss):
+        result['dropped'] += 1
+        return
+      write(data, address)
+    protocol._scheduler._write = _write
+  lossyWrite(nodeA._protocol)
+  lossyWrite(nodeB._protocol)
+
+  @twisted.internet.defer.inlineCallbacks
+  def benchmark():
+    try:
+      yield contact.ping()
+      yield contact.store(key, index, nodeA.id, 0)
+      lossy[0] = True
+      for i in range(rounds):
+        started = time.time()
+        try:
+          found = yield contact.findValue(key)
+        except entangled.kademlia.protocol.TimeoutError:
+          result['failed'] += 1
+        else:
+          if found != {key: index}:
+            raise RuntimeError('findValue returned a different value')
+        result['times'].append(time.time() - started)
+    except Exception, e:
+      result['error'] = str(e)
+    reactor.stop()
+
+  reactor.callWhenRunning(benchmark)
+  reactor.run(installSignalHandlers = False)
+  result['reassembly'] = nodeA._protocol._reassembler.stats()
+  result['retransmit'] = nodeB._protocol._retransmitBuffer.stats()
+  portA.stopListening()
+  portB.stopListening()
+  return result
+
+
+if __name__ == '__main__':
+  args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+  rounds = int(args[0]) if args else 20
+  loss = float(args[1]) if len(args) > 1 else 0.05
+  if '--retransmit' not in sys.argv and '--no-retransmit' not in sys.argv:
+    for mode in ('--no-retransmit', '--retransmit'):
+      subprocess.check_call([sys.executable, os.path.abspath(__file__),
+          str(rounds), str(loss), mode])
+    sys.exit(0)
+  retransmit = '--retransmit' in sys.argv
+  result = run(rounds, loss, retransmit)
+  if 'error' in result:
+    print('RPC failed: %s' % result['error'])
+    sys.exit(1)
+  times = sorted(result['times'])
+  print('%s: %d findValue rounds at %.0f%% packet loss, %d packets dropped, '
+      '%d timed out' % (
+      'retransmission' if retransmit else 'no retransmission', rounds,
+      loss * 100, result['dropped'], result['failed']))
+  print('  completion time: mean %.3fs, median %.3fs, max %.3fs' % (
+      sum(times) / len(times), times[len(times) / 2], times[-1]))
+  reassembly = result['reassembly']
+  print('  receiver: mean reassembly latency %.3fs, drops %s' % (
+      reassembly['meanLatency'], reassembly['drops']))
+  print('  sender: %(retransmitted)d retransmissions, %(acknowledged)d '
+      'acknowledged, %(evicted)d evicted' % result['retransmit'])
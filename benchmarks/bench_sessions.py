@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Measures ping RPCs/sec between two local nodes, with and without sessions.
+
+Usage: python benchmarks/bench_sessions.py [PINGS] [--sessions|--no-sessions]
+
+Without a mode flag both modes are run, each in its own process since the
+Twisted reactor can't be restarted.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import entangled.kademlia.contact
+import twisted.internet.reactor
+
+from node import TintangledNode
+import puzzle
+
+import subprocess
+import time
+
+
+def makeNode(seed, useSessions):
+  solver = puzzle.PuzzleSolver(workers = 1, seed = seed)
+  rsaKey, nodeID = solver.solveStatic()
+  node = TintangledNode(
+      id = nodeID, udpPort = 0, puzzleSolver = solver, useSessions = useSessions)
+  node.rsaKey = rsaKey
+  node.x = solver.solveDynamic(nodeID)
+  node.keyCache[node.id] = rsaKey
+  return node
+
+def run(pings, useSessions):
+  reactor = twisted.internet.reactor
+  nodeA = makeNode('bench-a', useSessions)
+  nodeB = makeNode('bench-b', useSessions)
+  portA = reactor.listenUDP(0, nodeA._protocol)
+  portB = reactor.listenUDP(0, nodeB._protocol)
+  # Let A know B's public key, as it would after a lookup.
+  nodeA.keyCache[nodeB.id] = nodeB.rsaKey.publickey()
+  contact = entangled.kademlia.contact.Contact(
+      nodeB.id, '127.0.0.1', portB.getHost().port, nodeA._protocol)
+  result = {}
+
+  def pingNext(_ = None, remaining = [pings]):
+    if remaining[0] == 0:
+      result['seconds'] = time.time() - result['start']
+      reactor.stop()
+      return
+    remaining[0] -= 1
+    contact.ping().addCallback(pingNext).addErrback(failed)
+
+  def failed(failure):
+    result['error'] = failure.getErrorMessage()
+    reactor.stop()
+
+  def start():
+    result['start'] = time.time()
+    pingNext()
+
+  reactor.callWhenRunning(start)
+  reactor.run(installSignalHandlers = False)
+  result['verifier'] = nodeB._protocol._verifier.stats()
+  result['keyCache'] = nodeB.keyCache.stats()
+  result['idCache'] = nodeB._protocol._verifiedIDs.stats()
+  portA.stopListening()
+  portB.stopListening()
+  return result
+
+
+if __name__ == '__main__':
+  args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+  pings = int(args[0]) if args else 200
+  if '--sessions' not in sys.argv and '--no-sessions' not in sys.argv:
+    for mode in ('--no-sessions', '--sessions'):
+      subprocess.check_call(
+          [sys.executable, os.path.abspath(__file__), str(pings), mode])
+    sys.exit(0)
+  useSessions = '--sessions' in sys.argv
+  result = run(pings, useSessions)
+  if 'error' in result:
+    print('RPC failed: %s' % result['error'])
+    sys.exit(1)
+  print('%s: %d pings in %.2fs -> %.1f RPCs/sec' % (
+      'sessions' if useSessions else 'pure RSA',
+      pings, result['seconds'], pings / result['seconds']))
+  verifierStats = result['verifier']
+  print('  receiver verification: mean wait %.3fms, mean verify %.3fms, '
+        '%d dropped' % (
+            verifierStats['queueWait']['mean'] * 1000,
+            verifierStats['verifyTime']['mean'] * 1000,
+            verifierStats['dropped']))
+  keyStats = result['keyCache']
+  print('  receiver key cache: %d/%d intern hits/misses, %d/%d lookup '
+        'hits/misses' % (
+            keyStats['internHits'], keyStats['internMisses'],
+            keyStats['hits'], keyStats['misses']))
+  idStats = result['idCache']
+  print('  receiver ID cache: %d/%d hits/misses' % (
+      idStats['hits'], idStats['misses']))
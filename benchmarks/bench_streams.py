@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Measures store/findValue of a very large value between two local nodes,
+sent in UDP packets or over a pooled TCP connection.
+
+Usage: python benchmarks/bench_streams.py [ROUNDS] [ENTRIES] [--tcp|--udp]
+
+The value is an Entangled-style inverted index of ENTRIES names (default
+10000, some 500 KB). Without a mode flag both modes are run, each in its own
+process since the Twisted reactor can't be restarted.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import entangled.kademlia.contact
+import twisted.internet.defer
+import twisted.internet.reactor
+
+from bench_compression import makeIndex
+from bench_sessions import makeNode
+
+import hashlib
+import subprocess
+import time
+
+
+def run(rounds, entries, tcp):
+  reactor = twisted.internet.reactor
+  nodeA = makeNode('bench-a', True)
+  nodeB = makeNode('bench-b', True)
+  for node in (nodeA, nodeB):
+    node._protocol._compression = False
+    if not tcp:
+      node._protocol._streams = None
+  portA = reactor.listenUDP(0, nodeA._protocol)
+  portB = reactor.listenUDP(0, nodeB._protocol)
+  nodeA.keyCache[nodeB.id] = nodeB.rsaKey.publickey()
+  contact = entangled.kademlia.contact.Contact(
+      nodeB.id, '127.0.0.1', portB.getHost().port, nodeA._protocol)
+  index = makeIndex(entries)
+  key = hashlib.sha1('index').digest()
+  result = {}
+
+  @twisted.internet.defer.inlineCallbacks
+  def benchmark():
+    try:
+      yield contact.ping()
+      started = time.time()
+      for i in range(rounds):
+        yield contact.store(key, index, nodeA.id, 0)
+        found = yield contact.findValue(key)
+        if found != {key: index}:
+          raise RuntimeError('findValue returned a different value')
+      result['seconds'] = time.time() - started
+    except Exception, e:
+      result['error'] = str(e)
+    reactor.stop()
+
+  reactor.callWhenRunning(benchmark)
+  reactor.run(installSignalHandlers = False)
+  if tcp:
+    result['streams'] = nodeA._protocol._streams.stats()
+  result['size'] = len(nodeA._protocol._encoder.encode(index))
+  portA.stopListening()
+  portB.stopListening()
+  return result
+
+
+if __name__ == '__main__':
+  args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+  rounds = int(args[0]) if args else 20
+  entries = int(args[1]) if len(args) > 1 else 10000
+  if '--tcp' not in sys.argv and '--udp' not in sys.argv:
+    for mode in ('--udp', '--tcp'):
+      subprocess.check_call([sys.executable, os.path.abspath(__file__),
+          str(rounds), str(entries), mode])
+    sys.exit(0)
+  tcp = '--tcp' in sys.argv
+  result = run(rounds, entries, tcp)
+  if 'error' in result:
+    print('RPC failed: %s' % result['error'])
+    sys.exit(1)
+  print('%s: %d store+findValue rounds of a %d byte value in %.2fs '
+      '(%.1fms per round)' % (
+      'TCP' if tcp else 'UDP', rounds, result['size'], result['seconds'],
+      result['seconds'] * 1000 / rounds))
+  if tcp:
+    print('  node A: %(opened)d connections opened, %(accepted)d accepted, '
+        '%(messagesSent)d messages sent, %(messagesReceived)d received' %
+        result['streams'])
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Compact, typed binary encoding of message primitives.
+
+Every encoded value starts with a version byte, followed by the value itself.
+Values are a one-byte type tag and a fixed or length-prefixed body:
+
+  N, T, F     None, True, False
+  i           signed 64-bit integer
+  L           any other integer: sign byte, 2-byte length, big-endian magnitude
+  f           IEEE 754 double
+  h           20-byte string (node IDs, keys, hashes), no length
+  s, S        string with a 1-byte, resp. 4-byte length
+  u           unicode string, UTF-8 encoded with a 4-byte length
+  c, v        contact triple with an IPv4, resp. IPv6 address, packed as in
+              nodeinfo
+  C, V        list of such triples: 4-byte count, then the packed triples
+  l, t        list, tuple: 4-byte item count, then the items
+  d           dictionary: 4-byte item count, then keys and values alternately
+"""
+
+from entangled.kademlia.encoding import Encoding, DecodeError
+import nodeinfo
+import util
+
+import struct
+
+VERSION = 1
+
+_int64 = struct.Struct('!q')
+_double = struct.Struct('!d')
+_count = struct.Struct('!I')
+_shortCount = struct.Struct('!H')
+
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+# Tags of the containers, and how many values follow per item
+_containers = {'l': 1, 't': 1, 'd': 2}
+
+# Tags of single and listed contact triples, per address family
+_tripleTags = {nodeinfo.IPV4: 'c', nodeinfo.IPV6: 'v'}
+_tripleListTags = {nodeinfo.IPV4: 'C', nodeinfo.IPV6: 'V'}
+_tripleFamilies = {'c': nodeinfo.IPV4, 'v': nodeinfo.IPV6,
+    'C': nodeinfo.IPV4, 'V': nodeinfo.IPV6}
+
+
+class BinaryEncoding(Encoding):
+  '''Encodes primitives in the compact binary format described above.
+
+  Like Bencode, both directions work on an explicit stack rather than
+  recursing.
+  '''
+
+  def encode(self, data):
+    chunks = [chr(VERSION)]
+    append = chunks.append
+    stack = [data]
+    pop = stack.pop
+    push = stack.append
+    while stack:
+      item = pop()
+      itemType = type(item)
+      if itemType == str:
+        length = len(item)
+        if length == 20:
+          append('h')
+        elif length < 256:
+          append('s' + chr(length))
+        else:
+          append('S' + _count.pack(length))
+        append(item)
+      elif itemType in (int, long):
+        if _INT64_MIN <= item <= _INT64_MAX:
+          append('i' + _int64.pack(item))
+        else:
+          magnitude = util.int2bytes(abs(item))
+          if len(magnitude) > 0xffff:
+            raise TypeError, 'Integer too large to encode'
+          append('L%s%s%s' % ('-' if item < 0 else '+',
+              _shortCount.pack(len(magnitude)), magnitude))
+      elif itemType == tuple and nodeinfo.tripleFamily(item) is not None:
+        family = nodeinfo.tripleFamily(item)
+        append(_tripleTags[family] + nodeinfo.pack([item], family))
+      elif itemType == list and nodeinfo.listFamily(item) is not None:
+        family = nodeinfo.listFamily(item)
+        append(_tripleListTags[family] + _count.pack(len(item)))
+        append(nodeinfo.pack(item, family))
+      elif itemType in (list, tuple):
+        append(('l' if itemType == list else 't') + _count.pack(len(item)))
+        stack.extend(item[::-1])
+      elif itemType == dict:
+        append('d' + _count.pack(len(item)))
+        for key, value in item.iteritems():
+          push(value)
+          push(key)
+      elif item is None:
+        append('N')
+      elif itemType == bool:
+        append('T' if item else 'F')
+      elif itemType == float:
+        append('f' + _double.pack(item))
+      elif itemType == unicode:
+        encoded = item.encode('utf-8')
+        append('u' + _count.pack(len(encoded)))
+        append(encoded)
+      else:
+        raise TypeError, "Cannot encode '%s' object" % itemType
+    return ''.join(chunks)
+
+  def decode(self, data):
+    if len(data) == 0:
+      raise DecodeError, 'Cannot decode empty string'
+    if ord(data[0]) != VERSION:
+      raise DecodeError, 'Unsupported format version %d' % ord(data[0])
+    try:
+      return self._decode(data, 1)[0]
+    except (IndexError, ValueError, TypeError, struct.error), e:
+      raise DecodeError, e
+
+  @staticmethod
+  def _decode(data, index):
+    """Returns the value encoded at index, and the index following it."""
+    # Open containers, as [tag, items, number of values still missing]
+    stack = []
+    while True:
+      tag = data[index]
+      index += 1
+      if tag == 'h':
+        value = data[index:index + 20]
+        index += 20
+      elif tag == 's' or tag == 'S' or tag == 'u':
+        if tag == 's':
+          length = ord(data[index])
+          index += 1
+        else:
+          length = _count.unpack_from(data, index)[0]
+          index += 4
+        value = data[index:index + length]
+        index += length
+        if tag == 'u':
+          value = value.decode('utf-8')
+      elif tag == 'i':
+        value = _int64.unpack_from(data, index)[0]
+        index += 8
+      elif tag in _tripleFamilies:
+        family = _tripleFamilies[tag]
+        if tag == 'c' or tag == 'v':
+          value = nodeinfo.unpack(data, family, 1, index)[0]
+          index += nodeinfo.recordSize[family]
+        else:
+          count = _count.unpack_from(data, index)[0]
+          index += 4
+          if index + count * nodeinfo.recordSize[family] > len(data):
+            raise DecodeError, 'Truncated data'
+          value = nodeinfo.unpack(data, family, count, index)
+          index += count * nodeinfo.recordSize[family]
+      elif tag in _containers:
+        missing = _count.unpack_from(data, index)[0] * _containers[tag]
+        index += 4
+        if missing:
+          stack.append([tag, [], missing])
+          continue
+        value = {'l': [], 't': (), 'd': {}}[tag]
+      elif tag == 'N':
+        value = None
+      elif tag == 'T' or tag == 'F':
+        value = tag == 'T'
+      elif tag == 'L':
+        sign = data[index]
+        length = _shortCount.unpack_from(data, index + 1)[0]
+        index += 3
+        value = long(data[index:index + length].encode('hex'), 16)
+        if sign == '-':
+          value = -value
+        index += length
+      elif tag == 'f':
+        value = _double.unpack_from(data, index)[0]
+        index += 8
+      else:
+        raise DecodeError, 'Unknown type tag %r at %d' % (tag, index - 1)
+      if index > len(data):
+        raise DecodeError, 'Truncated data'
+      # Complete every container this value was the last one missing in.
+      while True:
+        if not stack:
+          return (value, index)
+        frame = stack[-1]
+        frame[1].append(value)
+        frame[2] -= 1
+        if frame[2]:
+          break
+        stack.pop()
+        tag, items = frame[:2]
+        if tag == 'l':
+          value = items
+        elif tag == 't':
+          value = tuple(items)
+        else:
+          value = dict(zip(items[::2], items[1::2]))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""zlib compression of large message payloads."""
+
+from entangled.kademlia.encoding import DecodeError
+
+import constants
+
+import time
+import zlib
+
+
+class CompressionCounter(object):
+  """Compression figures of one message type."""
+
+  def __init__(self):
+    self.messages = 0
+    self.compressed = 0
+    self.bytesIn = 0
+    self.bytesOut = 0
+    self.compressSeconds = 0.0
+    self.decompressed = 0
+    self.decompressSeconds = 0.0
+
+  def ratio(self):
+    """Returns compressed / original size of the compressed payloads."""
+    return (float(self.bytesOut) / self.bytesIn) if self.bytesIn else 1.0
+
+  def summary(self):
+    return {
+      'messages': self.messages,
+      'compressed': self.compressed,
+      'ratio': self.ratio(),
+      'compressSeconds': self.compressSeconds,
+      'decompressed': self.decompressed,
+      'decompressSeconds': self.decompressSeconds,
+    }
+
+
+class Compressor(object):
+  '''Compresses payloads of at least threshold bytes, if that shrinks them.
+
+  Keeps a CompressionCounter per message type; the type of a request is its
+  method name, others are 'response' or 'error'. Types not among kinds share
+  the counter 'other', as the method names of incoming requests are up to
+  their senders.
+  '''
+
+  def __init__(
+      self,
+      threshold = constants.COMPRESSION_THRESHOLD,
+      level = constants.COMPRESSION_LEVEL,
+      maxSize = constants.COMPRESSION_MAX_SIZE,
+      kinds = constants.COMPRESSION_KINDS):
+    self.threshold = threshold
+    self.level = level
+    self.maxSize = maxSize
+    self.kinds = frozenset(kinds)
+    self.counters = {}
+
+  def _counter(self, kind):
+    if type(kind) != str or kind not in self.kinds:
+      kind = 'other'
+    if kind not in self.counters:
+      self.counters[kind] = CompressionCounter()
+    return self.counters[kind]
+
+  def compress(self, kind, data):
+    """Returns data compressed, or None if it isn't worth it."""
+    counter = self._counter(kind)
+    counter.messages += 1
+    if len(data) < self.threshold:
+      return None
+    started = time.time()
+    compressed = zlib.compress(data, self.level)
+    counter.compressSeconds += time.time() - started
+    if len(compressed) >= len(data):
+      return None
+    counter.compressed += 1
+    counter.bytesIn += len(data)
+    counter.bytesOut += len(compressed)
+    return compressed
+
+  def decompress(self, kind, data):
+    """Reverses compress(), refusing to inflate beyond maxSize."""
+    started = time.time()
+    decompressor = zlib.decompressobj()
+    try:
+      result = decompressor.decompress(data, self.maxSize)
+    except zlib.error, e:
+      raise DecodeError, e
+    if decompressor.unconsumed_tail:
+      raise DecodeError, 'Decompressed payload exceeds %d bytes' % self.maxSize
+    counter = self._counter(kind)
+    counter.decompressed += 1
+    counter.decompressSeconds += time.time() - started
+    return result
+
+  def stats(self):
+    """Returns the counters' summaries by message type."""
+    return dict([(kind, counter.summary())
+        for kind, counter in self.counters.items()])
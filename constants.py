@@ -22,3 +22,65 @@ CRYPTO_CHALLENGE_C2 = 4
 # from s/kademlia: valid sender addresses are only added to a bucket if
 # the nodeId prefix differs in an appropriate amount of bits x (for example x > 32).
 NODE_ID_PREFIX_DIFFERS_BITS = 33
+
+# Number of processes used to solve the crypto puzzles (None -> one per CPU).
+PUZZLE_WORKERS = None
+
+# Session keys replace per-message RSA signatures after the first handshake.
+USE_SESSIONS = True
+SESSION_KEY_LENGTH = SYMMETRIC_KEY_LENGTH
+SESSION_LIFETIME = 600 # (seconds) before a session is renegotiated
+SESSION_GRACE = rpcTimeout # (seconds) MACs are still accepted after expiry
+
+# Incoming messages are verified on this many threads (0 -> on the reactor).
+VERIFY_THREADS = 2
+# Messages waiting for verification beyond this are dropped.
+VERIFY_QUEUE_DEPTH = 1000
+
+# Messages kept per sender while its public key is fetched with getPublicKey.
+MAX_AWAITING_KEY = 16
+
+# Public keys kept in a node's key cache, and parsed keys interned on receipt.
+KEY_CACHE_SIZE = 4096
+# Nodes remembered as holding our public key, so they only get its fingerprint.
+KEY_HOLDERS_SIZE = 4096
+
+# Only accept messages whose key fingerprint is the sender's node ID, so that
+# nobody can pass off an ID with a key of their own. Only test networks whose
+# nodes share one key (see identitypool.SharedIdentities) turn this off.
+BIND_KEY_TO_ID = True
+
+# (node ID, X) pairs remembered as solving, resp. failing, the crypto puzzles.
+VERIFIED_ID_CACHE_SIZE = 4096
+REJECTED_ID_CACHE_SIZE = 1024
+
+# Sign the encoded message bytes rather than a stringified message. Nodes
+# accept messages signed either way, but nodes that predate canonical signing
+# can't parse the envelope it sends; only turn it on in networks where every
+# node accepts it.
+CANONICAL_SIGNING = False
+
+# Encode messages with binaryencoding instead of Bencode-wrapped pickles. This
+# changes the wire format, and nodes using one format can't parse the other:
+# only turn it on in networks where every node does.
+BINARY_MESSAGES = False
+
+# Payloads of at least COMPRESSION_THRESHOLD bytes are zlib-compressed when
+# the receiving peer has said it accepts that.
+COMPRESSION = True
+COMPRESSION_THRESHOLD = 1024 # (bytes)
+COMPRESSION_LEVEL = 6
+# Compressed payloads inflating beyond this are rejected.
+COMPRESSION_MAX_SIZE = 4 * 1024 * 1024 # (bytes)
+# Message types with compression counters of their own; the rest share one.
+COMPRESSION_KINDS = (
+    'ping', 'store', 'findNode', 'findValue', 'getPublicKey', 'response')
+# Nodes remembered as accepting compressed payloads.
+COMPRESSION_PEERS_SIZE = 4096
+
+# Defaults of the simulated network (see simulation.py): datagrams take
+# SIMULATION_LATENCY plus up to SIMULATION_JITTER seconds, and a fraction
+# SIMULATION_LOSS of them is lost.
+SIMULATION_LATENCY = 0.05 # (seconds)
+SIMULATION_JITTER = 0.02 # (seconds)
+SIMULATION_LOSS = 0.0
@@ -7,14 +7,14 @@ import time
 import signal
 
 
-def forNodes(nodes, func, i = 0):
+def forNodes(nodes, func, i = 0, delay = 0.15):
   for node in nodes:
     hashAmount = ((i * 50) / amount)
     hashbar = ('#' * hashAmount)
     output = '\r[%-50s] %d/%d' % (hashbar, i, amount)
     sys.stdout.write(output)
     func(node, i)
-    time.sleep(0.15)
+    time.sleep(delay)
     i += 1
 
 def destroyNetwork(nodes):
@@ -25,13 +25,21 @@ def destroyNetwork(nodes):
   print
 
 if __name__ == '__main__':
+  # Nodes claim pre-solved identities from this keystore (see mint_identities.py)
+  keystoreArgs = []
+  for arg in sys.argv[1:]:
+    if arg.startswith('--keystore='):
+      keystoreArgs = [arg]
+      sys.argv.remove(arg)
   if len(sys.argv) < 2:
-    print 'Usage:\n%s AMOUNT_OF_NODES [NIC_IP_ADDRESS]' % sys.argv[0]
+    print 'Usage:\n%s AMOUNT_OF_NODES [NIC_IP_ADDRESS] [SCENARIO_FILE] [--keystore=FILE]' % sys.argv[0]
     print '\nNIC_IP_ADDRESS should be the IP address of the network interface through'
     print 'which other systems will access these nodes.\n'
     print 'If omitted, the script will attempt to determine the system\'s IP address'
     print 'automatically, but do note that this may result in 127.0.0.1 being used (i.e.'
     print 'the nodes will only be reachable from this system).\n'
+    print 'With --keystore, nodes skip the crypto puzzles and claim identities'
+    print 'minted beforehand by mint_identities.py.\n'
     sys.exit(1)
   amount = int(sys.argv[1])
   if len(sys.argv) >= 3:
@@ -49,28 +57,32 @@ if __name__ == '__main__':
   startPort = 4000
   port = (startPort + 1)
   nodes = []
+  if keystoreArgs:
+    # Identities are pre-solved, so nodes are up almost immediately.
+    bootstrapDelay, spawnDelay = 0.2, 0.01
+  else:
+    bootstrapDelay, spawnDelay = 1.0, 0.15
   print 'Creating Kademlia network...'
   try:
-    nodes.append(os.spawnlp(
+    nodes.append(os.spawnvp(
         os.P_NOWAIT,
         'python',
-        'python',
-        './tinfoil.py',
-        str(startPort)))
+        ['python', './tinfoil.py', str(startPort)] + keystoreArgs))
     # Crypto ID need time to generate..
-    time.sleep(1.0)
+    time.sleep(bootstrapDelay)
     forNodes(
         # we're cheating a bit - it's actually a port range
         range(port, (port + (amount - 1))),
         (lambda port, i:
-            nodes.append(os.spawnlp(
+            nodes.append(os.spawnvp(
                 os.P_NOWAIT,
                 'python',
-                'python',
-                './tinfoil.py',
-                str(port), # the node var contains the port number ..
-                ipAddress,
-                str(startPort)))))
+                ['python',
+                 './tinfoil.py',
+                 str(port), # the node var contains the port number ..
+                 ipAddress,
+                 str(startPort)] + keystoreArgs))),
+        delay = spawnDelay)
   except KeyboardInterrupt:
     '\nNetwork creation cancelled.'
     destroyNetwork(nodes)
@@ -38,11 +38,11 @@ class EntangledViewer(gtk.DrawingArea):
         self.msgCounter = 0
         self.printMsgCount = False
         
-    def __guiSendRPC(self, contact, method, args, rawResponse=False):
+    def __guiSendRPC(self, contact, method, args, **kwargs):
         #print 'sending'
         self.drawComms(contact.id, method)
         self.msgCounter += 1
-        return self.node._protocol.__realSendRPC(contact, method, args, rawResponse)
+        return self.node._protocol.__realSendRPC(contact, method, args, **kwargs)
     
     def __guiDatagramReceived(self, datagram, address):
         msgPrimitive = self.node._protocol._encoder.decode(datagram)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+#
+# The docstrings in this module contain epytext markup; API documentation
+# may be created by processing this file with epydoc: http://epydoc.sf.net
+
+from collections import deque, OrderedDict
+
+import twisted.internet.reactor
+from twisted.python import failure
+
+import constants
+
+# Priority classes of RPCs, in the order their queues are served: lookups and
+# stores the application asked for, then the node's own upkeep (k-bucket
+# refreshes, republishing)
+(
+    priorityLookup,
+    priorityMaintenance
+) = range(2)
+
+class RPCLimiter(object):
+    """ Bounds the number of RPCs in flight, in total and to each contact
+
+    RPCs beyond either bound wait in the queue of their priority class, and
+    are sent as RPCs in flight complete; the queue of a higher class is
+    always served first. Within a class, the contacts with waiting RPCs take
+    turns - one RPC each - so that a contact with a long backlog doesn't hold
+    up the RPCs to others.
+    """
+    def __init__(self, maxInFlight=constants.rpcMaxInFlight,
+                 maxInFlightPerContact=constants.rpcMaxInFlightPerContact,
+                 clock=twisted.internet.reactor):
+        """
+        @param maxInFlight: The number of RPCs in flight, over all contacts
+        @type maxInFlight: int
+        @param maxInFlightPerContact: The number of RPCs in flight to one
+                                      contact
+        @type maxInFlightPerContact: int
+        @param clock: Provides the time
+        @type clock: twisted.internet.interfaces.IReactorTime
+        """
+        self.maxInFlight = maxInFlight
+        self.maxInFlightPerContact = maxInFlightPerContact
+        self._clock = clock
+        # One per priority class: contact ID -> deque of (send, deferred,
+        # time queued), contacts in the order they take their turns
+        self._queues = (OrderedDict(), OrderedDict())
+        # Contact ID -> RPCs in flight
+        self._inFlightPerContact = {}
+        self.inFlight = 0
+        self.queued = 0
+        self.sent = 0
+        # Per priority class: RPCs that had to wait, their total and longest
+        # wait
+        self.waited = [0, 0]
+        self.totalWait = [0.0, 0.0]
+        self.maxWait = [0.0, 0.0]
+
+    def submit(self, contactID, send, df, priority=priorityLookup):
+        """ Sends an RPC now, or queues it until the bounds allow
+
+        Every RPC that was sent must be L{release}d once it completed.
+
+        @param contactID: The ID of the contact the RPC goes to
+        @type contactID: str
+        @param send: Sends the RPC; if it raises an exception, that is
+                     raised here, or for a queued RPC, passed to C{df}
+        @type send: callable
+        @param df: The deferred for the RPC's result
+        @type df: twisted.internet.defer.Deferred
+        @param priority: C{priorityLookup} or C{priorityMaintenance}
+        @type priority: int
+        """
+        if self._admissible(contactID):
+            self._send(contactID, send)
+            return
+        queue = self._queues[priority]
+        if contactID not in queue:
+            queue[contactID] = deque()
+        queue[contactID].append((send, df, self._clock.seconds()))
+        self.queued += 1
+
+    def release(self, contactID):
+        """ Frees the place of a completed RPC, and sends waiting RPCs """
+        inFlight = self._inFlightPerContact[contactID] - 1
+        if inFlight:
+            self._inFlightPerContact[contactID] = inFlight
+        else:
+            del self._inFlightPerContact[contactID]
+        self.inFlight -= 1
+        self._dispatch()
+
+    def failQueued(self, reason):
+        """ Fails every waiting RPC, e.g. when the node leaves the network
+
+        @param reason: The failure passed to the RPCs' deferreds
+        @type reason: twisted.python.failure.Failure
+        """
+        queues, self._queues = self._queues, (OrderedDict(), OrderedDict())
+        self.queued = 0
+        for queue in queues:
+            for waiting in queue.itervalues():
+                for send, df, queuedAt in waiting:
+                    df.errback(reason)
+
+    def stats(self):
+        """ Returns the RPCs in flight and waiting, and the wait times per
+        priority class
+
+        @rtype: dict
+        """
+        return {'inFlight': self.inFlight,
+                'queued': self.queued,
+                'sent': self.sent,
+                'waited': list(self.waited),
+                'meanWait': [(total / count) if count else 0.0
+                             for total, count in zip(self.totalWait, self.waited)],
+                'maxWait': list(self.maxWait)}
+
+    def _admissible(self, contactID):
+        return (self.inFlight < self.maxInFlight and
+                self._inFlightPerContact.get(contactID, 0) < self.maxInFlightPerContact)
+
+    def _send(self, contactID, send):
+        self.inFlight += 1
+        self._inFlightPerContact[contactID] = self._inFlightPerContact.get(contactID, 0) + 1
+        self.sent += 1
+        try:
+            send()
+        except Exception:
+            self.release(contactID)
+            raise
+
+    def _dispatch(self):
+        now = self._clock.seconds()
+        while self.queued and self.inFlight < self.maxInFlight:
+            entry = self._next()
+            if entry is None:
+                # Only contacts already at their bound have RPCs waiting
+                return
+            priority, contactID, (send, df, queuedAt) = entry
+            self.queued -= 1
+            wait = now - queuedAt
+            self.waited[priority] += 1
+            self.totalWait[priority] += wait
+            if wait > self.maxWait[priority]:
+                self.maxWait[priority] = wait
+            try:
+                self._send(contactID, send)
+            except Exception:
+                df.errback(failure.Failure())
+
+    def _next(self):
+        """ Takes the next RPC to send off the queues
+
+        @return: The RPC's priority, contact ID and queue entry, or C{None}
+        """
+        for priority, queue in enumerate(self._queues):
+            for contactID in queue:
+                if self._inFlightPerContact.get(contactID, 0) < self.maxInFlightPerContact:
+                    waiting = queue.pop(contactID)
+                    entry = waiting.popleft()
+                    if waiting:
+                        # To the back of the line
+                        queue[contactID] = waiting
+                    return priority, contactID, entry
+        return None
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+#
+# The docstrings in this module contain epytext markup; API documentation
+# may be created by processing this file with epydoc: http://epydoc.sf.net
+
+""" Batching of small messages to the same node into one UDP datagram
+
+An envelope has the same header as the packets of a multi-packet
+transmission (see C{KademliaProtocol._send}), with the number of messages
+in the place of the total number of packets, an all-zero RPC ID and a
+header end indicator of 0x03. The messages follow, each prefixed with its
+2-byte length.
+"""
+
+import struct
+
+import twisted.internet.reactor
+
+import constants
+
+#: The header end indicator of envelopes
+envelopeIndicator = '\x03'
+headerSize = 26
+
+def pack(messages):
+    """ Returns an envelope holding the specified messages """
+    chunks = ['\x00%s\x00\x00%s%s' % (struct.pack('!H', len(messages)), '\x00' * 20, envelopeIndicator)]
+    for message in messages:
+        chunks.append(struct.pack('!H', len(message)))
+        chunks.append(message)
+    return ''.join(chunks)
+
+def unpack(envelope):
+    """ Returns the messages in an envelope; a truncated envelope yields the
+    messages that are complete """
+    count = struct.unpack('!H', envelope[1:3])[0]
+    messages = []
+    index = headerSize
+    while len(messages) < count and index + 2 <= len(envelope):
+        length = struct.unpack('!H', envelope[index:index+2])[0]
+        index += 2
+        if index + length > len(envelope):
+            break
+        messages.append(envelope[index:index+length])
+        index += length
+    return messages
+
+
+class Coalescer(object):
+    """ Holds small messages back for a short while, and sends those to the
+    same address in one envelope
+
+    A single timer flushes all held messages C{window} seconds after the
+    first of them came in. A message that doesn't fit into the envelope for
+    its address any more flushes it right away.
+    """
+    def __init__(self, send, window=constants.coalesceWindow,
+                 maxSize=constants.udpDatagramMaxSize,
+                 clock=twisted.internet.reactor):
+        """
+        @param send: Called with the datagram, address and priority to send
+                     an envelope (or a lone message)
+        @type send: callable
+        @param window: How long messages are held back (in seconds)
+        @type window: float
+        @param maxSize: The size limit of envelopes (in bytes)
+        @type maxSize: int
+        @param clock: Provides the time, and schedules the timer
+        @type clock: twisted.internet.interfaces.IReactorTime
+        """
+        self._send = send
+        self.window = window
+        self.maxSize = maxSize
+        self._clock = clock
+        # Address -> [messages, envelope size, priority, times held since]
+        self._pending = {}
+        self._timer = None
+        self.messages = 0
+        self.sent = 0
+        self.datagrams = 0
+        self.envelopes = 0
+        self.totalDelay = 0.0
+        self.maxDelay = 0.0
+
+    def add(self, data, address, priority):
+        """ Queues a message to be sent to the specified address """
+        now = self._clock.seconds()
+        self.messages += 1
+        batch = self._pending.get(address)
+        if batch is not None and batch[1] + 2 + len(data) > self.maxSize:
+            self._flush(address, now)
+            batch = None
+        if batch is None:
+            batch = self._pending[address] = [[], headerSize, priority, []]
+        batch[0].append(data)
+        batch[1] += 2 + len(data)
+        batch[2] = min(batch[2], priority)
+        batch[3].append(now)
+        if self._timer is None:
+            self._timer = self._clock.callLater(self.window, self.flush)
+
+    def flush(self):
+        """ Sends all held messages """
+        self._timer = None
+        now = self._clock.seconds()
+        for address in self._pending.keys():
+            self._flush(address, now)
+
+    def stop(self):
+        """ Drops all held messages, and cancels the timer """
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+        self._timer = None
+        self._pending = {}
+
+    def stats(self):
+        """ Returns the datagrams saved, and the delay added to messages
+
+        @rtype: dict
+        """
+        return {'messages': self.messages,
+                'datagrams': self.datagrams,
+                'envelopes': self.envelopes,
+                'saved': self.sent - self.datagrams,
+                'meanDelay': (self.totalDelay / self.sent) if self.sent else 0.0,
+                'maxDelay': self.maxDelay}
+
+    def _flush(self, address, now):
+        messages, size, priority, times = self._pending.pop(address)
+        for held in times:
+            delay = now - held
+            self.totalDelay += delay
+            if delay > self.maxDelay:
+                self.maxDelay = delay
+        self.sent += len(messages)
+        self.datagrams += 1
+        if len(messages) == 1:
+            self._send(messages[0], address, priority)
+        else:
+            self.envelopes += 1
+            self._send(pack(messages), address, priority)
@@ -44,3 +44,80 @@ checkRefreshInterval = refreshTimeout/5
 #: Max size of a single UDP datagram, in bytes. If a message is larger than this, it will
 #: be spread accross several UDP packets.
 udpDatagramMaxSize = 8192 # 8 KB
+
+#: Pacing of outgoing UDP packets: the rate and burst size of the token bucket
+#: in packets (see kademlia.scheduler)
+sendPacketsPerSecond = 1000
+sendPacketBurst = 32
+#: ...and in bytes; a rate of None doesn't limit the bandwidth
+sendBytesPerSecond = 10 * 1024 * 1024 # 10 MB/s
+sendByteBurst = 256 * 1024 # 256 KB
+
+#: Memory caps for reassembling messages spread across several UDP packets, in
+#: bytes: over all incomplete messages, and over those from one host
+reassemblyMaxBytes = 64 * 1024 * 1024 # 64 MB
+reassemblyMaxBytesPerPeer = 8 * 1024 * 1024 # 8 MB
+#: Incomplete messages that received no new packet for this long are dropped (in seconds)
+reassemblyTimeout = rpcTimeout
+
+#: Whether multi-packet messages are acknowledged, and their lost packets sent
+#: again (see KademliaProtocol._send)
+selectiveRetransmission = True
+#: The receiver reports missing packets once none arrived for this long (in
+#: seconds)...
+fragmentNackDelay = 0.25
+#: ...up to this many times per message
+fragmentMaxNacks = 4
+#: The sender keeps multi-packet messages around this long (in seconds), using
+#: no more than this many bytes
+retransmitBufferTimeout = rpcTimeout
+retransmitBufferMaxBytes = 16 * 1024 * 1024 # 16 MB
+
+#: Whether nodes accept TCP connections, and send large messages over them
+#: (see kademlia.stream)
+streamTransport = True
+#: Messages larger than this are sent over a pooled TCP connection instead of
+#: several UDP packets, if the receiver accepts TCP connections (in bytes)
+streamThreshold = 64 * 1024 # 64 KB
+#: The largest message accepted over TCP (in bytes)
+streamMaxMessageSize = 4 * 1024 * 1024 # 4 MB
+#: The number of TCP connections kept open, in total and per node
+streamMaxConnections = 256
+streamMaxConnectionsPerPeer = 2
+#: TCP connections are closed after being idle for this long (in seconds)
+streamIdleTimeout = 60
+#: A node that couldn't be connected to over TCP is left alone this long (in seconds)
+streamRetryInterval = 300
+#: A connection is closed if the node doesn't complete the handshake (see
+#: kademlia.stream) within this long (in seconds)
+streamHandshakeTimeout = 2
+
+#: Whether small messages to the same node are held back for a moment, and
+#: sent together in one UDP datagram (see kademlia.coalesce)
+coalesceMessages = True
+#: How long messages are held back (in seconds); 0 batches the messages sent
+#: during the same reactor iteration, without delaying them any further
+coalesceWindow = 0
+#: Messages larger than this are never held back (in bytes)
+coalesceMaxMessageSize = 2048
+#: The number of nodes remembered as accepting message envelopes
+coalesceMaxPeers = 4096
+
+#: RPC timeouts adapt to each contact's measured round-trip time (see
+#: kademlia.rtt), between this and rpcTimeout (in seconds); contacts that
+#: haven't responded yet get rpcTimeout
+rpcTimeoutMin = 0.5
+#: The number of contacts whose round-trip times are remembered
+rttMaxContacts = 4096
+#: Iterative lookups move on to further contacts once their active probes
+#: took longer than expected from the round-trip times, but not sooner than
+#: this (in seconds), and no later than iterativeLookupDelay
+iterativeLookupDelayMin = 0.05
+#: RPC timeouts are kept on a timer wheel (see kademlia.timerwheel), which
+#: expires them in batches at this granularity (in seconds)
+rpcTimerResolution = 0.01
+#: RPCs beyond these many in flight wait until earlier ones complete (see
+#: kademlia.admission); lookups the user asked for go ahead of maintenance
+rpcMaxInFlight = 64
+#: ...and RPCs beyond these many in flight to the same contact
+rpcMaxInFlightPerContact = 4
@@ -40,10 +40,17 @@ class Encoding(object):
         @return: The decoded data (in its correct type)
         """
 
+# Marks the end of a list or dictionary on the encoder's stack
+_END = object()
+
 class Bencode(Encoding):
     """ Implementation of a Bencode-based algorithm (Bencode is the encoding
     algorithm used by Bittorrent).
     
+    Both directions work iteratively on an explicit stack, so neither the
+    nesting depth nor the size of the data make them recurse or copy the
+    input over and over.
+    
     @note: This algorithm differs from the "official" Bencode algorithm in
            that it can encode/decode floating point values in addition to
            integers.
@@ -58,31 +65,42 @@ class Bencode(Encoding):
         @return: The encoded data
         @rtype: str
         """
-        if type(data) in (int, long):
-            return 'i%de' % data
-        elif type(data) == str:
-            return '%d:%s' % (len(data), data)
-        elif type(data) in (list, tuple):
-            encodedListItems = ''
-            for item in data:
-                encodedListItems += self.encode(item)
-            return 'l%se' % encodedListItems
-        elif type(data) == dict:
-            encodedDictItems = ''
-            keys = data.keys()
-            keys.sort()
-            for key in keys:
-                encodedDictItems += self.encode(key)
-                encodedDictItems += self.encode(data[key])
-            return 'd%se' % encodedDictItems
-        elif type(data) == float:
-            # This (float data type) is a non-standard extension to the original Bencode algorithm 
-            return 'f%fe' % data
-        elif data == None:
-            # This (None/NULL data type) is a non-standard extension to the original Bencode algorithm 
-            return 'n'
-        else:
-            raise TypeError, "Cannot bencode '%s' object" % type(data)
+        chunks = []
+        append = chunks.append
+        stack = [data]
+        pop = stack.pop
+        push = stack.append
+        while stack:
+            item = pop()
+            itemType = type(item)
+            if itemType is str:
+                append('%d:' % len(item))
+                append(item)
+            elif itemType is int or itemType is long:
+                append('i%de' % item)
+            elif item is _END:
+                append('e')
+            elif itemType is list or itemType is tuple:
+                append('l')
+                push(_END)
+                stack.extend(item[::-1])
+            elif itemType is dict:
+                append('d')
+                push(_END)
+                keys = item.keys()
+                keys.sort(reverse=True)
+                for key in keys:
+                    push(item[key])
+                    push(key)
+            elif itemType is float:
+                # This (float data type) is a non-standard extension to the original Bencode algorithm 
+                append('f%fe' % item)
+            elif item == None:
+                # This (None/NULL data type) is a non-standard extension to the original Bencode algorithm 
+                append('n')
+            else:
+                raise TypeError, "Cannot bencode '%s' object" % itemType
+        return ''.join(chunks)
     
     def decode(self, data):
         """ Decoder implementation of the Bencode algorithm 
@@ -90,54 +108,71 @@ class Bencode(Encoding):
         @param data: The encoded data
         @type data: str
         
-        @note: This is a convenience wrapper for the recursive decoding
-               algorithm, C{_decodeRecursive}
+        @note: Anything following the first complete value is ignored
        
         @return: The decoded data, as a native Python type
         @rtype:  int, list, dict or str
         """
         if len(data) == 0:
             raise DecodeError, 'Cannot decode empty string'
-        return self._decodeRecursive(data)[0]
+        try:
+            return self._decode(data)[0]
+        except (IndexError, ValueError, TypeError), e:
+            raise DecodeError, e
     
     @staticmethod
-    def _decodeRecursive(data, startIndex=0):
-        """ Actual implementation of the recursive Bencode algorithm
+    def _decode(data, startIndex=0):
+        """ Actual implementation of the Bencode algorithm
         
         Do not call this; use C{decode()} instead
+        
+        @return: The first value encoded at C{startIndex}, and the index
+                 following it
+        @rtype: tuple
         """
-        if data[startIndex] == 'i':
-            endPos = data[startIndex:].find('e')+startIndex
-            return (int(data[startIndex+1:endPos]), endPos+1)
-        elif data[startIndex] == 'l':
-            startIndex += 1
-            decodedList = []
-            while data[startIndex] != 'e':
-                listData, startIndex = Bencode._decodeRecursive(data, startIndex)
-                decodedList.append(listData)
-            return (decodedList, startIndex+1)
-        elif data[startIndex] == 'd':
-            startIndex += 1
-            decodedDict = {}
-            while data[startIndex] != 'e':
-                key, startIndex = Bencode._decodeRecursive(data, startIndex)
-                value, startIndex = Bencode._decodeRecursive(data, startIndex)
-                decodedDict[key] = value
-            return (decodedDict, startIndex)
-        elif data[startIndex] == 'f':
-            # This (float data type) is a non-standard extension to the original Bencode algorithm
-            endPos = data[startIndex:].find('e')+startIndex
-            return (float(data[startIndex+1:endPos]), endPos+1)
-        elif data[startIndex] == 'n':
-            # This (None/NULL data type) is a non-standard extension to the original Bencode algorithm 
-            return (None, startIndex+1)
-        else:
-            splitPos = data[startIndex:].find(':')+startIndex
-            try:
-                length = int(data[startIndex:splitPos])
-            except ValueError, e:
-                raise DecodeError, e
-            startIndex = splitPos+1
-            endPos = startIndex+length
-            bytes = data[startIndex:endPos]
-            return (bytes, endPos)
+        # Open lists and dictionaries, as (isDict, items) - dictionaries
+        # collect their keys and values alternately
+        stack = []
+        index = startIndex
+        dataLength = len(data)
+        find = data.index
+        while True:
+            token = data[index]
+            if token not in 'ldeifn':
+                splitPos = find(':', index)
+                length = int(data[index:splitPos])
+                index = splitPos+1+length
+                if length < 0 or index > dataLength:
+                    raise DecodeError, 'Invalid string length at %d' % splitPos
+                value = data[splitPos+1:index]
+            elif token == 'i':
+                endPos = find('e', index)
+                value = int(data[index+1:endPos])
+                index = endPos+1
+            elif token == 'l' or token == 'd':
+                stack.append((token == 'd', []))
+                index += 1
+                continue
+            elif token == 'e':
+                if not stack:
+                    raise DecodeError, 'Unexpected end marker at %d' % index
+                isDict, items = stack.pop()
+                if isDict:
+                    if len(items) % 2:
+                        raise DecodeError, 'Dictionary key without a value'
+                    value = dict(zip(items[::2], items[1::2]))
+                else:
+                    value = items
+                index += 1
+            elif token == 'f':
+                # This (float data type) is a non-standard extension to the original Bencode algorithm
+                endPos = find('e', index)
+                value = float(data[index+1:endPos])
+                index = endPos+1
+            else:
+                # This (None/NULL data type) is a non-standard extension to the original Bencode algorithm 
+                value = None
+                index += 1
+            if not stack:
+                return (value, index)
+            stack[-1][1].append(value)
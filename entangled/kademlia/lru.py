@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+#
+# The docstrings in this module contain epytext markup; API documentation
+# may be created by processing this file with epydoc: http://epydoc.sf.net
+
+from collections import OrderedDict
+
+class LRUSet(object):
+    """ A set of at most C{capacity} items, for what a node remembers about
+    its peers
+
+    Adding an item beyond the capacity evicts the one least recently added;
+    adding an item again counts as adding it anew.
+    """
+    def __init__(self, capacity):
+        """
+        @param capacity: The number of items kept
+        @type capacity: int
+        """
+        self.capacity = capacity
+        # Item -> None, least recently added first
+        self._items = OrderedDict()
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, item):
+        self._items.pop(item, None)
+        self._items[item] = None
+        while len(self._items) > self.capacity:
+            self._items.popitem(last=False)
+
+    def discard(self, item):
+        self._items.pop(item, None)
@@ -40,7 +40,7 @@ class MessageTranslator(object):
 class DefaultFormat(MessageTranslator):
     """ The default on-the-wire message format for this library """
     typeRequest, typeResponse, typeError = range(3)
-    headerType, headerMsgID, headerNodeID, headerPayload, headerArgs = range(5)
+    headerType, headerMsgID, headerNodeID, headerPayload, headerArgs, headerAcceptsEnvelopes = range(6)
     
     def fromPrimitive(self, msgPrimitive):
         msgType = msgPrimitive[self.headerType]
@@ -53,6 +53,7 @@ class DefaultFormat(MessageTranslator):
         else:
             # Unknown message, no payload
             msg = msgtypes.Message(msgPrimitive[self.headerMsgID], msgPrimitive[self.headerNodeID])
+        msg.acceptsEnvelopes = bool(msgPrimitive.get(self.headerAcceptsEnvelopes))
         return msg
     
     def toPrimitive(self, message):    
@@ -69,4 +70,6 @@ class DefaultFormat(MessageTranslator):
         elif isinstance(message, msgtypes.ResponseMessage):
             msg[self.headerType] = self.typeResponse
             msg[self.headerPayload] = message.response
+        if message.acceptsEnvelopes:
+            msg[self.headerAcceptsEnvelopes] = 1
         return msg
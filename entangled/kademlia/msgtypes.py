@@ -15,6 +15,8 @@ class Message(object):
     def __init__(self, rpcID, nodeID):
         self.id = rpcID
         self.nodeID = nodeID
+        # Whether the sender accepts several messages in one datagram
+        self.acceptsEnvelopes = False
 
 
 class RequestMessage(Message):
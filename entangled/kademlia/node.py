@@ -7,10 +7,12 @@
 # The docstrings in this module contain epytext markup; API documentation
 # may be created by processing this file with epydoc: http://epydoc.sf.net
 
-import hashlib, random, time
+import copy, hashlib, random, time
 
 from twisted.internet import defer
+from twisted.python import failure
 
+import admission
 import constants
 import routingtable
 import datastore
@@ -67,10 +69,17 @@ class Node(object):
             self.id = self._generateID()
         self.port = udpPort
         self._listeningPort = None # object implementing Twisted IListeningPort
+        # The call of the next periodic k-bucket refresh
+        self._refreshCall = None
         # This will contain a deferred created when joining the network, to enable publishing/retrieving information from
         # the DHT as soon as the node is part of the network (add callbacks to this deferred if scheduling such operations
         # before the node has finished joining the network)
         self._joinDeferred = None
+        # (key, rpc, priority) -> deferreds waiting for the lookup in progress
+        self._lookupsInFlight = {}
+        #: The number of lookups that joined an identical one in progress
+        #: instead of starting their own
+        self.coalescedLookups = 0
         # Create k-buckets (for storing contacts)
         #self._buckets = []
         #for i in range(160):
@@ -100,7 +109,8 @@ class Node(object):
 
     def __del__(self):
         self._persistState()
-        self._listeningPort.stopListening()
+        if self._listeningPort is not None:
+            self._listeningPort.stopListening()
 
     def joinNetwork(self, knownNodeAddresses=None):
         """ Causes the Node to join the Kademlia network; normally, this
@@ -124,18 +134,31 @@ class Node(object):
             bootstrapContacts = None
         # Initiate the Kademlia joining sequence - perform a search for this node's own ID
         self._joinDeferred = self._iterativeFind(self.id, bootstrapContacts)
-#        #TODO: Refresh all k-buckets further away than this node's closest neighbour
-#        def getBucketAfterNeighbour(*args):
-#            for i in range(160):
-#                if len(self._buckets[i]) > 0:
-#                    return i+1
-#            return 160
-#        df.addCallback(getBucketAfterNeighbour)
-#        df.addCallback(self._refreshKBuckets)
+        # That search only fills the k-buckets around this node's own ID;
+        # refresh all the others, further away than its closest neighbour,
+        # as well (in the background: the node has joined already)
+        def refreshKBuckets(result):
+            self._refreshRoutingTable(force=True)
+            return result
+        self._joinDeferred.addCallback(refreshKBuckets)
         #protocol.reactor.callLater(10, self.printContacts)
         self._joinDeferred.addCallback(self._persistState)
         # Start refreshing k-buckets periodically, if necessary
-        twisted.internet.reactor.callLater(constants.checkRefreshInterval, self._refreshNode) #IGNORE:E1101
+        self._refreshCall = twisted.internet.reactor.callLater(constants.checkRefreshInterval, self._refreshNode) #IGNORE:E1101
+
+    def leaveNetwork(self):
+        """ Causes the Node to stop taking part in the Kademlia network: it
+        closes its UDP port (failing the RPCs still waiting to be sent), and
+        stops refreshing its k-buckets. This undoes
+        C{joinNetwork()}, e.g. to remove a node from a process that runs
+        many of them.
+        """
+        if self._refreshCall is not None and self._refreshCall.active():
+            self._refreshCall.cancel()
+        self._refreshCall = None
+        if self._listeningPort is not None:
+            self._listeningPort.stopListening()
+            self._listeningPort = None
 
     def printContacts(self):
         print '\n\nNODE CONTACTS\n==============='
@@ -145,7 +168,8 @@ class Node(object):
         print '=================================='
         #twisted.internet.reactor.callLater(10, self.printContacts)
 
-    def iterativeStore(self, key, value, originalPublisherID=None, age=0):
+    def iterativeStore(self, key, value, originalPublisherID=None, age=0,
+                       priority=admission.priorityLookup):
         """ The Kademlia store operation
         
         Call this to store/republish data in the DHT.
@@ -162,6 +186,9 @@ class Node(object):
                     isn't actually given, to compensate for clock skew between
                     different nodes.
         @type age: int
+        @param priority: The priority of the RPCs sent for this (see
+                         L{kademlia.admission})
+        @type priority: int
         """
         #print '      iterativeStore called'
         if originalPublisherID == None:
@@ -178,21 +205,26 @@ class Node(object):
             else:
                 self.store(key, value, originalPublisherID=originalPublisherID, age=age)
             for contact in nodes:
-                contact.store(key, value, originalPublisherID, age)
+                contact.store(key, value, originalPublisherID, age, priority=priority)
             return nodes
         # Find k nodes closest to the key...
-        df = self.iterativeFindNode(key)
+        df = self.iterativeFindNode(key, priority)
         # ...and send them STORE RPCs as soon as they've been found
         df.addCallback(executeStoreRPCs)
         return df
 
-    def iterativeFindNode(self, key):
+    def iterativeFindNode(self, key, priority=admission.priorityLookup):
         """ The basic Kademlia node lookup operation
         
         Call this to find a remote node in the P2P overlay network.
         
         @param key: the 160-bit key (i.e. the node or value ID) to search for
         @type key: str
+        @param priority: The priority of the lookup's RPCs (see
+                         L{kademlia.admission}); a lookup for the same key
+                         already in progress is shared only if it runs at
+                         this priority or a higher one
+        @type priority: int
         
         @return: This immediately returns a deferred object, which will return
                  a list of k "closest" contacts (C{kademlia.contact.Contact}
@@ -200,7 +232,9 @@ class Node(object):
                  finished.
         @rtype: twisted.internet.defer.Deferred
         """
-        return self._iterativeFind(key)
+        return self._singleFlight(key, 'findNode',
+                                  lambda: self._iterativeFind(key, priority=priority),
+                                  priority)
 
     def iterativeFindValue(self, key):
         """ The Kademlia search operation (deterministic)
@@ -222,6 +256,9 @@ class Node(object):
                      to the specified key
         @rtype: twisted.internet.defer.Deferred
         """
+        return self._singleFlight(key, 'findValue', lambda: self._iterativeFindValue(key))
+
+    def _iterativeFindValue(self, key):
         # Prepare a callback for this operation
         outerDf = defer.Deferred()
         def checkResult(result):
@@ -409,7 +446,47 @@ class Node(object):
         hash.update(str(random.getrandbits(255)))
         return hash.digest()
 
-    def _iterativeFind(self, key, startupShortlist=None, rpc='findNode'):
+    def _singleFlight(self, key, rpc, lookup, priority=admission.priorityLookup):
+        """ Runs a lookup, unless an identical one is already in progress at
+        the same or a higher priority; then the caller gets that one's result
+        instead (a lookup the user asked for doesn't wait behind the queued
+        RPCs of a maintenance lookup it would otherwise share)
+
+        @param key: The key being looked up
+        @type key: str
+        @param rpc: The RPC the lookup issues
+        @type rpc: str
+        @param lookup: Starts the lookup, returning a deferred for its result
+        @type lookup: callable
+        @param priority: The priority C{lookup} runs its RPCs at
+        @type priority: int
+
+        @return: A deferred for a copy of the lookup's result
+        @rtype: twisted.internet.defer.Deferred
+        """
+        df = defer.Deferred()
+        # Lower numbers are higher priorities
+        for sharedPriority in range(priority + 1):
+            if (key, rpc, sharedPriority) in self._lookupsInFlight:
+                self._lookupsInFlight[(key, rpc, sharedPriority)].append(df)
+                self.coalescedLookups += 1
+                return df
+        flight = (key, rpc, priority)
+        waiting = self._lookupsInFlight[flight] = [df]
+        def done(result):
+            del self._lookupsInFlight[flight]
+            for waitingDf in waiting:
+                if isinstance(result, failure.Failure):
+                    waitingDf.errback(result)
+                else:
+                    # Each caller may do what it likes with its result
+                    waitingDf.callback(copy.copy(result))
+        # A lookup that raises right away must still end its flight
+        defer.maybeDeferred(lookup).addBoth(done)
+        return df
+
+    def _iterativeFind(self, key, startupShortlist=None, rpc='findNode',
+                       priority=admission.priorityLookup):
         """ The basic Kademlia iterative lookup operation (for nodes/values)
         
         This builds a list of k "closest" contacts through iterative use of
@@ -430,6 +507,9 @@ class Node(object):
                     other operations that piggy-back on the basic Kademlia
                     lookup operation (Entangled's "delete" RPC, for instance).
         @type rpc: str
+        @param priority: The priority of the RPCs issued (see
+                         L{kademlia.admission})
+        @type priority: int
         
         @return: If C{findValue} is C{True}, the algorithm will stop as soon
                  as a data value for C{key} is found, and return a dictionary
@@ -567,7 +647,7 @@ class Node(object):
                 if contact.id not in alreadyContacted:
                     activeProbes.append(contact.id)
                     rpcMethod = getattr(contact, rpc)
-                    df = rpcMethod(key, rawResponse=True)
+                    df = rpcMethod(key, rawResponse=True, priority=priority)
                     df.addCallback(extendShortlist)
                     df.addErrback(removeFromShortlist)
                     df.addCallback(cancelActiveProbe)
@@ -579,7 +659,7 @@ class Node(object):
                 or (len(shortlist) < constants.k and len(activeContacts) < len(shortlist) and len(activeProbes) > 0):
                 #print '----------- scheduling next call -------------'
                 # Schedule the next iteration if there are any active calls (Kademlia uses loose parallelism)
-                call = twisted.internet.reactor.callLater(constants.iterativeLookupDelay, searchIteration) #IGNORE:E1101
+                call = twisted.internet.reactor.callLater(self._protocol.probeDelay(activeProbes), searchIteration) #IGNORE:E1101
                 pendingIterationCalls.append(call)
             # Check for a quick contact response that made an update to the shortList
             elif prevShortlistLength < len(shortlist):
@@ -686,13 +766,15 @@ class Node(object):
         df.addCallback(self._republishData)
         df.addCallback(self._scheduleNextNodeRefresh)
 
-    def _refreshRoutingTable(self):
-        nodeIDs = self._routingTable.getRefreshList(0, False)
+    def _refreshRoutingTable(self, force=False):
+        """ Refreshes the k-buckets that haven't been accessed for a while,
+        or with C{force}, all of them """
+        nodeIDs = self._routingTable.getRefreshList(0, force)
         outerDf = defer.Deferred()
         def searchForNextNodeID(dfResult=None):
             if len(nodeIDs) > 0:
                 searchID = nodeIDs.pop()
-                df = self.iterativeFindNode(searchID)
+                df = self.iterativeFindNode(searchID, admission.priorityMaintenance)
                 df.addCallback(searchForNextNodeID)
             else:
                 # If this is reached, we have finished refreshing the routing table
@@ -708,7 +790,10 @@ class Node(object):
 
     def _scheduleNextNodeRefresh(self, *args):
         #print '==== sheduling next refresh'
-        twisted.internet.reactor.callLater(constants.checkRefreshInterval, self._refreshNode)
+        if self._listeningPort is None:
+            # The node left the network while refreshing
+            return
+        self._refreshCall = twisted.internet.reactor.callLater(constants.checkRefreshInterval, self._refreshNode)
 
     def _threadedRepublishData(self, *args):
         """ Republishes and expires any stored data (i.e. stored
@@ -732,7 +817,8 @@ class Node(object):
                 if age >= constants.dataExpireTimeout:
                     #print '    REPUBLISHING key:', key
                     #self.iterativeStore(key, self._dataStore[key])
-                    twisted.internet.reactor.callFromThread(self.iterativeStore, key, self._dataStore[key])
+                    twisted.internet.reactor.callFromThread(self.iterativeStore, key, self._dataStore[key],
+                                                            priority=admission.priorityMaintenance)
             else:
                 # This node needs to replicate the data at set intervals,
                 # until it expires, without changing the metadata associated with it
@@ -745,7 +831,8 @@ class Node(object):
                     # ...data has not yet expired, and we need to replicate it
                     #print '    replicating key:', key,'age:',age
                     #self.iterativeStore(key=key, value=self._dataStore[key], originalPublisherID=originalPublisherID, age=age)
-                    twisted.internet.reactor.callFromThread(self.iterativeStore, key=key, value=self._dataStore[key], originalPublisherID=originalPublisherID, age=age)
+                    twisted.internet.reactor.callFromThread(self.iterativeStore, key=key, value=self._dataStore[key], originalPublisherID=originalPublisherID, age=age,
+                                                            priority=admission.priorityMaintenance)
         for key in expiredKeys:
             #print '    expiring key:', key
             del self._dataStore[key]
@@ -7,40 +7,80 @@
 # The docstrings in this module contain epytext markup; API documentation
 # may be created by processing this file with epydoc: http://epydoc.sf.net
 
-import time
+import struct
 
 from twisted.internet import protocol, defer
 from twisted.python import failure
 import twisted.internet.reactor
 
+import admission
+import coalesce
 import constants
 import encoding
+import lru
 import msgtypes
 import msgformat
+import reassembly
+import retransmit
+import rtt
+import scheduler
+import stream
+import timerwheel
 from contact import Contact
 
 reactor = twisted.internet.reactor
 
+# The last byte of the header of multi-packet transmissions, their NACKs and
+# ACKs, of message envelopes (see kademlia.coalesce), and of the tokens that
+# confirm the UDP address of TCP connections (see kademlia.stream)
+(
+    fragmentData,
+    fragmentNack,
+    fragmentAck,
+    messageEnvelope,
+    streamToken
+) = ('\x00', '\x01', '\x02', coalesce.envelopeIndicator, stream.tokenIndicator)
+
 class TimeoutError(Exception):
     """ Raised when a RPC times out """
 
 class KademliaProtocol(protocol.DatagramProtocol):
     """ Implements all low-level network-related functions of a Kademlia node """
     msgSizeLimit = constants.udpDatagramMaxSize-26
-    maxToSendDelay = 10**-3#0.05
-    minToSendDelay = 10**-5#0.01
 
-    def __init__(self, node, msgEncoder=encoding.Bencode(), msgTranslator=msgformat.DefaultFormat()):
+    def __init__(self, node, msgEncoder=encoding.Bencode(), msgTranslator=msgformat.DefaultFormat(),
+                 selectiveRetransmission=constants.selectiveRetransmission,
+                 streamTransport=constants.streamTransport,
+                 coalesceMessages=constants.coalesceMessages):
         self._node = node
         self._encoder = msgEncoder
         self._translator = msgTranslator
         self._sentMessages = {}
-        self._partialMessages = {}
+        self._reassembler = reassembly.Reassembler(self.msgSizeLimit)
         self._partialMessagesProgress = {}
-        self._next = 0
-        self._callLaterList = {}
+        self._scheduler = scheduler.SendScheduler(self._write)
+        self._selectiveRetransmission = selectiveRetransmission
+        self._retransmitBuffer = retransmit.RetransmitBuffer()
+        # Message ID -> [NACK timer, NACKs sent] of incomplete messages
+        self._nacks = {}
+        if streamTransport:
+            self._streams = stream.StreamPool(self.datagramReceived, self._sendDatagrams,
+                                              self._sendStreamToken)
+        else:
+            self._streams = None
+        if coalesceMessages:
+            self._coalescer = coalesce.Coalescer(self._scheduler.enqueue)
+        else:
+            self._coalescer = None
+        # UDP addresses of nodes that accept message envelopes
+        self._envelopePeers = lru.LRUSet(constants.coalesceMaxPeers)
+        self._rtt = rtt.RTTEstimator()
+        # Owns the timeouts of the RPCs in _sentMessages
+        self._timers = timerwheel.TimerWheel(clock=reactor)
+        # Bounds the RPCs in _sentMessages; RPCs beyond its bounds wait there
+        self._limiter = admission.RPCLimiter(clock=reactor)
 
-    def sendRPC(self, contact, method, args, rawResponse=False):
+    def sendRPC(self, contact, method, args, rawResponse=False, priority=admission.priorityLookup):
         """ Sends an RPC to the specified contact
 
         @param contact: The contact (remote node) to send the RPC to
@@ -58,6 +98,12 @@ class KademliaProtocol(protocol.DatagramProtocol):
                             needs to be done with the metadata associated with
                             the message, this should remain C{False}.
         @type rawResponse: bool
+        @param priority: Whether the RPC is part of something the user asked
+                         for (C{admission.priorityLookup}) or of the node's
+                         own maintenance (C{admission.priorityMaintenance});
+                         while too many RPCs are in flight, it decides which
+                         are sent first
+        @type priority: int
 
         @return: This immediately returns a deferred object, which will return
                  the result of the RPC call, or raise the relevant exception
@@ -67,20 +113,51 @@ class KademliaProtocol(protocol.DatagramProtocol):
                  C{ErrorMessage}).
         @rtype: twisted.internet.defer.Deferred
         """
-        msg = msgtypes.RequestMessage(self._node.id, method, args)
-        msgPrimitive = self._translator.toPrimitive(msg)
-        encodedMsg = self._encoder.encode(msgPrimitive)
-
         df = defer.Deferred()
         if rawResponse:
             df._rpcRawResponse = True
+        self._limiter.submit(contact.id, lambda: self._sendRPC(contact, method, args, df),
+                             df, priority)
+        return df
+
+    def _sendRPC(self, contact, method, args, df):
+        """ Transmits an RPC once the limiter admitted it
+
+        @param df: The deferred returned by L{sendRPC}
+        @type df: twisted.internet.defer.Deferred
+        """
+        msg = msgtypes.RequestMessage(self._node.id, method, args)
+        msg.acceptsEnvelopes = True
+        msgPrimitive = self._translator.toPrimitive(msg)
+        encodedMsg = self._encoder.encode(msgPrimitive)
 
         # Set the RPC timeout timer
-        timeoutCall = reactor.callLater(constants.rpcTimeout, self._msgTimeout, msg.id) #IGNORE:E1101
+        timeoutCall = self._timers.callLater(self._rtt.timeout(contact.id), self._msgTimeout, msg.id)
         # Transmit the data
         self._send(encodedMsg, msg.id, (contact.address, contact.port))
-        self._sentMessages[msg.id] = (contact.id, df, timeoutCall)
-        return df
+        self._sentMessages[msg.id] = (contact.id, df, timeoutCall, reactor.seconds())
+
+    def probeDelay(self, contactIDs):
+        """ Returns how long to wait for the responses of RPCs sent to the
+        specified contacts, judging by their round-trip times, before an
+        iterative lookup moves on to further contacts
+
+        @param contactIDs: The IDs of the contacts that were sent RPCs
+        @type contactIDs: list
+
+        @return: The delay (in seconds), between
+                 C{constants.iterativeLookupDelayMin} and
+                 C{constants.iterativeLookupDelay}
+        @rtype: float
+        """
+        delay = constants.iterativeLookupDelayMin
+        for contactID in contactIDs:
+            estimate = self._rtt.estimate(contactID)
+            if estimate is None:
+                # No idea how long this one takes
+                return constants.iterativeLookupDelay
+            delay = max(delay, estimate)
+        return min(delay, constants.iterativeLookupDelay)
 
     def datagramReceived(self, datagram, address):
         """ Handles and parses incoming RPC messages (and responses)
@@ -88,23 +165,9 @@ class KademliaProtocol(protocol.DatagramProtocol):
         @note: This is automatically called by Twisted when the protocol
                receives a UDP datagram
         """
-        if datagram[0] == '\x00' and datagram[25] == '\x00':
-            totalPackets = (ord(datagram[1]) << 8) | ord(datagram[2])
-            msgID = datagram[5:25]
-            seqNumber = (ord(datagram[3]) << 8) | ord(datagram[4])
-            if msgID not in self._partialMessages:
-                self._partialMessages[msgID] = {}
-            self._partialMessages[msgID][seqNumber] = datagram[26:]
-            if len(self._partialMessages[msgID]) == totalPackets:
-                keys = self._partialMessages[msgID].keys()
-                keys.sort()
-                data = ''
-                for key in keys:
-                    data += self._partialMessages[msgID][key]
-                    datagram = data
-                del self._partialMessages[msgID]
-            else:
-                return
+        datagram = self._reassemble(datagram, address)
+        if datagram is None:
+            return
         try:
             msgPrimitive = self._encoder.decode(datagram)
         except encoding.DecodeError:
@@ -112,6 +175,7 @@ class KademliaProtocol(protocol.DatagramProtocol):
             return
         
         message = self._translator.fromPrimitive(msgPrimitive)
+        self._noteEnvelopes(message, address)
         remoteContact = Contact(message.nodeID, address[0], address[1], self)
         print 'Receied RPC from: %s to: %s' % (remoteContact.port, self._node.port)
         # Refresh the remote node's details in the local node's k-buckets
@@ -123,9 +187,12 @@ class KademliaProtocol(protocol.DatagramProtocol):
             # Find the message that triggered this response
             if self._sentMessages.has_key(message.id):
                 # Cancel timeout timer for this RPC
-                df, timeoutCall = self._sentMessages[message.id][1:3]
+                remoteContactID, df, timeoutCall, sentAt = self._sentMessages[message.id]
                 timeoutCall.cancel()
                 del self._sentMessages[message.id]
+                self._rtt.sample(remoteContactID, reactor.seconds() - sentAt)
+                # Before the callbacks run, which may well send further RPCs
+                self._limiter.release(remoteContactID)
 
                 if hasattr(df, '_rpcRawResponse'):
                     # The RPC requested that the raw response message and originating address be returned; do not interpret it
@@ -157,10 +224,158 @@ class KademliaProtocol(protocol.DatagramProtocol):
                 #TODO: we should probably do something with this...
                 pass
 
-    def _send(self, data, rpcID, address):
+    def _reassemble(self, datagram, address):
+        """ Collects the fragments of multi-packet messages
+
+        @return: The datagram if it isn't a fragment, the reassembled message
+                 if it was the last missing fragment of one, otherwise
+                 C{None}
+        @rtype: str
+        """
+        if len(datagram) < 26 or datagram[0] != '\x00':
+            return datagram
+        msgID = datagram[5:25]
+        if datagram[25] == messageEnvelope:
+            for message in coalesce.unpack(datagram):
+                # Envelopes don't nest
+                if message[:1] != '\x00':
+                    self.datagramReceived(message, address)
+            return None
+        elif datagram[25] == fragmentNack:
+            self._retransmit(msgID, datagram[26:], address)
+            return None
+        elif datagram[25] == fragmentAck:
+            self._retransmitBuffer.acknowledge(msgID, address)
+            return None
+        elif datagram[25] == streamToken:
+            if self._streams is not None:
+                self._streams.confirm(msgID, address)
+            return None
+        elif datagram[25] != fragmentData:
+            return datagram
+        totalPackets = (ord(datagram[1]) << 8) | ord(datagram[2])
+        seqNumber = (ord(datagram[3]) << 8) | ord(datagram[4])
+        data = self._reassembler.add(msgID, seqNumber, totalPackets, datagram[26:], address[0])
+        if data is not None:
+            self._partialMessagesProgress.pop(msgID, None)
+            if self._selectiveRetransmission:
+                self._cancelNack(msgID)
+                self._sendControl(fragmentAck, msgID, totalPackets, '', address)
+        elif self._selectiveRetransmission and msgID in self._reassembler:
+            if msgID not in self._nacks:
+                self._nacks[msgID] = [None, 0]
+            nack = self._nacks[msgID]
+            if nack[0] is not None and nack[0].active():
+                nack[0].reset(constants.fragmentNackDelay)
+            else:
+                nack[0] = reactor.callLater(constants.fragmentNackDelay, self._nackTimeout, msgID, totalPackets, address)
+            if seqNumber == totalPackets - 1:
+                # Packets are sent in sequence, so any gaps left by now were lost
+                self._sendNack(msgID, totalPackets, address)
+        return data
+
+    def _noteEnvelopes(self, message, address):
+        """ Records whether the sender of a message accepts envelopes """
+        if message.acceptsEnvelopes:
+            self._envelopePeers.add(address)
+        else:
+            self._envelopePeers.discard(address)
+
+    def _nackTimeout(self, msgID, totalPackets, address):
+        """ Called when no packet of an incomplete message arrived for a while """
+        if msgID not in self._nacks:
+            return
+        if msgID not in self._reassembler or not self._sendNack(msgID, totalPackets, address):
+            del self._nacks[msgID]
+            return
+        self._nacks[msgID][0] = reactor.callLater(constants.fragmentNackDelay, self._nackTimeout, msgID, totalPackets, address)
+
+    def _sendNack(self, msgID, totalPackets, address):
+        """ Asks the sender of an incomplete message for the missing packets
+
+        @return: C{False} if the message has been NACKed too often already
+        @rtype: bool
+        """
+        nack = self._nacks[msgID]
+        if nack[1] >= constants.fragmentMaxNacks:
+            return False
+        nack[1] += 1
+        missing = self._reassembler.missing(msgID, self.msgSizeLimit / 2)
+        self._sendControl(fragmentNack, msgID, totalPackets,
+                          struct.pack('!%dH' % len(missing), *missing), address)
+        return True
+
+    def _cancelNack(self, msgID):
+        nack = self._nacks.pop(msgID, None)
+        if nack is not None and nack[0] is not None and nack[0].active():
+            nack[0].cancel()
+
+    def _sendControl(self, kind, msgID, totalPackets, payload, address):
+        """ Sends a NACK or ACK for a multi-packet message, or a stream
+        token """
+        txData = '\x00%s\x00\x00%s%s%s' % (
+            struct.pack('!H', totalPackets), msgID, kind, payload)
+        self._scheduler.enqueue(txData, address, scheduler.priorityResponse)
+
+    def _sendStreamToken(self, token, address):
+        """ Returns the token of a TCP connection to the node at the specified
+        UDP address, confirming that we are the node at our UDP address """
+        self._sendControl(streamToken, token, 0, '', address)
+
+    def _retransmit(self, rpcID, payload, address):
+        """ Sends the packets of a message its receiver reported missing """
+        buffered = self._retransmitBuffer.request(rpcID, address)
+        if buffered is None:
+            return
+        data, priority = buffered
+        totalPackets = self._totalPackets(data)
+        count = len(payload) / 2
+        for seqNumber in struct.unpack('!%dH' % count, payload[:count*2]):
+            if seqNumber < totalPackets:
+                self._scheduler.enqueue(
+                    self._fragment(data, rpcID, seqNumber, totalPackets),
+                    address, priority)
+
+    def _totalPackets(self, data):
+        totalPackets = len(data) / self.msgSizeLimit
+        if len(data) % self.msgSizeLimit > 0:
+            totalPackets += 1
+        return totalPackets
+
+    def _fragment(self, data, rpcID, seqNumber, totalPackets):
+        """ Returns the packet with the specified sequence number of a
+        multi-packet transmission """
+        startPos = seqNumber * self.msgSizeLimit
+        return '\x00%s%s%s\x00%s' % (
+            struct.pack('!H', totalPackets), struct.pack('!H', seqNumber),
+            rpcID, data[startPos:startPos+self.msgSizeLimit])
+
+    def startProtocol(self):
+        """ Called when the transport is connected; starts accepting TCP
+        connections on the port number of the UDP port """
+        if self._streams is not None:
+            self._streams.listen(self.transport.getHost().port)
+
+    def _send(self, data, rpcID, address, priority=scheduler.priorityRequest):
+        """ Transmit the specified data
+
+        Data larger than C{constants.streamThreshold} goes over a pooled TCP
+        connection (see C{kademlia.stream}), unless the receiver can't be
+        reached over TCP; everything else is sent over UDP.
+        """
+        if (self._streams is not None and len(data) > constants.streamThreshold and
+                self._streams.send(data, rpcID, address, priority)):
+            return
+        self._sendDatagrams(data, rpcID, address, priority)
+
+    def _sendDatagrams(self, data, rpcID, address, priority=scheduler.priorityRequest):
         """ Transmit the specified data over UDP, breaking it up into several
         packets if necessary
         
+        The packets are queued with the send scheduler, at the specified
+        priority (C{scheduler.priorityResponse} or
+        C{scheduler.priorityRequest}).
+        
         If the data is spread over multiple UDP datagrams, the packets have the
         following structure::
             |           |     |      |      |        ||||||||||||   0x00   |
@@ -168,6 +383,17 @@ class KademliaProtocol(protocol.DatagramProtocol):
             | type ID   | of packets |of this packet |          | indicator|
             | (1 byte)  | (2 bytes)  |  (2 bytes)    |(20 bytes)| (1 byte) |
             |           |     |      |      |        ||||||||||||          |
+
+        These messages are kept in a retransmit buffer for a while. A
+        receiver that misses some of their packets replies with a NACK: the
+        same header, with a header end indicator of 0x01, followed by the
+        missing sequence numbers (2 bytes each). Once it has received all
+        packets, it replies with an ACK (header end indicator 0x02), which
+        frees the buffer.
+
+        Small messages to nodes that accept envelopes are held back for
+        C{constants.coalesceWindow} seconds, to be sent along with others to
+        the same node (see C{kademlia.coalesce}).
         
         @note: The header used for breaking up large data segments will
                possibly be moved out of the KademliaProtocol class in the
@@ -177,56 +403,43 @@ class KademliaProtocol(protocol.DatagramProtocol):
         if len(data) > self.msgSizeLimit:
             # We have to spread the data over multiple UDP datagrams, and provide sequencing information
             # 1st byte is transmission type id, bytes 2 & 3 are the total number of packets in this transmission, bytes 4 & 5 are the sequence number for this specific packet
-            totalPackets = len(data) / self.msgSizeLimit
-            if len(data) % self.msgSizeLimit > 0:
-                totalPackets += 1
-            encTotalPackets = chr(totalPackets >> 8) + chr(totalPackets & 0xff)
-            seqNumber = 0
-            startPos = 0
-            while seqNumber < totalPackets:
-                #reactor.iterate() #IGNORE:E1101
-                packetData = data[startPos:startPos+self.msgSizeLimit]
-                encSeqNumber = chr(seqNumber >> 8) + chr(seqNumber & 0xff)
-                txData = '\x00%s%s%s\x00%s' % (encTotalPackets, encSeqNumber, rpcID, packetData)
-                self._sendNext(txData, address)
-
-                startPos += self.msgSizeLimit
-                seqNumber += 1
-        else:
-            self._sendNext(data, address)
-
-    def _sendNext(self, txData, address):
-        """ Send the next UDP packet """
-        ts = time.time()
-        delay = 0
-        if ts >= self._next:
-            delay = self.minToSendDelay
-            self._next = ts + self.minToSendDelay
+            totalPackets = self._totalPackets(data)
+            if self._selectiveRetransmission:
+                self._retransmitBuffer.add(rpcID, address, data, priority)
+            for seqNumber in range(totalPackets):
+                self._scheduler.enqueue(
+                    self._fragment(data, rpcID, seqNumber, totalPackets),
+                    address, priority)
+        elif (self._coalescer is not None and address in self._envelopePeers and
+                len(data) <= constants.coalesceMaxMessageSize):
+            self._coalescer.add(data, address, priority)
         else:
-            delay = (self._next-ts) + self.maxToSendDelay
-            self._next += self.maxToSendDelay
+            self._scheduler.enqueue(data, address, priority)
+
+    def _write(self, txData, address):
+        """ Send a single UDP packet, once the send scheduler lets it go """
         if self.transport:
-            laterCall = reactor.callLater(delay, self.transport.write, txData, address)
-            for key in self._callLaterList.keys():
-                if key <= ts:
-                    del self._callLaterList[key]
-            self._callLaterList[self._next] = laterCall
+            self.transport.write(txData, address)
 
     def _sendResponse(self, contact, rpcID, response):
         """ Send a RPC response to the specified contact
         """
         msg = msgtypes.ResponseMessage(rpcID, self._node.id, response)
+        msg.acceptsEnvelopes = True
         msgPrimitive = self._translator.toPrimitive(msg)
         encodedMsg = self._encoder.encode(msgPrimitive)
-        self._send(encodedMsg, rpcID, (contact.address, contact.port))
+        self._send(encodedMsg, rpcID, (contact.address, contact.port),
+                   scheduler.priorityResponse)
 
     def _sendError(self, contact, rpcID, exceptionType, exceptionMessage):
         """ Send an RPC error message to the specified contact
         """
         msg = msgtypes.ErrorMessage(rpcID, self._node.id, exceptionType, exceptionMessage)
+        msg.acceptsEnvelopes = True
         msgPrimitive = self._translator.toPrimitive(msg)
         encodedMsg = self._encoder.encode(msgPrimitive)
-        self._send(encodedMsg, rpcID, (contact.address, contact.port))
+        self._send(encodedMsg, rpcID, (contact.address, contact.port),
+                   scheduler.priorityResponse)
 
     def _handleRPC(self, senderContact, rpcID, method, args):
         """ Executes a local function in response to an RPC request """
@@ -265,22 +478,29 @@ class KademliaProtocol(protocol.DatagramProtocol):
         """ Called when an RPC request message times out """
         # Find the message that timed out
         if self._sentMessages.has_key(messageID):
-            remoteContactID, df = self._sentMessages[messageID][0:2]
-            if self._partialMessages.has_key(messageID):
+            remoteContactID, df, timeoutCall, sentAt = self._sentMessages[messageID]
+            received = self._reassembler.received(messageID)
+            if received is not None:
                 # We are still receiving this message
                 # See if any progress has been made; if not, kill the message
-                if self._partialMessagesProgress.has_key(messageID):
-                    if len(self._partialMessagesProgress[messageID]) == len(self._partialMessages[messageID]):
-                        # No progress has been made
-                        del self._partialMessagesProgress[messageID]
-                        del self._partialMessages[messageID]
-                        df.errback(failure.Failure(TimeoutError(remoteContactID)))
-                        return
+                if self._partialMessagesProgress.get(messageID) == received:
+                    # No progress has been made
+                    del self._partialMessagesProgress[messageID]
+                    del self._sentMessages[messageID]
+                    self._limiter.release(remoteContactID)
+                    self._reassembler.discard(messageID)
+                    self._cancelNack(messageID)
+                    df.errback(failure.Failure(TimeoutError(remoteContactID)))
+                    return
+                self._partialMessagesProgress[messageID] = received
                 # Reset the RPC timeout timer
-                timeoutCall = reactor.callLater(constants.rpcTimeout, self._msgTimeout, messageID) #IGNORE:E1101
-                self._sentMessages[messageID] = (remoteContactID, df, timeoutCall)
+                timeoutCall = self._timers.callLater(constants.rpcTimeout, self._msgTimeout, messageID)
+                self._sentMessages[messageID] = (remoteContactID, df, timeoutCall, sentAt)
                 return
+            self._partialMessagesProgress.pop(messageID, None)
             del self._sentMessages[messageID]
+            self._limiter.release(remoteContactID)
+            self._rtt.timedOut(remoteContactID)
             # The message's destination node is now considered to be dead;
             # raise an (asynchronous) TimeoutError exception and update the host node
             self._node.removeContact(remoteContactID)
@@ -294,12 +514,11 @@ class KademliaProtocol(protocol.DatagramProtocol):
         
         Will only be called once, after all ports are disconnected.
         """
-        for key in self._callLaterList.keys():
-            try:
-                if key > time.time():
-                    self._callLaterList[key].cancel()
-            except Exception, e:
-                print e
-            del self._callLaterList[key]
-            #TODO: test: do we really need the reactor.iterate() call?
-            reactor.iterate()
+        if self._coalescer is not None:
+            self._coalescer.stop()
+        self._limiter.failQueued(failure.Failure(defer.CancelledError()))
+        self._scheduler.stop()
+        if self._streams is not None:
+            self._streams.stop()
+        for msgID in self._nacks.keys():
+            self._cancelNack(msgID)
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+#
+# The docstrings in this module contain epytext markup; API documentation
+# may be created by processing this file with epydoc: http://epydoc.sf.net
+
+from collections import OrderedDict
+
+import twisted.internet.reactor
+
+import constants
+
+class PartialMessage(object):
+    """ A message of which some, but not all fragments have arrived
+
+    Fragments are copied into a buffer allocated for the whole message as they
+    arrive, and a bitmap records which of them are in. All fragments but the
+    last one carry exactly C{maxSegmentSize} bytes, as senders split messages
+    at that size; the last one, which may be shorter, is kept aside.
+    """
+    def __init__(self, peer, totalPackets, maxSegmentSize, now):
+        self.peer = peer
+        self.totalPackets = totalPackets
+        #: The number of bytes reserved for this message against the caps
+        self.reserved = totalPackets * maxSegmentSize
+        self.buffer = bytearray((totalPackets - 1) * maxSegmentSize)
+        self.bitmap = bytearray((totalPackets + 7) / 8)
+        self.received = 0
+        self.segmentSize = maxSegmentSize
+        self.tail = None
+        self.started = now
+        self.lastActivity = now
+
+    def has(self, seqNumber):
+        return self.bitmap[seqNumber >> 3] & (1 << (seqNumber & 7))
+
+    def add(self, seqNumber, data):
+        """ Stores a fragment
+
+        @return: C{False} if the fragment doesn't fit the message
+        @rtype: bool
+        """
+        if seqNumber == self.totalPackets - 1:
+            self.tail = data
+        else:
+            if len(data) != self.segmentSize:
+                return False
+            offset = seqNumber * self.segmentSize
+            self.buffer[offset:offset+self.segmentSize] = data
+        self.bitmap[seqNumber >> 3] |= 1 << (seqNumber & 7)
+        self.received += 1
+        return True
+
+    def complete(self):
+        return self.received == self.totalPackets
+
+    def missing(self, limit):
+        """ Returns the sequence numbers of up to C{limit} missing fragments """
+        result = []
+        for index, byte in enumerate(self.bitmap):
+            if byte == 0xff:
+                continue
+            for bit in range(8):
+                seqNumber = (index << 3) | bit
+                if seqNumber >= self.totalPackets or len(result) == limit:
+                    return result
+                if not byte & (1 << bit):
+                    result.append(seqNumber)
+        return result
+
+    def data(self):
+        """ Returns the reassembled message """
+        if self.totalPackets == 1:
+            return self.tail
+        return str(self.buffer[:(self.totalPackets - 1) * self.segmentSize]) + self.tail
+
+
+class Reassembler(object):
+    """ Rebuilds messages that were split into several UDP datagrams
+
+    The buffers of incomplete messages count against a global and a per-peer
+    memory cap; a message that would exceed either is dropped. Messages that
+    stop making progress are evicted after C{timeout} seconds.
+
+    The IDs of recently completed messages are remembered, so that fragments
+    which arrive late (e.g. retransmitted ones) don't start a new message.
+    """
+    #: The number of completed message IDs to remember
+    recentlyCompleted = 1024
+
+    def __init__(self, maxSegmentSize, maxBytes=constants.reassemblyMaxBytes,
+                 maxBytesPerPeer=constants.reassemblyMaxBytesPerPeer,
+                 timeout=constants.reassemblyTimeout,
+                 clock=twisted.internet.reactor):
+        """
+        @param maxSegmentSize: The largest fragment payload, in bytes
+        @type maxSegmentSize: int
+        @param maxBytes: The memory cap over all incomplete messages
+        @type maxBytes: int
+        @param maxBytesPerPeer: The memory cap over the incomplete messages
+                                of one peer (host)
+        @type maxBytesPerPeer: int
+        @param timeout: How long an incomplete message may go without a new
+                        fragment before it is evicted (in seconds)
+        @type timeout: float
+        @param clock: Provides the time
+        @type clock: twisted.internet.interfaces.IReactorTime
+        """
+        self.maxSegmentSize = maxSegmentSize
+        self.maxBytes = maxBytes
+        self.maxBytesPerPeer = maxBytesPerPeer
+        self.timeout = timeout
+        self._clock = clock
+        # Message ID -> PartialMessage, least recently active first
+        self._partials = OrderedDict()
+        self._peerBytes = {}
+        # Message ID -> time of completion, oldest first
+        self._completed = OrderedDict()
+        self.bytes = 0
+        self.completed = 0
+        self.totalLatency = 0.0
+        self.maxLatency = 0.0
+        self.drops = {'malformed': 0, 'duplicate': 0, 'peerCap': 0,
+                      'globalCap': 0, 'expired': 0}
+
+    def __len__(self):
+        return len(self._partials)
+
+    def __contains__(self, msgID):
+        return msgID in self._partials
+
+    def received(self, msgID):
+        """ Returns how many fragments of a message have arrived, or C{None}
+        if it isn't being reassembled """
+        if msgID in self._partials:
+            return self._partials[msgID].received
+        return None
+
+    def add(self, msgID, seqNumber, totalPackets, data, peer):
+        """ Adds a fragment of a message
+
+        @param peer: The host that sent the fragment
+        @type peer: str
+
+        @return: The reassembled message if this was its last missing
+                 fragment, otherwise C{None}
+        @rtype: str
+        """
+        now = self._clock.seconds()
+        self.expire(now)
+        if not 0 <= seqNumber < totalPackets or len(data) > self.maxSegmentSize:
+            self.drops['malformed'] += 1
+            return None
+        if msgID in self._completed:
+            self.drops['duplicate'] += 1
+            return None
+        partial = self._partials.pop(msgID, None)
+        if partial is None:
+            partial = self._start(peer, totalPackets, now)
+            if partial is None:
+                return None
+        elif partial.totalPackets != totalPackets or partial.peer != peer:
+            self._partials[msgID] = partial
+            self.drops['malformed'] += 1
+            return None
+        # Re-inserting keeps the dict ordered by activity
+        self._partials[msgID] = partial
+        partial.lastActivity = now
+        if partial.has(seqNumber):
+            self.drops['duplicate'] += 1
+            return None
+        if not partial.add(seqNumber, data):
+            self.drops['malformed'] += 1
+            return None
+        if not partial.complete():
+            return None
+        self._remove(msgID)
+        self._completed[msgID] = now
+        if len(self._completed) > self.recentlyCompleted:
+            self._completed.popitem(last=False)
+        latency = now - partial.started
+        self.completed += 1
+        self.totalLatency += latency
+        if latency > self.maxLatency:
+            self.maxLatency = latency
+        return partial.data()
+
+    def missing(self, msgID, limit=None):
+        """ Returns the sequence numbers of the fragments of a message that
+        have not arrived yet
+
+        @param limit: The maximum number of sequence numbers to return
+        @type limit: int
+        """
+        if msgID not in self._partials:
+            return []
+        return self._partials[msgID].missing(limit)
+
+    def discard(self, msgID):
+        """ Gives up on reassembling a message """
+        if msgID in self._partials:
+            self._remove(msgID)
+
+    def expire(self, now=None):
+        """ Evicts the messages that made no progress for C{timeout} seconds """
+        if now is None:
+            now = self._clock.seconds()
+        while self._partials:
+            msgID, partial = next(self._partials.iteritems())
+            if now - partial.lastActivity < self.timeout:
+                break
+            self._remove(msgID)
+            self.drops['expired'] += 1
+        while self._completed:
+            msgID, completed = next(self._completed.iteritems())
+            if now - completed < self.timeout:
+                break
+            del self._completed[msgID]
+
+    def stats(self):
+        """ Returns the buffered bytes, reassembly latency and drop counts
+
+        @rtype: dict
+        """
+        return {'pending': len(self._partials),
+                'bytes': self.bytes,
+                'completed': self.completed,
+                'meanLatency': (self.totalLatency / self.completed) if self.completed else 0.0,
+                'maxLatency': self.maxLatency,
+                'drops': dict(self.drops)}
+
+    def _start(self, peer, totalPackets, now):
+        size = totalPackets * self.maxSegmentSize
+        if self._peerBytes.get(peer, 0) + size > self.maxBytesPerPeer:
+            self.drops['peerCap'] += 1
+            return None
+        if self.bytes + size > self.maxBytes:
+            self.drops['globalCap'] += 1
+            return None
+        self.bytes += size
+        self._peerBytes[peer] = self._peerBytes.get(peer, 0) + size
+        return PartialMessage(peer, totalPackets, self.maxSegmentSize, now)
+
+    def _remove(self, msgID):
+        partial = self._partials.pop(msgID)
+        self.bytes -= partial.reserved
+        self._peerBytes[partial.peer] -= partial.reserved
+        if not self._peerBytes[partial.peer]:
+            del self._peerBytes[partial.peer]
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+#
+# The docstrings in this module contain epytext markup; API documentation
+# may be created by processing this file with epydoc: http://epydoc.sf.net
+
+from collections import OrderedDict
+
+import twisted.internet.reactor
+
+import constants
+
+class RetransmitBuffer(object):
+    """ Keeps recently sent multi-packet messages around for a short while,
+    so that fragments the receiver reports missing can be sent again
+
+    Messages are dropped once the receiver acknowledges them, after
+    C{timeout} seconds, or - oldest first - when the buffer exceeds
+    C{maxBytes}.
+    """
+    def __init__(self, maxBytes=constants.retransmitBufferMaxBytes,
+                 timeout=constants.retransmitBufferTimeout,
+                 maxRequests=constants.fragmentMaxNacks,
+                 clock=twisted.internet.reactor):
+        """
+        @param maxBytes: The memory cap over all buffered messages
+        @type maxBytes: int
+        @param timeout: How long a message is kept (in seconds)
+        @type timeout: float
+        @param maxRequests: How many retransmission requests are served per
+                            message
+        @type maxRequests: int
+        @param clock: Provides the time
+        @type clock: twisted.internet.interfaces.IReactorTime
+        """
+        self.maxBytes = maxBytes
+        self.timeout = timeout
+        self.maxRequests = maxRequests
+        self._clock = clock
+        # (RPC ID, address) -> [data, priority, time sent, requests served],
+        # oldest first
+        self._messages = OrderedDict()
+        self.bytes = 0
+        self.acknowledged = 0
+        self.retransmitted = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __contains__(self, key):
+        return key in self._messages
+
+    def add(self, rpcID, address, data, priority):
+        """ Buffers a message that was sent in several packets """
+        now = self._clock.seconds()
+        self.expire(now)
+        self.discard(rpcID, address)
+        if len(data) > self.maxBytes:
+            return
+        while self.bytes + len(data) > self.maxBytes:
+            key = next(self._messages.iterkeys())
+            self._remove(key)
+            self.evicted += 1
+        self._messages[(rpcID, address)] = [data, priority, now, 0]
+        self.bytes += len(data)
+
+    def request(self, rpcID, address):
+        """ Looks up a message whose receiver asked for missing fragments
+
+        @return: The message data and the priority it was sent at, or
+                 C{None} if it is no longer buffered (or was requested too
+                 often)
+        @rtype: tuple
+        """
+        self.expire()
+        entry = self._messages.get((rpcID, address))
+        if entry is None or entry[3] >= self.maxRequests:
+            return None
+        entry[3] += 1
+        self.retransmitted += 1
+        return entry[0], entry[1]
+
+    def acknowledge(self, rpcID, address):
+        """ Drops a message the receiver got in full """
+        if (rpcID, address) in self._messages:
+            self._remove((rpcID, address))
+            self.acknowledged += 1
+
+    def discard(self, rpcID, address):
+        if (rpcID, address) in self._messages:
+            self._remove((rpcID, address))
+
+    def expire(self, now=None):
+        """ Drops the messages sent more than C{timeout} seconds ago """
+        if now is None:
+            now = self._clock.seconds()
+        while self._messages:
+            key, entry = next(self._messages.iteritems())
+            if now - entry[2] < self.timeout:
+                break
+            self._remove(key)
+            self.evicted += 1
+
+    def stats(self):
+        """ Returns the buffered bytes and how messages left the buffer
+
+        @rtype: dict
+        """
+        return {'buffered': len(self._messages),
+                'bytes': self.bytes,
+                'acknowledged': self.acknowledged,
+                'retransmitted': self.retransmitted,
+                'evicted': self.evicted}
+
+    def _remove(self, key):
+        self.bytes -= len(self._messages.pop(key)[0])
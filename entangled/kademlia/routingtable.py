@@ -5,7 +5,7 @@
 # The docstrings in this module contain epytext markup; API documentation
 # may be created by processing this file with epydoc: http://epydoc.sf.net
 
-import time, random
+import bisect, heapq, time, random
 
 import constants
 import kbucket
@@ -127,6 +127,9 @@ class TreeRoutingTable(RoutingTable):
         """
         # Create the initial (single) k-bucket covering the range of the entire 160-bit ID space
         self._buckets = [kbucket.KBucket(rangeMin=0, rangeMax=2**160)]
+        # The rangeMin of each k-bucket in self._buckets, in the same
+        # (ascending) order, for looking up the bucket of a key by bisection
+        self._bucketBounds = [0]
         self._parentNodeID = parentNodeID
 
     def addContact(self, contact):
@@ -197,32 +200,32 @@ class TreeRoutingTable(RoutingTable):
         @type _rpcNodeID: str
         
         @return: A list of node contacts (C{kademlia.contact.Contact instances})
-                 closest to the specified key. 
+                 closest to the specified key, the closest first.
                  This method will return C{k} (or C{count}, if specified)
                  contacts if at all possible; it will only return fewer if the
                  node is returning all of the contacts that it knows of.
         @rtype: list
         """
-        #if key == self.id:
-        #    bucketIndex = 0 #TODO: maybe not allow this to continue?
-        #else:
-        bucketIndex = self._kbucketIndex(key)
-        closestNodes = self._buckets[bucketIndex].getContacts(constants.k, _rpcNodeID)
-        # This method must return k contacts (even if we have the node with the specified key as node ID), 
-        # unless there is less than k remote nodes in the routing table
-        i = 1
-        canGoLower = bucketIndex-i >= 0
-        canGoHigher = bucketIndex+i < len(self._buckets)
-        # Fill up the node list to k nodes, starting with the closest neighbouring nodes known 
-        while len(closestNodes) < constants.k and (canGoLower or canGoHigher):
-            #TODO: this may need to be optimized
-            if canGoLower:
-                closestNodes.extend(self._buckets[bucketIndex-i].getContacts(constants.k - len(closestNodes), _rpcNodeID))
-                canGoLower = bucketIndex-(i+1) >= 0
-            if canGoHigher:
-                closestNodes.extend(self._buckets[bucketIndex+i].getContacts(constants.k - len(closestNodes), _rpcNodeID))
-                canGoHigher = bucketIndex+(i+1) < len(self._buckets)
-            i += 1
+        keyValue = long(key.encode('hex'), 16)
+        # Every k-bucket covers a range of IDs sharing a prefix, which XOR
+        # with the key maps onto a range of distances sharing a prefix; these
+        # don't overlap, so all contacts of the k-bucket whose range starts
+        # closer to the key are closer than those of the others. Taking the
+        # k-buckets in that order, only the contacts within each need sorting,
+        # and the search ends with the k-bucket that fills up the list.
+        buckets = []
+        for bucket in self._buckets:
+            if len(bucket):
+                rangeSize = bucket.rangeMax - bucket.rangeMin
+                buckets.append(((keyValue ^ bucket.rangeMin) & ~(rangeSize - 1), bucket))
+        buckets.sort(key=lambda entry: entry[0])
+        closestNodes = []
+        for minDistance, bucket in buckets:
+            contacts = [contact for contact in bucket._contacts if contact.id != _rpcNodeID]
+            closestNodes.extend(heapq.nsmallest(constants.k - len(closestNodes), contacts,
+                                                key=lambda contact: long(contact.id.encode('hex'), 16) ^ keyValue))
+            if len(closestNodes) == constants.k:
+                break
         return closestNodes
 
     def getContact(self, contactID):
@@ -304,13 +307,9 @@ class TreeRoutingTable(RoutingTable):
         @rtype: int
         """
         valKey = long(key.encode('hex'), 16)
-        i = 0
-        for bucket in self._buckets:
-            if bucket.keyInRange(valKey):
-                return i
-            else:
-                i += 1
-        return i
+        # The k-buckets cover the ID space without gaps, so the last one
+        # starting at or below the key is the one covering it
+        return bisect.bisect_right(self._bucketBounds, valKey) - 1
 
     def _randomIDInBucketRange(self, bucketIndex):
         """ Returns a random ID in the specified k-bucket's range
@@ -344,6 +343,7 @@ class TreeRoutingTable(RoutingTable):
         oldBucket.rangeMax = splitPoint
         # Now, add the new bucket into the routing table tree
         self._buckets.insert(oldBucketIndex + 1, newBucket)
+        self._bucketBounds.insert(oldBucketIndex + 1, splitPoint)
         # Finally, copy all nodes that belong to the new k-bucket into it...
         for contact in oldBucket._contacts:
             if newBucket.keyInRange(contact.id):
@@ -396,8 +396,8 @@ class OptimizedTreeRoutingTable(TreeRoutingTable):
                 if contact in self._replacementCache[bucketIndex]:
                     self._replacementCache[bucketIndex].remove(contact)
                 #TODO: Using k to limit the size of the contact replacement cache - maybe define a seperate value for this in constants.py?
-                elif len(self._replacementCache) >= constants.k:
-                    self._replacementCache.pop(0)
+                elif len(self._replacementCache[bucketIndex]) >= constants.k:
+                    self._replacementCache[bucketIndex].pop(0)
                 self._replacementCache[bucketIndex].append(contact)
     
     def removeContact(self, contactID):
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+#
+# The docstrings in this module contain epytext markup; API documentation
+# may be created by processing this file with epydoc: http://epydoc.sf.net
+
+from collections import OrderedDict
+
+import constants
+
+#: Gains of the smoothed round-trip time and of its mean deviation, as in TCP
+#: (Jacobson/Karels; RFC 6298)
+rttGain = 0.125
+deviationGain = 0.25
+#: The timeout is the smoothed round-trip time plus this many mean deviations
+deviationFactor = 4
+
+class RTTEstimator(object):
+    """ Estimates the round-trip time of RPCs to each contact, and derives
+    per-contact RPC timeouts from it
+
+    Like TCP's retransmission timer, the timeout of a contact is its smoothed
+    RTT plus four times the RTT's mean deviation, kept between C{minTimeout}
+    and C{maxTimeout}; every timeout in a row doubles it (exponential
+    backoff), and the next response restores it. Contacts without a
+    response yet get C{initialTimeout}.
+
+    Only the C{maxContacts} most recently seen contacts are remembered.
+    """
+    def __init__(self, initialTimeout=None, minTimeout=constants.rpcTimeoutMin,
+                 maxTimeout=None, maxContacts=constants.rttMaxContacts):
+        """
+        @param initialTimeout: The timeout of contacts without RTT samples (in
+                               seconds); C{None} means C{constants.rpcTimeout}
+        @type initialTimeout: float
+        @param minTimeout: The shortest timeout (in seconds)
+        @type minTimeout: float
+        @param maxTimeout: The longest timeout (in seconds); C{None} means
+                           C{constants.rpcTimeout}
+        @type maxTimeout: float
+        @param maxContacts: The number of contacts whose estimates are kept
+        @type maxContacts: int
+        """
+        self._initialTimeout = initialTimeout
+        self.minTimeout = minTimeout
+        self._maxTimeout = maxTimeout
+        self.maxContacts = maxContacts
+        # Contact ID -> [smoothed RTT, mean deviation, backoff factor], least
+        # recently seen first
+        self._contacts = OrderedDict()
+        self.samples = 0
+        self.timeouts = 0
+
+    @property
+    def initialTimeout(self):
+        if self._initialTimeout is None:
+            return constants.rpcTimeout
+        return self._initialTimeout
+
+    @property
+    def maxTimeout(self):
+        if self._maxTimeout is None:
+            return constants.rpcTimeout
+        return self._maxTimeout
+
+    def __len__(self):
+        return len(self._contacts)
+
+    def sample(self, contactID, rtt):
+        """ Updates a contact's estimate with the round-trip time of an RPC it
+        answered
+
+        @param rtt: The time between sending the request and receiving the
+                    response (in seconds)
+        @type rtt: float
+        """
+        self.samples += 1
+        entry = self._contacts.pop(contactID, None)
+        if entry is None:
+            entry = [rtt, rtt / 2.0, 1]
+        else:
+            entry[1] += deviationGain * (abs(entry[0] - rtt) - entry[1])
+            entry[0] += rttGain * (rtt - entry[0])
+            entry[2] = 1
+        self._contacts[contactID] = entry
+        while len(self._contacts) > self.maxContacts:
+            self._contacts.popitem(last=False)
+
+    def timedOut(self, contactID):
+        """ Backs off a contact's timeout after an RPC to it timed out """
+        self.timeouts += 1
+        entry = self._contacts.get(contactID)
+        if entry is not None and self._timeout(entry) < self.maxTimeout:
+            entry[2] *= 2
+
+    def estimate(self, contactID):
+        """ Returns how long a response from a contact may take (in seconds),
+        ignoring the timeout bounds and backoff, or C{None} for contacts
+        without RTT samples
+
+        @rtype: float
+        """
+        entry = self._contacts.get(contactID)
+        if entry is None:
+            return None
+        return entry[0] + deviationFactor * entry[1]
+
+    def timeout(self, contactID):
+        """ Returns the RPC timeout of a contact (in seconds)
+
+        @rtype: float
+        """
+        entry = self._contacts.get(contactID)
+        if entry is None:
+            return self.initialTimeout
+        return self._timeout(entry)
+
+    def stats(self):
+        """ Returns the number of contacts and samples, and the timeouts that
+        occurred
+
+        @rtype: dict
+        """
+        return {'contacts': len(self._contacts),
+                'samples': self.samples,
+                'timeouts': self.timeouts}
+
+    def _timeout(self, entry):
+        timeout = (entry[0] + deviationFactor * entry[1]) * entry[2]
+        return min(max(timeout, self.minTimeout), self.maxTimeout)
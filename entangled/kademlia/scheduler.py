@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+#
+# The docstrings in this module contain epytext markup; API documentation
+# may be created by processing this file with epydoc: http://epydoc.sf.net
+
+from collections import deque
+
+import twisted.internet.reactor
+from twisted.python import log
+
+import constants
+
+# Queues, in the order they are drained
+(
+    priorityResponse,
+    priorityRequest
+) = range(2)
+
+#: The shortest time the queues are left waiting for the bucket to refill
+minimumWait = 1e-6
+
+class SendScheduler(object):
+    """ Paces outgoing UDP packets with a token bucket
+
+    Packets are queued by priority - responses go ahead of new requests - and
+    sent as long as the bucket holds a token for the packet and enough byte
+    tokens for its size. A single timer drains the queues: right after the
+    current reactor iteration, and later on whenever the bucket has refilled.
+    """
+    def __init__(self, write, packetsPerSecond=constants.sendPacketsPerSecond,
+                 packetBurst=constants.sendPacketBurst,
+                 bytesPerSecond=constants.sendBytesPerSecond,
+                 byteBurst=constants.sendByteBurst,
+                 clock=twisted.internet.reactor):
+        """
+        @param write: Called with the packet data and address to send a packet
+        @type write: callable
+        @param packetsPerSecond: The rate packet tokens refill at
+        @type packetsPerSecond: float
+        @param packetBurst: The number of packet tokens the bucket holds
+        @type packetBurst: int
+        @param bytesPerSecond: The rate byte tokens refill at, or C{None} to
+                               not limit the bandwidth
+        @type bytesPerSecond: float
+        @param byteBurst: The number of byte tokens the bucket holds
+        @type byteBurst: int
+        @param clock: Provides the time, and schedules the timer
+        @type clock: twisted.internet.interfaces.IReactorTime
+        """
+        self._write = write
+        self.packetsPerSecond = float(packetsPerSecond)
+        self.packetBurst = packetBurst
+        if bytesPerSecond is not None:
+            bytesPerSecond = float(bytesPerSecond)
+        self.bytesPerSecond = bytesPerSecond
+        self.byteBurst = byteBurst
+        self._clock = clock
+        self._packetTokens = float(packetBurst)
+        self._byteTokens = float(byteBurst)
+        self._lastRefill = clock.seconds()
+        self._queues = (deque(), deque())
+        self._timer = None
+        self.sent = 0
+        self.maxQueueDepth = 0
+        self.totalDelay = 0.0
+        self.maxDelay = 0.0
+
+    def queueDepth(self):
+        """ The number of packets waiting to be sent """
+        return len(self._queues[0]) + len(self._queues[1])
+
+    def enqueue(self, data, address, priority=priorityRequest):
+        """ Queues a packet for sending
+
+        @param priority: C{priorityResponse} or C{priorityRequest}
+        @type priority: int
+        """
+        self._queues[priority].append((data, address, self._clock.seconds()))
+        depth = self.queueDepth()
+        if depth > self.maxQueueDepth:
+            self.maxQueueDepth = depth
+        if self._timer is None:
+            self._timer = self._clock.callLater(0, self._drain)
+
+    def stop(self):
+        """ Drops all queued packets, and cancels the timer """
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+        self._timer = None
+        for queue in self._queues:
+            queue.clear()
+
+    def stats(self):
+        """ Returns the queue depth and the pacing delay of sent packets
+
+        @rtype: dict
+        """
+        return {'queueDepth': self.queueDepth(),
+                'maxQueueDepth': self.maxQueueDepth,
+                'sent': self.sent,
+                'meanDelay': (self.totalDelay / self.sent) if self.sent else 0.0,
+                'maxDelay': self.maxDelay}
+
+    def _refill(self, now):
+        elapsed = max(now - self._lastRefill, 0)
+        self._lastRefill = now
+        self._packetTokens = min(self.packetBurst,
+                                 self._packetTokens + elapsed*self.packetsPerSecond)
+        if self.bytesPerSecond is not None:
+            self._byteTokens = min(self.byteBurst,
+                                   self._byteTokens + elapsed*self.bytesPerSecond)
+
+    def _wait(self, size):
+        """ Returns how long it takes until a packet of C{size} bytes may go """
+        wait = (1 - self._packetTokens) / self.packetsPerSecond
+        if self.bytesPerSecond is not None:
+            # Packets larger than the bucket go once it is full
+            needed = min(size, self.byteBurst) - self._byteTokens
+            wait = max(wait, needed / self.bytesPerSecond)
+        return max(wait, 0)
+
+    def _drain(self):
+        self._timer = None
+        now = self._clock.seconds()
+        self._refill(now)
+        for queue in self._queues:
+            while queue:
+                data, address, enqueued = queue[0]
+                wait = self._wait(len(data))
+                if wait > 0:
+                    # Timestamps as large as time.time()'s can't tell apart
+                    # times less than a microsecond apart, so a shorter wait
+                    # would find the clock (and the bucket) unchanged
+                    self._timer = self._clock.callLater(max(wait, minimumWait),
+                                                        self._drain)
+                    return
+                queue.popleft()
+                self._packetTokens -= 1
+                if self.bytesPerSecond is not None:
+                    self._byteTokens -= len(data)
+                delay = now - enqueued
+                self.sent += 1
+                self.totalDelay += delay
+                if delay > self.maxDelay:
+                    self.maxDelay = delay
+                try:
+                    self._write(data, address)
+                except Exception:
+                    log.err()
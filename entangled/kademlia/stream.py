@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+#
+# The docstrings in this module contain epytext markup; API documentation
+# may be created by processing this file with epydoc: http://epydoc.sf.net
+
+""" TCP transport for messages too large to be sent efficiently over UDP
+
+Nodes listen for TCP connections on the port number of their UDP port. Every
+connection starts with a hello message in each direction, carrying the
+sender's UDP port and a random token, so that messages can be attributed to
+the sender's UDP address - which is what contacts are known by. The UDP port
+an incoming connection claims isn't taken on trust, though: the connecting
+node has to send the token it got back in a UDP datagram, from that very
+port. Only then does the accepting node confirm the connection with an empty
+message, and messages flow. A peer that doesn't complete this handshake in
+time - some other TCP service listening on the port, say - is treated like
+one that can't be connected to, and its messages go over UDP instead.
+
+Messages are framed by a 4-byte length prefix. Connections are kept open and
+reused in both directions until they have been idle for a while.
+"""
+
+import os
+import struct
+
+from twisted.internet import error, protocol
+from twisted.protocols import basic
+import twisted.internet.reactor
+
+import constants
+
+#: The last byte of the header of the UDP datagram that returns a token (see
+#: KademliaProtocol._sendStreamToken)
+tokenIndicator = '\x04'
+tokenSize = 20
+_hello = struct.Struct('!H%ds' % tokenSize)
+
+class StreamConnection(basic.Int32StringReceiver):
+    """ A connection to another node, in the pool of a C{StreamPool} """
+    MAX_LENGTH = constants.streamMaxMessageSize
+
+    def __init__(self, pool, address=None):
+        """
+        @param address: The UDP address of the node, if the connection is an
+                        outgoing one; incoming connections learn it from the
+                        node's hello message
+        @type address: tuple
+        """
+        self.pool = pool
+        self.address = address
+        self.outgoing = address is not None
+        self.connected = False
+        self.greeted = False
+        # Whether the handshake is complete, so messages may be exchanged
+        self.ready = False
+        # The UDP address an incoming connection claims, until it is confirmed
+        self.claimed = None
+        # The token the node has to send back over UDP
+        self.token = os.urandom(tokenSize)
+        self.handshakeCall = None
+        self.connector = None
+        self.lastUsed = pool._reactor.seconds()
+        # Messages to send once the connection is made
+        self.queue = []
+
+    def connectionMade(self):
+        self.connected = True
+        self.sendString(_hello.pack(self.pool.port, self.token))
+        self.pool._connected(self)
+
+    def stringReceived(self, data):
+        self.lastUsed = self.pool._reactor.seconds()
+        if not self.greeted:
+            self.greeted = True
+            if len(data) != _hello.size:
+                self.transport.loseConnection()
+            else:
+                port, token = _hello.unpack(data)
+                self.pool._greeted(self, port, token)
+        elif self.ready:
+            self.pool._received(data, self.address)
+        elif self.outgoing and data == '':
+            # The node confirmed our UDP port
+            self.pool._ready(self)
+        else:
+            # A message before the handshake is complete
+            self.transport.loseConnection()
+
+    def lengthLimitExceeded(self, length):
+        self.transport.loseConnection()
+
+    def connectionLost(self, reason=protocol.connectionDone):
+        self.connected = False
+        self.pool._lost(self)
+
+    def send(self, data):
+        self.lastUsed = self.pool._reactor.seconds()
+        self.sendString(data)
+
+
+class _StreamClientFactory(protocol.ClientFactory):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def buildProtocol(self, addr):
+        return self.connection
+
+    def clientConnectionFailed(self, connector, reason):
+        self.connection.pool._connectFailed(self.connection)
+
+
+class StreamPool(protocol.ServerFactory):
+    """ Keeps a pool of keep-alive TCP connections to other nodes
+
+    A node gets at most C{maxConnectionsPerPeer} connections (one of which we
+    open ourselves, if it hasn't opened one to us already), and the pool at
+    most C{maxConnections}; the least recently used connection is closed to
+    make room. Connections that have been idle for C{idleTimeout} seconds are
+    closed as well.
+
+    Nodes we can't connect to, or that don't complete the handshake within
+    C{handshakeTimeout} seconds, are left alone for C{retryInterval} seconds;
+    the messages for them are handed back to be sent over UDP.
+    """
+    def __init__(self, receive, fallback, sendToken,
+                 maxConnections=constants.streamMaxConnections,
+                 maxConnectionsPerPeer=constants.streamMaxConnectionsPerPeer,
+                 idleTimeout=constants.streamIdleTimeout,
+                 retryInterval=constants.streamRetryInterval,
+                 handshakeTimeout=constants.streamHandshakeTimeout,
+                 reactor=twisted.internet.reactor):
+        """
+        @param receive: Called with a received message and the UDP address
+                        of its sender
+        @type receive: callable
+        @param fallback: Called with a message, its RPC ID, destination UDP
+                         address and send priority if it couldn't be sent
+                         over TCP
+        @type fallback: callable
+        @param sendToken: Called with a token and a UDP address; sends the
+                          token there in a UDP datagram, from our UDP port
+        @type sendToken: callable
+        @param reactor: Provides the time, and makes the connections
+        @type reactor: twisted.internet.interfaces.IReactorTCP
+        """
+        self._receive = receive
+        self._fallback = fallback
+        self._sendToken = sendToken
+        self.maxConnections = maxConnections
+        self.maxConnectionsPerPeer = maxConnectionsPerPeer
+        self.idleTimeout = idleTimeout
+        self.retryInterval = retryInterval
+        self.handshakeTimeout = handshakeTimeout
+        self._reactor = reactor
+        #: Our UDP port, which is also the TCP port we listen on
+        self.port = None
+        self._listeningPort = None
+        # UDP address -> connections to that node
+        self._connections = {}
+        # Incoming connections whose UDP address isn't confirmed yet
+        self._pending = set()
+        # Token -> incoming connection that said hello, and has to send it
+        # back over UDP
+        self._tokens = {}
+        # UDP address -> time until which it isn't connected to again
+        self._unreachable = {}
+        self._sweepCall = None
+        self.opened = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.failed = 0
+        self.evicted = 0
+        self.messagesSent = 0
+        self.bytesSent = 0
+        self.messagesReceived = 0
+
+    def listen(self, port):
+        """ Starts accepting connections on the specified TCP port """
+        self.port = port
+        try:
+            self._listeningPort = self._reactor.listenTCP(port, self)
+        except error.CannotListenError, e:
+            print 'Cannot accept TCP connections: %s' % e
+
+    def stop(self):
+        """ Stops listening, and closes all connections """
+        if self._listeningPort is not None:
+            self._listeningPort.stopListening()
+            self._listeningPort = None
+        if self._sweepCall is not None and self._sweepCall.active():
+            self._sweepCall.cancel()
+        self._sweepCall = None
+        for connections in self._connections.values():
+            for connection in connections:
+                connection.queue = []
+                self._close(connection)
+        for connection in self._pending:
+            self._close(connection)
+        self._connections = {}
+        self._pending = set()
+        self._tokens = {}
+
+    def confirm(self, token, address):
+        """ Called with a token that came back in a UDP datagram from the
+        specified address; completes the handshake of the incoming connection
+        it was handed out on, if that connection claimed the address """
+        connection = self._tokens.get(token)
+        if connection is None or connection.claimed != address:
+            return
+        del self._tokens[token]
+        self._register(connection, address)
+
+    def send(self, data, rpcID, address, priority):
+        """ Sends a message over a pooled connection to the node at the
+        specified UDP address, connecting to it if necessary
+
+        @return: C{False} if the node can't be reached over TCP, or the
+                 message is larger than a connection accepts
+        @rtype: bool
+        """
+        if len(data) > constants.streamMaxMessageSize:
+            return False
+        now = self._reactor.seconds()
+        if address in self._unreachable:
+            if now < self._unreachable[address]:
+                return False
+            del self._unreachable[address]
+        connections = self._connections.get(address)
+        if not connections:
+            if self.port is None:
+                return False
+            connection = StreamConnection(self, address)
+            self._add(connection)
+            self.opened += 1
+            connection.connector = self._reactor.connectTCP(
+                address[0], address[1], _StreamClientFactory(connection),
+                timeout=constants.rpcTimeout)
+            connections = [connection]
+        self.messagesSent += 1
+        self.bytesSent += len(data)
+        # Prefer connections that are already up
+        for connection in connections:
+            if connection.ready:
+                connection.send(data)
+                return True
+        connections[0].queue.append((data, rpcID, priority))
+        return True
+
+    def connectionCount(self):
+        return sum([len(connections) for connections in self._connections.values()])
+
+    def stats(self):
+        """ Returns the connection counts and message totals
+
+        @rtype: dict
+        """
+        return {'connections': self.connectionCount(),
+                'opened': self.opened,
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'failed': self.failed,
+                'evicted': self.evicted,
+                'messagesSent': self.messagesSent,
+                'bytesSent': self.bytesSent,
+                'messagesReceived': self.messagesReceived}
+
+    def buildProtocol(self, addr):
+        # Incoming connections join the pool once their UDP address is
+        # confirmed
+        if len(self._pending) >= self.maxConnections:
+            self.rejected += 1
+            return None
+        connection = StreamConnection(self)
+        self._pending.add(connection)
+        if self._sweepCall is None:
+            self._sweepCall = self._reactor.callLater(self.idleTimeout / 2.0, self._sweep)
+        return connection
+
+    def _add(self, connection):
+        """ Adds a connection to the pool, closing the least recently used
+        one if the pool is full """
+        if self.connectionCount() >= self.maxConnections:
+            oldest = None
+            for connections in self._connections.values():
+                for other in connections:
+                    if oldest is None or other.lastUsed < oldest.lastUsed:
+                        oldest = other
+            self._discard(oldest)
+            self._close(oldest)
+            self.evicted += 1
+        self._connections.setdefault(connection.address, []).append(connection)
+        if self._sweepCall is None:
+            self._sweepCall = self._reactor.callLater(self.idleTimeout / 2.0, self._sweep)
+
+    def _greeted(self, connection, port, token):
+        """ Called with the UDP port and token in the hello of a node """
+        if connection.outgoing:
+            if port != connection.address[1]:
+                # Not the node we wanted to reach
+                connection.transport.loseConnection()
+                return
+            self._sendToken(token, connection.address)
+        else:
+            connection.claimed = (connection.transport.getPeer().host, port)
+            self._tokens[connection.token] = connection
+
+    def _register(self, connection, address):
+        """ Called once the UDP address of an incoming connection is
+        confirmed """
+        self._pending.discard(connection)
+        if len(self._connections.get(address, ())) >= self.maxConnectionsPerPeer:
+            self.rejected += 1
+            connection.transport.loseConnection()
+            return
+        connection.address = address
+        self.accepted += 1
+        self._add(connection)
+        # Tells the node its UDP address was confirmed
+        connection.send('')
+        self._ready(connection)
+
+    def _connected(self, connection):
+        connection.handshakeCall = self._reactor.callLater(
+            self.handshakeTimeout, self._handshakeTimeout, connection)
+
+    def _ready(self, connection):
+        """ Called once the handshake of a connection is complete """
+        connection.ready = True
+        self._cancelHandshake(connection)
+        queue, connection.queue = connection.queue, []
+        for data, rpcID, priority in queue:
+            connection.send(data)
+
+    def _handshakeTimeout(self, connection):
+        connection.handshakeCall = None
+        if not connection.ready:
+            self._close(connection)
+
+    def _cancelHandshake(self, connection):
+        if connection.handshakeCall is not None and connection.handshakeCall.active():
+            connection.handshakeCall.cancel()
+        connection.handshakeCall = None
+
+    def _connectFailed(self, connection):
+        self._giveUp(connection)
+        queue, connection.queue = connection.queue, []
+        for data, rpcID, priority in queue:
+            self._fallback(data, rpcID, connection.address, priority)
+
+    def _lost(self, connection):
+        self._cancelHandshake(connection)
+        self._pending.discard(connection)
+        if self._tokens.get(connection.token) is connection:
+            del self._tokens[connection.token]
+        if connection.outgoing and not connection.ready:
+            self._giveUp(connection)
+        self._discard(connection)
+        queue, connection.queue = connection.queue, []
+        for data, rpcID, priority in queue:
+            self._fallback(data, rpcID, connection.address, priority)
+
+    def _giveUp(self, connection):
+        """ Leaves a node alone for a while, after connecting to it failed """
+        if connection in self._connections.get(connection.address, ()):
+            # ...rather than given up on to make room in the pool
+            self.failed += 1
+            self._discard(connection)
+            self._unreachable[connection.address] = self._reactor.seconds() + self.retryInterval
+
+    def _received(self, data, address):
+        self.messagesReceived += 1
+        self._receive(data, address)
+
+    def _discard(self, connection):
+        connections = self._connections.get(connection.address)
+        if connections is not None and connection in connections:
+            connections.remove(connection)
+            if not connections:
+                del self._connections[connection.address]
+
+    def _close(self, connection):
+        if connection.connected:
+            connection.transport.loseConnection()
+        elif connection.connector is not None:
+            connection.connector.disconnect()
+
+    def _sweep(self):
+        """ Closes the connections that have been idle for too long """
+        self._sweepCall = None
+        now = self._reactor.seconds()
+        for connections in self._connections.values():
+            for connection in connections[:]:
+                if now - connection.lastUsed >= self.idleTimeout:
+                    self._discard(connection)
+                    self._close(connection)
+                    self.evicted += 1
+        for connection in list(self._pending):
+            if now - connection.lastUsed >= self.idleTimeout:
+                self._pending.discard(connection)
+                self._close(connection)
+        for address, until in self._unreachable.items():
+            if now >= until:
+                del self._unreachable[address]
+        if self._connections or self._pending:
+            self._sweepCall = self._reactor.callLater(self.idleTimeout / 2.0, self._sweep)
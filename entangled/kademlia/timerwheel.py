@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+#
+# The docstrings in this module contain epytext markup; API documentation
+# may be created by processing this file with epydoc: http://epydoc.sf.net
+
+import math
+
+import twisted.internet.reactor
+from twisted.internet import error
+from twisted.python import log
+
+import constants
+
+#: Every level of the wheel has 2**wheelBits slots...
+wheelBits = 8
+#: ...and there are this many levels; timers further away than the last level
+#: reaches are parked in its last slot until they come within reach
+wheelLevels = 4
+
+class Timer(object):
+    """ A timer scheduled on a L{TimerWheel}
+
+    Like the C{DelayedCall}s returned by C{reactor.callLater}, it can be
+    cancelled until it fires.
+    """
+    def __init__(self, wheel, tick, time, func, args, kw):
+        self._wheel = wheel
+        self._tick = tick
+        self.time = time
+        self.func = func
+        self.args = args
+        self.kw = kw
+        # The wheel slot holding this timer, if it is pending
+        self._slot = None
+        self.cancelled = False
+        self.called = False
+
+    def getTime(self):
+        return self.time
+
+    def active(self):
+        return not (self.cancelled or self.called)
+
+    def cancel(self):
+        if self.cancelled:
+            raise error.AlreadyCancelled
+        if self.called:
+            raise error.AlreadyCalled
+        self.cancelled = True
+        self._wheel._remove(self)
+
+class TimerWheel(object):
+    """ Hierarchical timing wheel (Varghese and Lauck), for the many
+    short-lived timers of RPC timeouts
+
+    Timers are rounded up to ticks of C{resolution} seconds, and filed in
+    the slot of the tick they expire in, so that scheduling and cancelling
+    them takes constant time. The first level has a slot per tick; a slot of
+    each further level covers a full turn of the level below, and is spread
+    over it (cascaded) when that level comes round to it.
+
+    All timers expiring in the same tick are run together, from a single
+    reactor call. The wheel keeps only that one call pending, for the next
+    tick that holds any timers.
+    """
+    def __init__(self, resolution=constants.rpcTimerResolution,
+                 clock=twisted.internet.reactor):
+        """
+        @param resolution: The length of a tick (in seconds)
+        @type resolution: float
+        @param clock: Provides the time, and runs the wheel
+        @type clock: twisted.internet.interfaces.IReactorTime
+        """
+        self.resolution = resolution
+        self._clock = clock
+        self._slotCount = 1 << wheelBits
+        self._mask = self._slotCount - 1
+        self._levels = [[set() for i in range(self._slotCount)]
+                        for level in range(wheelLevels)]
+        # The first tick that hasn't been run yet
+        self._tick = None
+        # The reactor call that runs the wheel, and the tick it is due at
+        self._call = None
+        self._callTick = None
+        self._running = False
+        self.pending = 0
+        self.expired = 0
+        self.cancelled = 0
+        self.batches = 0
+
+    def __len__(self):
+        return self.pending
+
+    def callLater(self, delay, func, *args, **kw):
+        """ Schedules a function to be called in C{delay} seconds (or up to
+        one tick later)
+
+        @return: The timer, which can be cancelled
+        @rtype: L{Timer}
+        """
+        now = self._clock.seconds()
+        if self.pending == 0:
+            # Nothing to catch up on
+            self._tick = int(math.floor(now / self.resolution))
+        time = now + delay
+        tick = max(int(math.ceil(time / self.resolution)), self._tick)
+        timer = Timer(self, tick, time, func, args, kw)
+        self._insert(timer)
+        self.pending += 1
+        if not self._running and (self._callTick is None or tick < self._callTick):
+            self._schedule(tick)
+        return timer
+
+    def stats(self):
+        """ Returns the number of pending timers, how many expired or were
+        cancelled, and in how many batches the expired ones were run
+
+        @rtype: dict
+        """
+        return {'pending': self.pending,
+                'expired': self.expired,
+                'cancelled': self.cancelled,
+                'batches': self.batches}
+
+    def _insert(self, timer):
+        ticks = timer._tick - self._tick
+        for level in range(wheelLevels):
+            if ticks < 1 << (wheelBits * (level + 1)):
+                break
+        else:
+            # Beyond the wheel's reach: park it in the last slot it reaches
+            level = wheelLevels - 1
+            ticks = (1 << (wheelBits * wheelLevels)) - 1
+        index = ((self._tick + ticks) >> (wheelBits * level)) & self._mask
+        timer._slot = self._levels[level][index]
+        timer._slot.add(timer)
+
+    def _remove(self, timer):
+        timer._slot.discard(timer)
+        timer._slot = None
+        self.pending -= 1
+        self.cancelled += 1
+        if self.pending == 0 and self._call is not None:
+            self._call.cancel()
+            self._call = None
+            self._callTick = None
+
+    def _schedule(self, tick):
+        delay = max(tick * self.resolution - self._clock.seconds(), 0)
+        if self._call is not None:
+            self._call.reset(delay)
+        else:
+            self._call = self._clock.callLater(delay, self._run)
+        self._callTick = tick
+
+    def _cascade(self, level):
+        """ Spreads the timers of the current slot of a level over the levels
+        below it
+
+        @return: Whether the level came round to its first slot, i.e. the
+                 next level needs to be cascaded too
+        @rtype: bool
+        """
+        index = (self._tick >> (wheelBits * level)) & self._mask
+        slot = self._levels[level][index]
+        if slot:
+            self._levels[level][index] = set()
+            for timer in slot:
+                self._insert(timer)
+        return index == 0
+
+    def _run(self):
+        """ Runs the timers of all ticks up to the current one """
+        self._call = None
+        # Floating point error must not leave the tick we were called for
+        # behind
+        nowTick = max(int(math.floor(self._clock.seconds() / self.resolution)),
+                      self._callTick)
+        self._callTick = None
+        self._running = True
+        while self.pending and self._tick <= nowTick:
+            if self._tick & self._mask == 0:
+                level = 1
+                while level < wheelLevels and self._cascade(level):
+                    level += 1
+            index = self._tick & self._mask
+            slot = self._levels[0][index]
+            self._tick += 1
+            if not slot:
+                continue
+            self._levels[0][index] = set()
+            self.batches += 1
+            for timer in sorted(slot, key=lambda timer: timer.time):
+                if timer.cancelled:
+                    # Cancelled by an earlier timer of this batch
+                    continue
+                timer._slot = None
+                timer.called = True
+                self.pending -= 1
+                self.expired += 1
+                try:
+                    timer.func(*timer.args, **timer.kw)
+                except Exception:
+                    log.err()
+        self._running = False
+        if self.pending:
+            self._schedule(self._nextTick())
+
+    def _nextTick(self):
+        """ Returns the next tick with timers on the first level, or the one
+        the next cascade happens at """
+        tick = self._tick
+        while True:
+            if tick & self._mask == 0 or self._levels[0][tick & self._mask]:
+                return tick
+            tick += 1
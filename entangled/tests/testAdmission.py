@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import unittest
+
+from twisted.internet import defer, task
+from twisted.python import failure
+
+import entangled.kademlia.admission as admission
+
+class RPCLimiterTest(unittest.TestCase):
+    """ Test case for the limiter that bounds the RPCs in flight """
+    def setUp(self):
+        self.clock = task.Clock()
+        self.limiter = admission.RPCLimiter(maxInFlight=3, maxInFlightPerContact=2,
+                                            clock=self.clock)
+        self.sent = []
+
+    def submit(self, contactID, name, priority=admission.priorityLookup):
+        df = defer.Deferred()
+        self.limiter.submit(contactID, lambda: self.sent.append(name), df, priority)
+        return df
+
+    def testBounds(self):
+        """ Tests that RPCs beyond the global and per-contact bounds wait """
+        for name in ('a1', 'a2', 'a3', 'b1', 'c1'):
+            self.submit(name[0], name)
+        self.failUnlessEqual(self.sent, ['a1', 'a2', 'b1'])
+        self.failUnlessEqual(self.limiter.stats()['queued'], 2)
+        self.limiter.release('b')
+        # a is still at its bound, so c goes first
+        self.failUnlessEqual(self.sent, ['a1', 'a2', 'b1', 'c1'])
+        self.limiter.release('c')
+        self.failUnlessEqual(len(self.sent), 4)
+        self.limiter.release('a')
+        self.failUnlessEqual(self.sent[-1], 'a3')
+        self.failUnlessEqual(self.limiter.inFlight, 2)
+
+    def testPriority(self):
+        """ Tests that waiting lookups are sent before waiting maintenance RPCs """
+        for name in ('a', 'b', 'c'):
+            self.submit(name, name)
+        self.submit('d', 'maintenance', admission.priorityMaintenance)
+        self.submit('e', 'lookup')
+        self.limiter.release('a')
+        self.failUnlessEqual(self.sent[-1], 'lookup')
+        self.limiter.release('b')
+        self.failUnlessEqual(self.sent[-1], 'maintenance')
+
+    def testFairness(self):
+        """ Tests that contacts with waiting RPCs take turns """
+        for name in ('x', 'y', 'z'):
+            self.submit(name, name)
+        for i in range(3):
+            self.submit('a', 'a%d' % i)
+        self.submit('b', 'b0')
+        for contactID in ('x', 'y', 'z'):
+            self.limiter.release(contactID)
+        self.failUnlessEqual(self.sent[3:], ['a0', 'b0', 'a1'])
+
+    def testWaitTimes(self):
+        """ Tests that the time RPCs waited is reported per priority class """
+        for name in ('a', 'b', 'c'):
+            self.submit(name, name)
+        self.submit('d', 'd', admission.priorityMaintenance)
+        self.clock.advance(2)
+        self.limiter.release('a')
+        stats = self.limiter.stats()
+        self.failUnlessEqual(stats['waited'], [0, 1])
+        self.failUnlessEqual(stats['meanWait'], [0.0, 2.0])
+        self.failUnlessEqual(stats['maxWait'], [0.0, 2.0])
+
+    def testSendFailure(self):
+        """ Tests that an RPC failing to be sent doesn't keep its place """
+        def fail():
+            raise ValueError('unencodable')
+        self.failUnlessRaises(ValueError, self.limiter.submit, 'a', fail, defer.Deferred())
+        self.failUnlessEqual(self.limiter.inFlight, 0)
+        # Once queued, the failure goes to the RPC's deferred instead
+        for name in ('a', 'b', 'c'):
+            self.submit(name, name)
+        errors = []
+        self.limiter.submit('d', fail, defer.Deferred().addErrback(errors.append))
+        self.limiter.release('a')
+        self.failUnless(errors[0].check(ValueError))
+        self.failUnlessEqual(self.limiter.inFlight, 2)
+
+    def testFailQueued(self):
+        """ Tests that waiting RPCs are failed, and never sent, when the limiter is cleared """
+        for name in ('a', 'b', 'c'):
+            self.submit(name, name)
+        errors = []
+        self.submit('d', 'd').addErrback(errors.append)
+        self.submit('e', 'e', admission.priorityMaintenance).addErrback(errors.append)
+        self.limiter.failQueued(failure.Failure(defer.CancelledError()))
+        self.failUnlessEqual(len(errors), 2)
+        self.failUnless(errors[1].check(defer.CancelledError))
+        self.failUnlessEqual(self.limiter.stats()['queued'], 0)
+        self.limiter.release('a')
+        self.failUnlessEqual(self.sent, ['a', 'b', 'c'])
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(RPCLimiterTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
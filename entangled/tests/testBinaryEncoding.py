@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import unittest
+
+import Crypto.PublicKey.RSA
+
+from entangled.kademlia.encoding import DecodeError
+import binaryencoding
+import compression
+import msgformat
+import msgtypes
+
+nodeID = 'n' * 20
+contactIPv4 = ('c' * 20, '10.0.0.1', 4000)
+contactIPv6 = ('d' * 20, '2001:db8::1', 4001)
+
+class BinaryEncodingTest(unittest.TestCase):
+    """ Test case for the binary encoding of message primitives """
+    def setUp(self):
+        self.encoding = binaryencoding.BinaryEncoding()
+        self.cases = (0, 42, -1, 2**63 - 1, -2**63, 2**64, -2**200,
+                      1.5, None, True, False,
+                      '', 'spam', nodeID, 300 * 'x', 70000 * 'y', u'gr\xfc\xdfe',
+                      [], (), {}, ['spam', 42], ('spam', 42),
+                      {'a': {'b': None}, 'c': ''}, {0: 'x', 1: []},
+                      [{'a': 1}, [2, (3, [])]],
+                      contactIPv4, contactIPv6,
+                      [contactIPv4, contactIPv4], [contactIPv6],
+                      # Mixed address families go as plain tuples
+                      [contactIPv4, contactIPv6],
+                      {'contacts': [contactIPv4], 'value': 'v'})
+        # Non-contact tuples that merely resemble contact triples
+        self.nonContacts = ((nodeID, '10.0.0.1', 70000),
+                            (nodeID, '10.0.0.1', -1),
+                            (nodeID, '10.0.0.1', '4000'),
+                            (nodeID, '10.0.0.1', True),
+                            (nodeID, '010.0.0.1', 4000),
+                            (nodeID, '2001:DB8::1', 4000),
+                            (nodeID, 'localhost', 4000),
+                            (nodeID, 4000, '10.0.0.1'),
+                            (19 * 'n', '10.0.0.1', 4000),
+                            (nodeID, '10.0.0.1', 4000, 'extra'),
+                            [nodeID, '10.0.0.1', 4000])
+
+    def failUnlessSame(self, value, decoded):
+        """ Fails unless the decoded value equals the original, down to the types of its containers """
+        self.failUnlessEqual(decoded, value)
+        self.failUnlessEqual(type(decoded) in (int, long), type(value) in (int, long),
+                             'Type changed from %s to %s' % (type(value), type(decoded)))
+        if type(value) not in (int, long):
+            self.failUnlessEqual(type(decoded), type(value))
+        if type(value) in (list, tuple):
+            for item, decodedItem in zip(value, decoded):
+                self.failUnlessSame(item, decodedItem)
+        elif type(value) == dict:
+            for key in value:
+                self.failUnlessSame(value[key], decoded[key])
+
+    def testRoundTrip(self):
+        """ Tests that decoding an encoded value returns the value """
+        for value in self.cases:
+            self.failUnlessSame(value, self.encoding.decode(self.encoding.encode(value)))
+
+    def testContactTriples(self):
+        """ Tests that contact triples are packed, and non-contact tuples survive a round trip """
+        self.failUnlessEqual(self.encoding.encode(contactIPv4)[1], 'c')
+        self.failUnlessEqual(len(self.encoding.encode(contactIPv4)), 2 + 26)
+        self.failUnlessEqual(self.encoding.encode([contactIPv6])[1], 'V')
+        for value in self.nonContacts:
+            encoded = self.encoding.encode(value)
+            self.failIf(encoded[1] in 'cvCV', '%r was packed as a contact' % (value,))
+            self.failUnlessSame(value, self.encoding.decode(encoded))
+            self.failUnlessSame([value, value], self.encoding.decode(self.encoding.encode([value, value])))
+
+    def testTruncated(self):
+        """ Tests that every truncation of an encoded value is rejected """
+        for value in self.cases:
+            encoded = self.encoding.encode(value)
+            for length in range(len(encoded)):
+                self.failUnlessRaises(DecodeError, self.encoding.decode, encoded[:length])
+
+    def testMalformed(self):
+        """ Tests that malformed input is rejected """
+        for encoded in ('\x02i' + 8 * '\x00',   # Unknown format version
+                        '\x01Z',                # Unknown type tag
+                        '\x01u\x00\x00\x00\x01\xff', # Invalid UTF-8
+                        'd1:ai1ee'):            # Bencode
+            self.failUnlessRaises(DecodeError, self.encoding.decode, encoded)
+
+    def testOversized(self):
+        """ Tests that lengths and counts beyond the end of the input are rejected """
+        for encoded in ('\x01S\xff\xff\xff\xffspam',
+                        '\x01u\xff\xff\xff\xffspam',
+                        '\x01l\xff\xff\xff\xffN',
+                        '\x01d\xff\xff\xff\xffNN',
+                        '\x01C\xff\xff\xff\xff' + 26 * 'c',
+                        '\x01L+\xff\xff\x01'):
+            self.failUnlessRaises(DecodeError, self.encoding.decode, encoded)
+        self.failUnlessRaises(TypeError, self.encoding.encode, 2 ** (8 * 0x10000))
+        self.failUnlessRaises(TypeError, self.encoding.encode, object())
+
+
+class TintangledBinaryFormatTest(unittest.TestCase):
+    """ Test case for the binary message format """
+    rsaKey = None
+
+    def setUp(self):
+        if TintangledBinaryFormatTest.rsaKey is None:
+            TintangledBinaryFormatTest.rsaKey = Crypto.PublicKey.RSA.generate(1024).publickey()
+        self.encoding = binaryencoding.BinaryEncoding()
+        self.translator = msgformat.TintangledBinaryFormat(
+            compressor=compression.Compressor(threshold=100))
+        self.args = {'key': nodeID, 'value': 'v', 'contacts': [contactIPv4, contactIPv4]}
+
+    def roundTrip(self, message):
+        decoded = self.translator.fromPrimitive(self.encoding.decode(
+            self.encoding.encode(self.translator.toPrimitive(message))))
+        self.translator.decompress(decoded)
+        return decoded
+
+    def failUnlessCommonFields(self, message, decoded):
+        self.failUnlessEqual(type(decoded), type(message))
+        for attribute in ('id', 'nodeID', 'cryptoChallengeX', 'signedValue', 'mac',
+                          'sessionKey', 'keyFingerprint', 'includeKey',
+                          'acceptsCompression', 'acceptsEnvelopes'):
+            self.failUnlessEqual(getattr(decoded, attribute), getattr(message, attribute),
+                                 '%s differs' % attribute)
+
+    def testRequest(self):
+        """ Tests a request with a public key and RSA signature """
+        message = msgtypes.RequestMessage(nodeID, 'store', self.args, self.rsaKey, 12345L)
+        message.keyFingerprint = 'f' * 20
+        message.signedValue = (2 ** 1000 + 7,)
+        message.sessionKey = 's' * 128
+        message.acceptsCompression = True
+        decoded = self.roundTrip(message)
+        self.failUnlessCommonFields(message, decoded)
+        self.failUnlessEqual(decoded.request, 'store')
+        self.failUnlessEqual(decoded.args, self.args)
+        self.failUnlessEqual((decoded.rsaKey.n, decoded.rsaKey.e), (self.rsaKey.n, self.rsaKey.e))
+
+    def testResponse(self):
+        """ Tests a MAC'd, compressed response that only carries a key fingerprint """
+        message = msgtypes.ResponseMessage('r' * 20, nodeID, None, 1, [contactIPv4] * 20)
+        message.includeKey = False
+        message.keyFingerprint = 'f' * 20
+        message.mac = 'm' * 20
+        message.compress = True
+        message.acceptsEnvelopes = True
+        primitive = self.translator.toPrimitive(message)
+        self.failUnless(type(primitive[1]) == str, 'The response was not compressed')
+        decoded = self.roundTrip(message)
+        self.failUnlessCommonFields(message, decoded)
+        self.failUnlessEqual(decoded.response, message.response)
+        self.failUnlessEqual(decoded.rsaKey, None)
+
+    def testError(self):
+        """ Tests an error message """
+        message = msgtypes.ErrorMessage('r' * 20, nodeID, None, 1, 'exceptions.ValueError', 'bad value')
+        message.includeKey = False
+        message.keyFingerprint = 'f' * 20
+        decoded = self.roundTrip(message)
+        self.failUnlessCommonFields(message, decoded)
+        self.failUnlessEqual((decoded.exceptionType, decoded.response), ('exceptions.ValueError', 'bad value'))
+
+    def testMalformed(self):
+        """ Tests that malformed headers are rejected """
+        message = msgtypes.RequestMessage(nodeID, 'ping', {}, None, 1, 'r' * 20)
+        message.includeKey = False
+        message.keyFingerprint = 'f' * 20
+        header, payload = self.translator.toPrimitive(message)
+        badPrimitives = [(header[:length], payload) for length in range(len(header))]
+        badPrimitives.extend([
+            (header + 'x', payload),                    # Trailing bytes
+            (chr(2) + header[1:], payload),             # Unknown version
+            (header[:2] + chr(ord(header[2]) | self.translator.flagMAC) + header[3:], payload), # Missing field
+            (header[:2] + chr(ord(header[2]) | self.translator.flagCompressed) + header[3:], ['not zlib']),
+            (header, payload, 'extra'),
+            header,
+            {}])
+        for primitive in badPrimitives:
+            self.failUnlessRaises(DecodeError, self.translator.fromPrimitive, primitive)
+        # Compressed payloads are only inflated on request, once the sender is authenticated
+        decoded = self.translator.fromPrimitive(
+            (header[:2] + chr(ord(header[2]) | self.translator.flagCompressed) + header[3:], 'not zlib'))
+        self.failUnlessRaises(DecodeError, self.translator.decompress, decoded)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(BinaryEncodingTest))
+    suite.addTest(unittest.makeSuite(TintangledBinaryFormatTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
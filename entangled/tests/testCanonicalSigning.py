@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import unittest
+
+import Crypto.PublicKey.RSA
+
+import entangled.kademlia.contact
+
+import constants
+import msgtypes
+import node
+import util
+import verifier
+
+# RSA keys are slow to generate; all tests share these
+keys = []
+
+def rsaKey(index):
+    while len(keys) <= index:
+        keys.append(Crypto.PublicKey.RSA.generate(1024))
+    return keys[index]
+
+class CanonicalSigningTest(unittest.TestCase):
+    """ Test case for signing the encoded message instead of its stringToSign() """
+    def makeNode(self, index, canonicalSigning, useSessions=False):
+        key = rsaKey(index)
+        tintangledNode = node.TintangledNode(
+            id=util.keyFingerprint(key), udpPort=0, useSessions=useSessions,
+            verificationPipeline=verifier.VerificationPipeline(threads=0))
+        tintangledNode.rsaKey = key
+        tintangledNode.x = 42L
+        tintangledNode._protocol._canonicalSigning = canonicalSigning
+        return tintangledNode
+
+    def exchange(self, senderCanonical, receiverCanonical, useSessions=False, tamper=None):
+        """ Returns the requests the receiver accepted out of one sent to it """
+        sender = self.makeNode(0, senderCanonical, useSessions)
+        receiver = self.makeNode(1, receiverCanonical, useSessions)
+        handled = []
+        receiver._protocol._handleRPC = lambda contact, rpcID, method, args: handled.append((method, args))
+        receiver._protocol._verifiedIDs.record(sender.id, sender.x, True)
+        if useSessions:
+            key = util.generateRandomString(constants.SESSION_KEY_LENGTH)
+            sender._protocol._sessions.accept(sender.id, receiver.id, key)
+            receiver._protocol._sessions.accept(receiver.id, sender.id, key)
+        contact = entangled.kademlia.contact.Contact(receiver.id, '127.0.0.1', 4001, sender._protocol)
+        msg = msgtypes.RequestMessage(sender.id, 'ping', {'echo': 'value'}, sender.rsaKey.publickey(), sender.x)
+        datagram = sender._protocol._encodeMessage(msg, contact)
+        if tamper is not None:
+            self.failUnless(tamper[0] in datagram)
+            datagram = datagram.replace(tamper[0], tamper[1])
+        receiver._protocol.datagramReceived(datagram, ('127.0.0.1', 4000))
+        return handled, datagram
+
+    def testRoundTrip(self):
+        """ Tests that canonically signed messages are sent in an envelope and verified """
+        for useSessions in (False, True):
+            handled, datagram = self.exchange(True, True, useSessions)
+            self.failUnlessEqual(datagram[0], 'l', 'The message was not wrapped in an envelope')
+            self.failUnlessEqual(handled, [('ping', {'echo': 'value'})])
+
+    def testMixed(self):
+        """ Tests that nodes accept messages signed either way, whichever way they sign themselves """
+        for senderCanonical in (False, True):
+            handled, datagram = self.exchange(senderCanonical, not senderCanonical)
+            self.failUnlessEqual(handled, [('ping', {'echo': 'value'})])
+
+    def testTampered(self):
+        """ Tests that a message whose body was changed after signing is rejected """
+        for useSessions in (False, True):
+            for senderCanonical in (False, True):
+                handled, datagram = self.exchange(senderCanonical, True, useSessions, tamper=('value', 'forge'))
+                self.failUnlessEqual(handled, [])
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(CanonicalSigningTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import unittest
+
+from twisted.internet import task
+
+import entangled.kademlia.coalesce as coalesce
+
+class CoalescerTest(unittest.TestCase):
+    """ Test case for the batching of small messages into envelopes """
+    def setUp(self):
+        self.clock = task.Clock()
+        self.sent = []
+        self.coalescer = coalesce.Coalescer(
+            lambda data, address, priority: self.sent.append((data, address, priority)),
+            window=0.01, maxSize=64, clock=self.clock)
+
+    def testEnvelope(self):
+        """ Tests that messages to the same address within the window share an envelope """
+        self.coalescer.add('ping', 'a', 1)
+        self.coalescer.add('pong', 'a', 0)
+        self.coalescer.add('store', 'b', 1)
+        self.failUnlessEqual(self.sent, [], 'Messages should be held back for the window')
+        self.clock.advance(0.01)
+        self.failUnlessEqual(len(self.sent), 2)
+        sent = dict([(address, (data, priority)) for data, address, priority in self.sent])
+        self.failUnlessEqual(sent['b'], ('store', 1), 'A lone message should not be wrapped')
+        envelope, priority = sent['a']
+        self.failUnlessEqual(priority, 0, 'An envelope should go at the highest priority of its messages')
+        self.failUnlessEqual(coalesce.unpack(envelope), ['ping', 'pong'])
+
+    def testFullEnvelope(self):
+        """ Tests that an envelope is sent as soon as the next message doesn't fit """
+        self.coalescer.add('x' * 20, 'a', 1)
+        self.coalescer.add('y' * 10, 'a', 1)
+        self.coalescer.add('z' * 10, 'a', 1)
+        self.failUnlessEqual(len(self.sent), 1)
+        self.failUnlessEqual(coalesce.unpack(self.sent[0][0]), ['x' * 20, 'y' * 10])
+        self.clock.advance(0.01)
+        self.failUnlessEqual(self.sent[1][0], 'z' * 10)
+
+    def testUnpackTruncated(self):
+        """ Tests that a truncated envelope yields its complete messages only """
+        envelope = coalesce.pack(['first', 'second'])
+        self.failUnlessEqual(coalesce.unpack(envelope[:-1]), ['first'])
+        self.failUnlessEqual(coalesce.unpack(envelope[:coalesce.headerSize + 1]), [])
+
+    def testStats(self):
+        """ Tests that the datagrams saved and the delay added are reported """
+        for i in range(3):
+            self.clock.advance(i and 0.004)
+            self.coalescer.add(str(i), 'a', 1)
+        self.clock.advance(0.002)
+        stats = self.coalescer.stats()
+        self.failUnlessEqual(stats['datagrams'], 1)
+        self.failUnlessEqual(stats['saved'], 2)
+        self.failUnlessAlmostEqual(stats['maxDelay'], 0.01)
+        self.failUnlessAlmostEqual(stats['meanDelay'], 0.006)
+
+    def testStop(self):
+        """ Tests that stopping drops held messages and the timer """
+        self.coalescer.add('ping', 'a', 1)
+        self.coalescer.stop()
+        self.failUnlessEqual(self.clock.getDelayedCalls(), [])
+        self.failUnlessEqual(self.sent, [])
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(CoalescerTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import hashlib
+import pickle
+import unittest
+import zlib
+
+import Crypto.PublicKey.RSA
+
+from entangled.kademlia.contact import Contact
+from entangled.kademlia.encoding import DecodeError
+import compression
+import msgformat
+import msgtypes
+import node
+import verifier
+
+class CompressorTest(unittest.TestCase):
+    """ Test case for the compression of message payloads """
+    def setUp(self):
+        self.compressor = compression.Compressor(threshold=100, maxSize=64 * 1024)
+        self.data = ''.join(['value %d, ' % (i % 50) for i in range(1000)])
+
+    def testRoundTrip(self):
+        """ Tests that compressed payloads decompress to the original """
+        compressed = self.compressor.compress('store', self.data)
+        self.failUnless(len(compressed) < len(self.data))
+        self.failUnlessEqual(self.compressor.decompress('store', compressed), self.data)
+
+    def testNotWorthIt(self):
+        """ Tests that short or incompressible payloads are left alone """
+        self.failUnlessEqual(self.compressor.compress('store', self.data[:99]), None)
+        incompressible = ''.join([hashlib.sha1(str(i)).digest() for i in range(100)])
+        self.failUnlessEqual(self.compressor.compress('store', incompressible), None)
+
+    def testMaxSize(self):
+        """ Tests that payloads inflating beyond the maximum size are rejected """
+        bomb = zlib.compress('\x00' * (16 * 1024 * 1024), 9)
+        self.failUnless(len(bomb) < 64 * 1024)
+        self.failUnlessRaises(DecodeError, self.compressor.decompress, 'response', bomb)
+        limit = zlib.compress('\x00' * (64 * 1024))
+        self.failUnlessEqual(len(self.compressor.decompress('response', limit)), 64 * 1024)
+        self.failUnlessRaises(DecodeError, self.compressor.decompress, 'response', 'not zlib data')
+
+    def testCounters(self):
+        """ Tests that compression is accounted per message type """
+        for i in range(2):
+            self.compressor.decompress('store', self.compressor.compress('store', self.data))
+        self.compressor.compress('store', 'short')
+        self.compressor.compress('response', self.data)
+        # Method names made up by senders share one counter
+        compressed = zlib.compress(self.data)
+        for i in range(100):
+            self.compressor.decompress('madeUp%d' % i, compressed)
+        self.compressor.decompress(['unhashable'], compressed)
+        stats = self.compressor.stats()
+        self.failUnlessEqual(sorted(stats.keys()), ['other', 'response', 'store'])
+        self.failUnlessEqual(stats['other']['decompressed'], 101)
+        self.failUnlessEqual(stats['store']['messages'], 3)
+        self.failUnlessEqual(stats['store']['compressed'], 2)
+        self.failUnlessEqual(stats['store']['decompressed'], 2)
+        self.failUnless(0.0 < stats['store']['ratio'] < 1.0)
+        self.failUnlessEqual(stats['response']['messages'], 1)
+        self.failUnlessEqual(stats['response']['decompressed'], 0)
+
+class CompressionAgreementTest(unittest.TestCase):
+    """ Test case for compressing only the payloads of messages to peers that accept it """
+    def setUp(self):
+        self.translator = msgformat.TintangledDefaultFormat(
+            compressor=compression.Compressor(threshold=100))
+        self.args = {'value': 1000 * 'a'}
+
+    def request(self, compress, rsaKey=None):
+        message = msgtypes.RequestMessage(20 * 'n', 'store', self.args, rsaKey, 42)
+        message.includeKey = False
+        message.compress = compress
+        return message
+
+    def testUncompressed(self):
+        """ Tests that the payload isn't compressed for a peer that hasn't agreed to it """
+        primitive = self.translator.toPrimitive(self.request(False))
+        self.failIf(self.translator.headerCompressed in primitive)
+        self.failUnlessEqual(primitive[self.translator.headerArgs], pickle.dumps(self.args))
+
+    def testCompressed(self):
+        """ Tests that the payload is compressed for a peer that agreed to it """
+        primitive = self.translator.toPrimitive(self.request(True))
+        self.failUnless(primitive.get(self.translator.headerCompressed))
+        message = self.translator.fromPrimitive(primitive)
+        self.failUnlessEqual(message.args, None, 'The payload was inflated before the sender was authenticated')
+        self.translator.decompress(message)
+        self.failUnlessEqual(message.args, self.args)
+
+    def testSignedPayload(self):
+        """ Tests that the signature of a compressed message covers the payload as sent """
+        sent = self.request(True)
+        self.translator.compress(sent)
+        received = self.translator.fromPrimitive(self.translator.toPrimitive(sent))
+        self.failUnlessEqual(received.stringToSign(), sent.stringToSign())
+        self.failUnless(sent.compressedPayload in sent.stringToSign())
+        # Not worth it: the message goes, and is signed, uncompressed
+        sent = self.request(True)
+        sent.args = {'value': 'short'}
+        self.translator.compress(sent)
+        self.failIf(sent.compress)
+        self.failUnlessEqual(self.translator.fromPrimitive(self.translator.toPrimitive(sent)).stringToSign(),
+                             sent.stringToSign())
+
+    def testAgreement(self):
+        """ Tests that a node compresses only for nodes that said they accept it """
+        h = hashlib.sha1()
+        h.update('node')
+        sender = node.TintangledNode(
+            id=h.digest(), udpPort=91824, useSessions=False,
+            verificationPipeline=verifier.VerificationPipeline(threads=0))
+        sender.rsaKey = Crypto.PublicKey.RSA.generate(1024)
+        sender.x = 42
+        h.update('peer')
+        peer = Contact(h.digest(), '127.0.0.1', 91825, sender._protocol)
+        message = self.request(True, sender.rsaKey.publickey())
+        sender._protocol._encodeMessage(message, peer)
+        self.failIf(message.compress, 'Compressed for a peer that hasn\'t agreed to it')
+        self.failUnless(message.acceptsCompression)
+        sender._protocol._compressionPeers.add(peer.id)
+        message = self.request(False, sender.rsaKey.publickey())
+        sender._protocol._encodeMessage(message, peer)
+        self.failUnless(message.compress)
+
+    def testUnauthenticated(self):
+        """ Tests that the payload of a message that fails verification is never inflated """
+        h = hashlib.sha1()
+        h.update('node')
+        receiver = node.TintangledNode(
+            id=h.digest(), udpPort=91824, useSessions=False,
+            verificationPipeline=verifier.VerificationPipeline(threads=0))
+        receiver.rsaKey = Crypto.PublicKey.RSA.generate(1024)
+        receiver.x = 42
+        h.update('peer')
+        peer = Contact(h.digest(), '127.0.0.1', 91825, receiver._protocol)
+        receiver._protocol._compressionPeers.add(peer.id)
+        # The node's own ID doesn't solve the puzzles, so the message is rejected
+        data = receiver._protocol._encodeMessage(self.request(True, receiver.rsaKey.publickey()), peer)
+        compressor = receiver._protocol._translator.compressor
+        self.failUnlessEqual(compressor.stats()['store']['compressed'], 1)
+        receiver._protocol.datagramReceived(data, ('127.0.0.1', 91825))
+        self.failUnlessEqual(compressor.stats()['store']['decompressed'], 0)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(CompressorTest))
+    suite.addTest(unittest.makeSuite(CompressionAgreementTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
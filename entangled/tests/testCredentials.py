@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import hashlib
+import unittest
+
+import Crypto.PublicKey.RSA
+
+import msgtypes
+import node
+import util
+import verifier
+
+# RSA keys are slow to generate; all tests share these
+keys = []
+
+def rsaKey(index):
+    while len(keys) <= index:
+        keys.append(Crypto.PublicKey.RSA.generate(1024))
+    return keys[index]
+
+class KeyBindingTest(unittest.TestCase):
+    """ Test case for checking that the key of a Tinfoil message belongs to its sender """
+    def setUp(self):
+        self.receiver = self.makeNode(True)
+        self.ownKey = rsaKey(0)
+        self.foreignKey = rsaKey(1)
+
+    def makeNode(self, bindKeyToID):
+        h = hashlib.sha1()
+        h.update('receiver')
+        return node.TintangledNode(
+            id=h.digest(), udpPort=91824, useSessions=False,
+            verificationPipeline=verifier.VerificationPipeline(threads=0),
+            bindKeyToID=bindKeyToID)
+
+    def request(self, nodeID, key, receiver):
+        """ Returns a request from nodeID, signed with key, whose ID the receiver takes as solving the puzzles """
+        message = msgtypes.RequestMessage(nodeID, 'ping', {}, key.publickey(), 42)
+        message.keyFingerprint = util.keyFingerprint(key)
+        message.signedValue = key.sign(hashlib.sha1(message.stringToSign()).digest(), '')
+        receiver._protocol._verifiedIDs.record(nodeID, 42, True)
+        return message
+
+    def testOwnKey(self):
+        """ Tests that a message signed with the key its sender's ID derives from is accepted """
+        message = self.request(util.keyFingerprint(self.ownKey), self.ownKey, self.receiver)
+        self.failUnlessEqual(self.receiver._protocol._verifyCredentials(message), (True, None))
+
+    def testForeignKey(self):
+        """ Tests that a valid key belonging to a different node ID is rejected """
+        victimID = util.keyFingerprint(self.ownKey)
+        message = self.request(victimID, self.foreignKey, self.receiver)
+        self.failUnlessEqual(self.receiver._protocol._verifyCredentials(message), (False, None))
+        self.receiver._protocol._verify(message, ('127.0.0.1', 91825))
+        self.failIf(victimID in self.receiver.keyCache, 'The victim\'s ID got the impostor\'s key')
+        self.failIf(message.keyFingerprint in self.receiver.keyCache, 'The key of a rejected message was cached')
+
+    def testUnbound(self):
+        """ Tests that nodes sharing one key are accepted with the binding turned off """
+        receiver = self.makeNode(False)
+        h = hashlib.sha1()
+        h.update('sender')
+        message = self.request(h.digest(), self.foreignKey, receiver)
+        self.failUnlessEqual(receiver._protocol._verifyCredentials(message), (True, None))
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(KeyBindingTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
@@ -4,6 +4,7 @@
 # the GNU Lesser General Public License Version 3, or any later version.
 # See the COPYING file included in this archive
 
+import random
 import unittest
 
 import entangled.kademlia.encoding
@@ -18,10 +19,18 @@ class BencodeTest(unittest.TestCase):
                       (['spam',42], 'l4:spami42ee'),
                       ({'foo':42, 'bar':'spam'}, 'd3:bar4:spam3:fooi42ee'),
                       # ...and now the "real life" tests
-                      ([['abc', '127.0.0.1', 1919], ['def', '127.0.0.1', 1921]], 'll3:abc9:127.0.0.1i1919eel3:def9:127.0.0.1i1921eee'))
+                      ([['abc', '127.0.0.1', 1919], ['def', '127.0.0.1', 1921]], 'll3:abc9:127.0.0.1i1919eel3:def9:127.0.0.1i1921eee'),
+                      # Dictionaries nested in lists and dictionaries
+                      ([{'a':1}, 2], 'ld1:ai1eei2ee'),
+                      ({'a':{'b':None}, 'c':''}, 'd1:ad1:bne1:c0:e'),
+                      ({0:'x', 1:[]}, 'di0e1:xi1elee'))
         # The following test cases are "bad"; i.e. sending rubbish into the decoder to test what exceptions get thrown
         self.badDecoderCases = ('abcdefghijklmnopqrstuvwxyz',
-                                '')                        
+                                '',
+                                # Truncated data
+                                '4:spa', 'i42', 'l4:spam', 'd3:foo',
+                                # Misplaced end markers and unpaired keys
+                                'e', 'd3:fooe', '-1:')
                       
     def testEncoder(self):
         """ Tests the bencode encoder """
@@ -37,9 +46,96 @@ class BencodeTest(unittest.TestCase):
         for encodedValue in self.badDecoderCases:
             self.failUnlessRaises(entangled.kademlia.encoding.DecodeError, self.encoding.decode, encodedValue)
 
+
+def referenceEncode(data):
+    """ The original, recursive Bencode encoder; the output of the current
+    one must not differ from it """
+    if type(data) in (int, long):
+        return 'i%de' % data
+    elif type(data) == str:
+        return '%d:%s' % (len(data), data)
+    elif type(data) in (list, tuple):
+        return 'l%se' % ''.join([referenceEncode(item) for item in data])
+    elif type(data) == dict:
+        keys = data.keys()
+        keys.sort()
+        return 'd%se' % ''.join(
+            [referenceEncode(key) + referenceEncode(data[key]) for key in keys])
+    elif type(data) == float:
+        return 'f%fe' % data
+    elif data == None:
+        return 'n'
+
+class BencodePropertyTest(unittest.TestCase):
+    """ Tests the Bencode implementation with randomly generated data """
+    def setUp(self):
+        self.encoding = entangled.kademlia.encoding.Bencode()
+        self.random = random.Random(1919)
+
+    def _randomValue(self, depth=0):
+        """ Returns a random value, and what it decodes to """
+        kind = self.random.randint(0, 5 if depth < 4 else 2)
+        if kind == 0:
+            value = self.random.randint(-2**70, 2**70)
+            return value, value
+        elif kind == 1:
+            value = ''.join([chr(self.random.randint(0, 255))
+                             for i in range(self.random.randint(0, 30))])
+            return value, value
+        elif kind == 2:
+            return None, None
+        elif kind in (3, 4):
+            items = [self._randomValue(depth+1)
+                     for i in range(self.random.randint(0, 5))]
+            values = [value for value, decoded in items]
+            if kind == 4:
+                values = tuple(values)
+            return values, [decoded for value, decoded in items]
+        else:
+            value, decoded = {}, {}
+            for i in range(self.random.randint(0, 5)):
+                key = self._randomValue(4)[0]
+                value[key], decoded[key] = self._randomValue(depth+1)
+            return value, decoded
+
+    def testMatchesReferenceEncoder(self):
+        """ Tests that the encoder output is byte-for-byte the original's """
+        for i in range(500):
+            value = self._randomValue()[0]
+            self.failUnlessEqual(self.encoding.encode(value), referenceEncode(value))
+        self.failUnlessEqual(self.encoding.encode([1.5, (-2.25,)]), referenceEncode([1.5, (-2.25,)]))
+
+    def testRoundTrip(self):
+        """ Tests that decoding reverses encoding """
+        for i in range(500):
+            value, decoded = self._randomValue()
+            encodedValue = self.encoding.encode(value)
+            self.failUnlessEqual(self.encoding.decode(encodedValue), decoded)
+
+    def testTruncated(self):
+        """ Tests that every proper prefix of an encoded container is rejected """
+        for i in range(50):
+            encodedValue = self.encoding.encode([self._randomValue()[0]])
+            for end in range(1, len(encodedValue)):
+                self.failUnlessRaises(entangled.kademlia.encoding.DecodeError, self.encoding.decode, encodedValue[:end])
+
+    def testDeepNesting(self):
+        """ Tests that nesting depth is not limited by the recursion limit """
+        value = 'spam'
+        for i in range(5000):
+            value = [value]
+        encodedValue = self.encoding.encode(value)
+        self.failUnlessEqual(encodedValue, 'l' * 5000 + '4:spam' + 'e' * 5000)
+        result = self.encoding.decode(encodedValue)
+        for i in range(5000):
+            self.failUnlessEqual(len(result), 1)
+            result = result[0]
+        self.failUnlessEqual(result, 'spam')
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(BencodeTest))
+    suite.addTest(unittest.makeSuite(BencodePropertyTest))
     return suite
 
 if __name__ == '__main__':
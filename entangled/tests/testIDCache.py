@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import hashlib
+import unittest
+
+import Crypto.PublicKey.RSA
+
+import idcache
+import msgtypes
+import node
+import verifier
+
+class VerifiedIDCacheTest(unittest.TestCase):
+    """ Test case for the cache of crypto puzzle verdicts """
+    def setUp(self):
+        self.cache = idcache.VerifiedIDCache(capacity=2, negativeCapacity=3)
+
+    def testLookup(self):
+        """ Tests that valid and invalid verdicts are returned, and unknown pairs counted as misses """
+        self.cache.record('a', 1, True)
+        self.cache.record('b', 2, False)
+        self.failUnlessEqual([self.cache.lookup('a', 1), self.cache.lookup('b', 2), self.cache.lookup('a', 2)],
+                             [True, False, None])
+        self.failUnless(self.cache.rejected('b', 2))
+        self.failIf(self.cache.rejected('a', 1) or self.cache.rejected('c', 3))
+        self.failUnlessEqual(self.cache.stats(), {'valid': 1, 'invalid': 1, 'hits': 2, 'misses': 1})
+
+    def testBounds(self):
+        """ Tests that each table evicts its least recently used pairs, and invalid pairs don't evict valid ones """
+        self.cache.record('a', 1, True)
+        self.cache.record('b', 1, True)
+        self.cache.lookup('a', 1)
+        self.cache.record('c', 1, True)
+        self.failUnlessEqual([self.cache.lookup(id, 1) for id in 'abc'], [True, None, True])
+        for i in range(10):
+            self.cache.record('bogus', i, False)
+        self.failUnlessEqual([self.cache.rejected('bogus', i) for i in range(10)], [False] * 7 + [True] * 3)
+        stats = self.cache.stats()
+        self.failUnlessEqual((stats['valid'], stats['invalid']), (2, 3))
+
+class RejectedIDTest(unittest.TestCase):
+    """ Test case for dropping messages from IDs already known to be invalid """
+    def setUp(self):
+        h = hashlib.sha1()
+        h.update('receiver')
+        self.node = node.TintangledNode(
+            id=h.digest(), udpPort=91824, useSessions=False,
+            verificationPipeline=verifier.VerificationPipeline(threads=0))
+        self.protocol = self.node._protocol
+        self.verified = []
+        self.protocol._verify = lambda message, address: self.verified.append(message.nodeID)
+        self.rsaKey = Crypto.PublicKey.RSA.generate(1024)
+
+    def receive(self, nodeID):
+        message = msgtypes.RequestMessage(nodeID, 'ping', {}, self.rsaKey.publickey(), 42)
+        message.signedValue = (1L,)
+        primitive = self.protocol._translator.toPrimitive(message)
+        self.protocol.datagramReceived(self.protocol._encoder.encode(primitive), ('127.0.0.1', 91825))
+
+    def testDropped(self):
+        """ Tests that messages from a rejected (node ID, X) pair never reach verification """
+        self.protocol._verifiedIDs.record('b' * 20, 42, False)
+        self.receive('a' * 20)
+        self.receive('b' * 20)
+        self.failUnlessEqual(self.verified, ['a' * 20])
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(VerifiedIDCacheTest))
+    suite.addTest(unittest.makeSuite(RejectedIDTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import pickle
+import unittest
+
+import keycache
+
+class KeyCacheTest(unittest.TestCase):
+    """ Test case for the cache of parsed public keys """
+    def setUp(self):
+        self.cache = keycache.KeyCache(capacity=3)
+        self.parsed = []
+
+    def parse(self, data):
+        self.parsed.append(data)
+        return pickle.loads(data)
+
+    def testLRU(self):
+        """ Tests that the least recently used key is evicted once the cache is full """
+        for userID in ('a', 'b', 'c'):
+            self.cache[userID] = 'key ' + userID
+        self.failUnlessEqual(self.cache['a'], 'key a')
+        self.cache['d'] = 'key d'
+        self.failIf('b' in self.cache, 'The least recently used key was kept')
+        self.failUnlessEqual(len(self.cache), 3)
+        self.cache['c'] = 'new key c'
+        self.cache['e'] = 'key e'
+        self.failIf('a' in self.cache)
+        self.failUnlessEqual(self.cache['c'], 'new key c')
+        self.failUnlessRaises(KeyError, self.cache.__getitem__, 'b')
+
+    def testCounters(self):
+        """ Tests that lookups count as hits and misses """
+        self.cache['a'] = 'key a'
+        self.cache.get('a')
+        self.cache.get('a')
+        self.failUnlessEqual(self.cache.get('b', 'default'), 'default')
+        stats = self.cache.stats()
+        self.failUnlessEqual((stats['keys'], stats['hits'], stats['misses']), (1, 2, 1))
+
+    def testIntern(self):
+        """ Tests that the same bytes map to the same key object, parsed only once """
+        first = pickle.dumps(('n', 65537))
+        key = self.cache.intern(first, self.parse)
+        self.failUnless(self.cache.intern(first, self.parse) is key)
+        self.failUnless(self.cache.intern(pickle.dumps(('n', 65537)), self.parse) is key)
+        self.failUnlessEqual(self.parsed, [first])
+        other = self.cache.intern(pickle.dumps(('m', 3)), self.parse)
+        self.failUnlessEqual(other, ('m', 3))
+        stats = self.cache.stats()
+        self.failUnlessEqual((stats['interned'], stats['internHits'], stats['internMisses']), (2, 2, 2))
+
+    def testInternBound(self):
+        """ Tests that interned keys are evicted least recently used first """
+        serialized = [pickle.dumps(i) for i in range(4)]
+        for data in serialized[:3]:
+            self.cache.intern(data, self.parse)
+        self.cache.intern(serialized[0], self.parse)
+        self.cache.intern(serialized[3], self.parse)
+        self.failUnlessEqual(self.cache.stats()['interned'], 3)
+        del self.parsed[:]
+        self.cache.intern(serialized[0], self.parse)
+        self.cache.intern(serialized[1], self.parse)
+        self.failUnlessEqual(self.parsed, [serialized[1]])
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(KeyCacheTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import Crypto.PublicKey.RSA
+
+import keystore
+
+class KeystoreTest(unittest.TestCase):
+    """ Test case for the file of pre-solved node identities """
+    # Generating keys is slow; the bundles share one
+    rsaKey = Crypto.PublicKey.RSA.generate(1024)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'identities')
+        self.store = keystore.Keystore(self.path)
+        self.bundles = [(chr(i) * 20, self.rsaKey, (i + 1) * 2 ** 150 + i) for i in range(5)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testEmpty(self):
+        """ Tests that a new keystore holds nothing to claim """
+        self.failUnlessEqual(os.path.getsize(self.path), keystore.HEADER.size)
+        self.failUnlessEqual((len(self.store), self.store.unclaimed()), (0, 0))
+        self.failUnlessRaises(keystore.KeystoreExhausted, self.store.claim)
+        self.failUnlessRaises(IndexError, self.store.get, 0)
+
+    def testRoundTrip(self):
+        """ Tests that appended bundles read back unchanged, also through a reopened keystore """
+        self.store.append(self.bundles[:2])
+        self.store.append(self.bundles[2:])
+        self.failUnlessEqual(os.path.getsize(self.path),
+                             keystore.HEADER.size + len(self.bundles) * keystore.RECORD_SIZE)
+        reopened = keystore.Keystore(self.path)
+        self.failUnlessEqual(len(reopened), len(self.bundles))
+        for index, (id, rsaKey, x) in enumerate(self.bundles):
+            storedID, storedKey, storedX = reopened.get(index)
+            self.failUnlessEqual((storedID, storedX), (id, x))
+            self.failUnless(storedKey.has_private(), 'The private key was not stored')
+            self.failUnlessEqual(storedKey.exportKey('DER'), rsaKey.exportKey('DER'))
+
+    def testClaim(self):
+        """ Tests that bundles are claimed in order, each once, until the keystore is exhausted """
+        self.store.append(self.bundles[:3])
+        claimed = [self.store.claim()]
+        # Another process claiming from the same file
+        claimed.append(keystore.Keystore(self.path).claim())
+        self.store.append(self.bundles[3:])
+        while self.store.unclaimed():
+            claimed.append(self.store.claim())
+        self.failUnlessRaises(keystore.KeystoreExhausted, self.store.claim)
+        self.failUnlessEqual([index for index, bundle in claimed], range(len(self.bundles)))
+        self.failUnlessEqual([bundle[0] for index, bundle in claimed], [id for id, rsaKey, x in self.bundles])
+
+    def testMalformed(self):
+        """ Tests that files which aren't keystores are rejected """
+        open(self.path, 'wb').write('not a keystore')
+        self.failUnlessRaises(keystore.KeystoreError, len, keystore.Keystore(self.path))
+        open(self.path, 'wb').write(keystore.HEADER.pack(keystore.MAGIC, keystore.VERSION, 1, 0))
+        self.failUnlessRaises(keystore.KeystoreError, self.store.claim)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(KeystoreTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import unittest
+
+import entangled.kademlia.lru as lru
+
+class LRUSetTest(unittest.TestCase):
+    """ Test case for the bounded set of what a node remembers about its peers """
+    def testCapacity(self):
+        """ Tests that the least recently added item is evicted beyond the capacity """
+        peers = lru.LRUSet(3)
+        for address in ('a', 'b', 'c'):
+            peers.add(address)
+        # Adding 'a' again makes 'b' the least recently added
+        peers.add('a')
+        peers.add('d')
+        self.failUnlessEqual(len(peers), 3)
+        self.failIf('b' in peers, 'The least recently added item was kept')
+        for address in ('a', 'c', 'd'):
+            self.failUnless(address in peers)
+        peers.discard('c')
+        peers.discard('x')
+        self.failUnlessEqual(len(peers), 2)
+        self.failIf('c' in peers)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(LRUSetTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
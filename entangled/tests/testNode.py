@@ -7,8 +7,13 @@
 import hashlib
 import unittest
 
+from twisted.internet import defer, task
+
+import entangled.kademlia.admission
+import entangled.kademlia.contact
 import entangled.kademlia.node
 import entangled.kademlia.constants
+import entangled.kademlia.protocol
 
 class NodeIDTest(unittest.TestCase):
     """ Test case for the Node class's ID """
@@ -87,6 +92,158 @@ class NodeContactTest(unittest.TestCase):
         self.failIf(contact in closestNodes, 'Node added itself as a contact')
 
 
+class FakePort(object):
+    """ Fake listening UDP port """
+    def __init__(self, protocol=None):
+        self.listening = True
+        self.protocol = protocol
+    def stopListening(self):
+        self.listening = False
+        if self.protocol is not None:
+            self.protocol.stopProtocol()
+
+class NodeLeaveTest(unittest.TestCase):
+    """ Test case for taking a node out of the network again """
+    def setUp(self):
+        self.node = entangled.kademlia.node.Node()
+        self.clock = task.Clock()
+
+    def testLeaveNetwork(self):
+        """ Tests that leaving closes the node's port and stops the periodic k-bucket refresh """
+        port = FakePort()
+        self.node._listeningPort = port
+        refreshCall = self.node._refreshCall = self.clock.callLater(entangled.kademlia.constants.checkRefreshInterval, self.node._refreshNode)
+        self.node.leaveNetwork()
+        self.failIf(port.listening, 'The UDP port should have been closed')
+        self.failIf(refreshCall.active(), 'The refresh should have been cancelled')
+        # A refresh that was under way doesn't schedule the next one
+        self.node._scheduleNextNodeRefresh()
+        self.failUnlessEqual(self.node._refreshCall, None)
+
+    def testFailQueuedRPCs(self):
+        """ Tests that leaving fails the RPCs still waiting to be sent """
+        self.node._listeningPort = FakePort(self.node._protocol)
+        limiter = self.node._protocol._limiter
+        errors = []
+        for i in range(limiter.maxInFlight + 1):
+            df = defer.Deferred().addErrback(errors.append)
+            limiter.submit('contact%d' % i, lambda: None, df)
+        self.node.leaveNetwork()
+        self.failUnlessEqual(len(errors), 1)
+        self.failUnless(errors[0].check(defer.CancelledError))
+
+class NodeJoinTest(unittest.TestCase):
+    """ Test case for the lookups a node does when joining the network """
+    def setUp(self):
+        self.node = entangled.kademlia.node.Node(udpPort=0)
+        # (key, priority, deferred) of every lookup started
+        self.lookups = []
+        def _iterativeFind(key, startupShortlist=None, rpc='findNode',
+                           priority=entangled.kademlia.admission.priorityLookup):
+            df = defer.Deferred()
+            self.lookups.append((key, priority, df))
+            return df
+        self.node._iterativeFind = _iterativeFind
+        # Enough contacts to split the k-bucket of the node's own ID
+        h = hashlib.sha1()
+        for i in range(3 * entangled.kademlia.constants.k):
+            h.update(str(i))
+            self.node.addContact(entangled.kademlia.contact.Contact(h.digest(), '127.0.0.1', 9182, self.node._protocol))
+
+    def tearDown(self):
+        self.node.leaveNetwork()
+
+    def testRefreshKBuckets(self):
+        """ Tests that once it has looked up its own ID, a joining node refreshes every k-bucket, as maintenance """
+        buckets = self.node._routingTable._buckets
+        self.failUnless(len(buckets) > 1)
+        self.node.joinNetwork([('127.0.0.1', 9182)])
+        self.failUnlessEqual(self.lookups[0][:2], (self.node.id, entangled.kademlia.admission.priorityLookup))
+        self.lookups[0][2].callback([])
+        # One k-bucket after the other
+        refreshed = set()
+        while len(self.lookups) > len(refreshed) + 1:
+            key, priority, df = self.lookups[-1]
+            self.failUnlessEqual(priority, entangled.kademlia.admission.priorityMaintenance)
+            refreshed.add(self.node._routingTable._kbucketIndex(key))
+            df.callback([])
+        self.failUnlessEqual(refreshed, set(range(len(buckets))))
+
+class NodeSingleFlightTest(unittest.TestCase):
+    """ Test case for sharing lookups in progress between identical requests """
+    def setUp(self):
+        self.node = entangled.kademlia.node.Node()
+        # (key, rpc, deferred, priority) of every lookup started
+        self.lookups = []
+        def _iterativeFind(key, startupShortlist=None, rpc='findNode',
+                           priority=entangled.kademlia.admission.priorityLookup):
+            df = defer.Deferred()
+            self.lookups.append((key, rpc, df, priority))
+            return df
+        self.node._iterativeFind = _iterativeFind
+
+    def testCoalescing(self):
+        """ Tests that identical lookups in progress are only run once """
+        results = []
+        for i in range(3):
+            self.node.iterativeFindValue('key').addCallback(results.append)
+        self.node.iterativeFindNode('key').addCallback(results.append)
+        self.failUnlessEqual([lookup[:2] for lookup in self.lookups],
+                             [('key', 'findValue'), ('key', 'findNode')])
+        self.failUnlessEqual(self.node.coalescedLookups, 2)
+        self.lookups[0][2].callback({'key': 'value'})
+        self.failUnlessEqual(results, [{'key': 'value'}] * 3)
+        self.failIf(results[0] is results[1], 'Every caller should get a result of its own')
+        # The next lookup for the key starts afresh
+        self.node.iterativeFindValue('key')
+        self.failUnlessEqual(len(self.lookups), 3)
+
+    def testFailure(self):
+        """ Tests that a failed lookup fails all of its callers """
+        errors = []
+        for i in range(2):
+            self.node.iterativeFindNode('key').addErrback(errors.append)
+        self.lookups[0][2].errback(entangled.kademlia.protocol.TimeoutError('node'))
+        self.failUnlessEqual(len(errors), 2)
+        self.failUnless(errors[1].check(entangled.kademlia.protocol.TimeoutError))
+
+    def testRaisingLookup(self):
+        """ Tests that a lookup raising right away fails its caller, and doesn't hold up later ones """
+        def _iterativeFind(key, startupShortlist=None, rpc='findNode',
+                           priority=entangled.kademlia.admission.priorityLookup):
+            raise ValueError(key)
+        self.node._iterativeFind = _iterativeFind
+        errors = []
+        for i in range(2):
+            self.node.iterativeFindValue('key').addErrback(errors.append)
+        self.failUnlessEqual([error.check(ValueError) for error in errors], [ValueError] * 2)
+        self.failUnlessEqual(self.node._lookupsInFlight, {})
+
+    def testMaintenancePriority(self):
+        """ Tests that k-bucket refreshes look up at maintenance priority """
+        self.node._routingTable.getRefreshList = lambda startIndex, force: ['key']
+        self.node._refreshRoutingTable()
+        self.node.iterativeFindNode('other')
+        self.failUnlessEqual([(lookup[0], lookup[3]) for lookup in self.lookups],
+                             [('key', entangled.kademlia.admission.priorityMaintenance),
+                              ('other', entangled.kademlia.admission.priorityLookup)])
+
+    def testPriorityFlights(self):
+        """ Tests that a user lookup doesn't join a maintenance lookup, but a maintenance lookup joins a user lookup """
+        maintenance = entangled.kademlia.admission.priorityMaintenance
+        results = []
+        for priority in (maintenance, entangled.kademlia.admission.priorityLookup, maintenance):
+            self.node.iterativeFindNode('key', priority).addCallback(results.append)
+        self.failUnlessEqual([(lookup[0], lookup[3]) for lookup in self.lookups],
+                             [('key', maintenance), ('key', entangled.kademlia.admission.priorityLookup)])
+        self.failUnlessEqual(self.node.coalescedLookups, 1)
+        # The user lookup's result goes to the maintenance lookup that joined it
+        self.lookups[1][2].callback(['contact'])
+        self.failUnlessEqual(results, [['contact']] * 2)
+        self.lookups[0][2].callback(['other'])
+        self.failUnlessEqual(results[-1], ['other'])
+
+
 #class NodeLookupTest(unittest.TestCase):
 #    """ Test case for the Node class's iterative node lookup algorithm """
 #    def setUp(self):
@@ -129,7 +286,7 @@ class FakeRPCProtocol(protocol.DatagramProtocol):
          self.network = contactNetwork
        
     """ Fake RPC protocol; allows entangled.kademlia.contact.Contact objects to "send" RPCs """
-    def sendRPC(self, contact, method, args, rawResponse=False):
+    def sendRPC(self, contact, method, args, rawResponse=False, priority=None):
         #print method + " " + str(args)
         
         if method == "findNode":        
@@ -423,6 +580,9 @@ def suite():
     suite.addTest(unittest.makeSuite(NodeIDTest))
     suite.addTest(unittest.makeSuite(NodeDataTest))
     suite.addTest(unittest.makeSuite(NodeContactTest))
+    suite.addTest(unittest.makeSuite(NodeLeaveTest))
+    suite.addTest(unittest.makeSuite(NodeJoinTest))
+    suite.addTest(unittest.makeSuite(NodeSingleFlightTest))
     suite.addTest(unittest.makeSuite(NodeLookupTest))
     return suite
 
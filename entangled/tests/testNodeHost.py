@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import unittest
+
+from twisted.test import proto_helpers
+
+import identitypool
+import nodehost
+
+class SharedIdentitiesTest(unittest.TestCase):
+    """ Test case for the cheap node identities of many-node processes """
+    def identities(self, seed, count=3):
+        pool = identitypool.SharedIdentities(seed=seed, rsaBits=1024)
+        return pool, [pool.next() for i in range(count)]
+
+    def testSeeded(self):
+        """ Tests that the same seed hands out the same identities, and different seeds different ones """
+        pool, identities = self.identities(1)
+        other, again = self.identities(1)
+        self.failUnlessEqual([(id, rsaKey.n, x) for id, rsaKey, x in identities],
+                             [(id, rsaKey.n, x) for id, rsaKey, x in again])
+        self.failUnlessEqual(len(set([id for id, rsaKey, x in identities])), 3)
+        self.failUnlessEqual(pool.handedOut, 3)
+        self.failIfEqual(self.identities(2, 1)[1][0][0], identities[0][0])
+
+    def testShared(self):
+        """ Tests that the identities share one key, and their IDs pass the crypto puzzle checks """
+        pool, identities = self.identities(3)
+        self.failUnless(pool.sharedKey)
+        self.failUnless(identities[0][1] is identities[1][1] is pool.rsaKey())
+        host = nodehost.NodeHost(47100, identities=pool, verifyThreads=0)
+        protocol = host.node(host.addNode())._protocol
+        try:
+            for id, rsaKey, x in identities:
+                self.failUnless(protocol._verifyID(id, x), 'A handed out ID failed verification')
+            self.failIf(protocol._verifyID(identities[0][0], identities[1][2]))
+        finally:
+            host.stop()
+
+class NodeHostTest(unittest.TestCase):
+    """ Test case for running many nodes in one process """
+    def makeHost(self, startPort):
+        # Ports are only released once the reactor runs, so each test uses its own
+        self.host = nodehost.NodeHost(
+            startPort, identities=identitypool.SharedIdentities(seed=4, rsaBits=1024), verifyThreads=0)
+
+    def tearDown(self):
+        self.host.stop()
+
+    def command(self, line):
+        """ Returns the reply of the control port to a command """
+        factory = nodehost.ControlFactory(self.host)
+        protocol = factory.buildProtocol(None)
+        transport = proto_helpers.StringTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived(line + '\n')
+        return transport.value()
+
+    def testAddRemove(self):
+        """ Tests that nodes get ports of their own, join through the first node, and are stopped when removed """
+        self.makeHost(47200)
+        ports = [self.host.addNode() for i in range(3)]
+        self.failUnlessEqual(ports, [47200, 47201, 47202])
+        self.failUnlessEqual(self.host.addNode(47210), 47210)
+        self.failUnlessEqual(self.host.addNode(), 47203)
+        first = self.host.node(47200)
+        self.failIfEqual(first.id, self.host.node(47201).id)
+        self.host.removeNode(47200)
+        self.failUnless(first._listeningPort is None, 'The removed node still listens')
+        self.failUnlessRaises(KeyError, self.host.removeNode, 47200)
+        stats = self.host.stats()
+        self.failUnlessEqual((stats['nodes'], stats['added'], stats['removed']), (4, 5, 1))
+        self.failUnlessEqual(stats['verifier']['dropped'], 0)
+
+    def testControl(self):
+        """ Tests the commands of the control port """
+        self.makeHost(47300)
+        self.failUnlessEqual(self.command('add 2'), 'ok 47300 47301\n')
+        self.failUnlessEqual(self.command('list'), 'ok 47300:%s 47301:%s\n' % (
+            self.host.node(47300).id.encode('hex'), self.host.node(47301).id.encode('hex')))
+        self.failUnlessEqual(self.command('remove 47301'), 'ok 47301\n')
+        self.failUnless(self.command('stats').startswith('ok nodes=1 added=2 removed=1 '))
+        self.failUnlessEqual(self.command('remove 47301'), 'error No node on port 47301\n')
+        self.failUnlessEqual(self.command('frobnicate'), 'error unknown command frobnicate\n')
+        self.failUnlessEqual(self.command(''), '')
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SharedIdentitiesTest))
+    suite.addTest(unittest.makeSuite(NodeHostTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
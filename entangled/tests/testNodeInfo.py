@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import unittest
+
+import nodeinfo
+
+class NodeInfoTest(unittest.TestCase):
+    """ Test case for packing contact triples into binary records """
+    def setUp(self):
+        self.ipv4 = [('a' * 20, '10.0.0.1', 4000), ('b' * 20, '255.255.255.255', 0),
+                     ('c' * 20, '0.0.0.0', 65535)]
+        self.ipv6 = [('a' * 20, '2001:db8::1', 4000), ('b' * 20, '::', 0),
+                     ('c' * 20, 'fe80::1:2:3:4', 65535)]
+
+    def testRoundTrip(self):
+        """ Tests that packed triples unpack to the original ones """
+        for family, triples in ((nodeinfo.IPV4, self.ipv4), (nodeinfo.IPV6, self.ipv6)):
+            self.failUnlessEqual(nodeinfo.listFamily(triples), family)
+            packed = nodeinfo.pack(triples, family)
+            self.failUnlessEqual(len(packed), len(triples) * nodeinfo.recordSize[family])
+            self.failUnlessEqual(nodeinfo.unpack(packed, family, len(triples)), triples)
+            # ...also from within a larger buffer
+            self.failUnlessEqual(nodeinfo.unpack('xyz' + packed + 'xyz', family, 2, 3), triples[:2])
+
+    def testEmpty(self):
+        """ Tests that an empty list packs to nothing, and back """
+        for family in (nodeinfo.IPV4, nodeinfo.IPV6):
+            self.failUnlessEqual(nodeinfo.pack([], family), '')
+            self.failUnlessEqual(nodeinfo.unpack('', family, 0), [])
+        self.failUnlessEqual(nodeinfo.listFamily([]), None)
+
+    def testFamilies(self):
+        """ Tests which triples and lists are recognized as packable """
+        self.failUnlessEqual(nodeinfo.tripleFamily(self.ipv4[0]), nodeinfo.IPV4)
+        self.failUnlessEqual(nodeinfo.tripleFamily(self.ipv6[0]), nodeinfo.IPV6)
+        for triple in (('a' * 20, '10.0.0.1', 65536), ('a' * 20, '10.0.0.256', 1),
+                       ('a' * 19, '10.0.0.1', 1), ('a' * 20, '2001:DB8::1', 1)):
+            self.failUnlessEqual(nodeinfo.tripleFamily(triple), None)
+        self.failUnlessEqual(nodeinfo.listFamily(self.ipv4 + self.ipv6), None)
+
+    def testBadCount(self):
+        """ Tests that a count the buffer doesn't hold is rejected """
+        packed = nodeinfo.pack(self.ipv4, nodeinfo.IPV4)
+        self.failUnlessRaises(ValueError, nodeinfo.unpack, packed, nodeinfo.IPV4, 4)
+        self.failUnlessRaises(ValueError, nodeinfo.unpack, packed, nodeinfo.IPV4, -1)
+        self.failUnlessRaises(ValueError, nodeinfo.unpack, packed, nodeinfo.IPV4, 3, 1)
+        self.failUnlessRaises(ValueError, nodeinfo.unpack, packed, nodeinfo.IPV6, 3)
+
+    def testTruncated(self):
+        """ Tests that a truncated buffer is rejected """
+        for family, triples in ((nodeinfo.IPV4, self.ipv4), (nodeinfo.IPV6, self.ipv6)):
+            packed = nodeinfo.pack(triples, family)
+            for length in range(len(packed)):
+                self.failUnlessRaises(ValueError, nodeinfo.unpack, packed[:length], family, len(triples))
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(NodeInfoTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
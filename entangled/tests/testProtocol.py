@@ -214,7 +214,8 @@ class KademliaProtocolTest(unittest.TestCase):
         msgID = 'abcdefghij1234567890'
         df = defer.Deferred()
         timeoutCall = entangled.kademlia.protocol.reactor.callLater(entangled.kademlia.constants.rpcTimeout, self.protocol._msgTimeout, msgID)
-        self.protocol._sentMessages[msgID] = (remoteContact.id, df, timeoutCall)
+        self.protocol._limiter.submit(remoteContact.id, lambda: None, df)
+        self.protocol._sentMessages[msgID] = (remoteContact.id, df, timeoutCall, entangled.kademlia.protocol.reactor.seconds())
         # Simulate the "reply" transmission
         msg = entangled.kademlia.msgtypes.ResponseMessage(msgID, 'node2', responseData)
         msgPrimitive = self.protocol._translator.toPrimitive(msg)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import unittest
+
+import Crypto.Hash.SHA
+
+import puzzle
+import util
+
+class PuzzleSolverTest(unittest.TestCase):
+    """ Test case for the parallel solver of the crypto puzzles """
+    def setUp(self):
+        self.nodeID = Crypto.Hash.SHA.new('node').digest()
+        self.c2 = 8
+
+    def solve(self, workers, seed='test'):
+        solver = puzzle.PuzzleSolver(workers=workers, seed=seed)
+        x = solver.solveDynamic(self.nodeID, c2=self.c2)
+        return x, solver.lastStats
+
+    def testSolution(self):
+        """ Tests that the solution has the required number of leading zero bits """
+        x, stats = self.solve(1)
+        hashed = util.hsh2int(Crypto.Hash.SHA.new(util.int2bin(util.bin2int(self.nodeID) ^ x)))
+        self.failUnless(util.hasNZeroBitPrefix(hashed, self.c2))
+        self.failUnlessEqual(stats['attempts'], stats['winningAttempt'] + 1)
+
+    def testDeterministic(self):
+        """ Tests that a seeded solve finds the same solution in the same attempt for any number of workers """
+        x, stats = self.solve(1)
+        for workers in (2, 3):
+            parallelX, parallelStats = self.solve(workers)
+            self.failUnlessEqual((parallelX, parallelStats['winningAttempt']), (x, stats['winningAttempt']))
+            self.failUnlessEqual(parallelStats['workers'], workers)
+            self.failUnless(parallelStats['attempts'] > stats['winningAttempt'])
+        self.failIfEqual(self.solve(1, seed='other')[0], x)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(PuzzleSolverTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
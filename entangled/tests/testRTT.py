@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import unittest
+
+import entangled.kademlia.constants as constants
+import entangled.kademlia.protocol as protocol
+import entangled.kademlia.rtt as rtt
+
+class RTTEstimatorTest(unittest.TestCase):
+    """ Test case for the per-contact round-trip time estimates """
+    def setUp(self):
+        self.estimator = rtt.RTTEstimator(
+            initialTimeout=5, minTimeout=0.1, maxTimeout=5, maxContacts=2)
+
+    def testInitialTimeout(self):
+        """ Tests that contacts without samples get the initial timeout """
+        self.failUnlessEqual(self.estimator.timeout('node'), 5)
+        self.failUnlessEqual(self.estimator.estimate('node'), None)
+
+    def testSamples(self):
+        """ Tests that the timeout follows the smoothed RTT and its deviation """
+        self.estimator.sample('node', 0.2)
+        # First sample: RTT 0.2, deviation 0.1
+        self.failUnlessAlmostEqual(self.estimator.timeout('node'), 0.6)
+        self.estimator.sample('node', 0.2)
+        # Deviation 0.1 + (0 - 0.1) / 4 = 0.075
+        self.failUnlessAlmostEqual(self.estimator.timeout('node'), 0.5)
+        for i in range(100):
+            self.estimator.sample('node', 0.01)
+        self.failUnlessAlmostEqual(self.estimator.timeout('node'), 0.1,
+                                   msg='The timeout should not go below its minimum')
+        self.failUnless(self.estimator.estimate('node') < 0.1)
+        self.estimator.sample('slow', 30)
+        self.failUnlessEqual(self.estimator.timeout('slow'), 5,
+                             'The timeout should not go beyond its maximum')
+
+    def testBackoff(self):
+        """ Tests that timeouts double the timeout, and a response restores it """
+        self.estimator.sample('node', 0.2)
+        self.estimator.timedOut('node')
+        self.failUnlessAlmostEqual(self.estimator.timeout('node'), 1.2)
+        self.estimator.timedOut('node')
+        self.failUnlessAlmostEqual(self.estimator.timeout('node'), 2.4)
+        for i in range(10):
+            self.estimator.timedOut('node')
+        self.failUnlessEqual(self.estimator.timeout('node'), 5)
+        self.estimator.sample('node', 0.2)
+        self.failUnless(self.estimator.timeout('node') < 1)
+        self.failUnlessEqual(self.estimator.stats()['timeouts'], 12)
+
+    def testLimit(self):
+        """ Tests that only the most recently seen contacts are remembered """
+        self.estimator.sample('a', 0.2)
+        self.estimator.sample('b', 0.2)
+        self.estimator.sample('a', 0.2)
+        self.estimator.sample('c', 0.2)
+        self.failUnlessEqual(len(self.estimator), 2)
+        self.failUnlessEqual(self.estimator.estimate('b'), None,
+                             'The least recently seen contact should be forgotten')
+        self.failIfEqual(self.estimator.estimate('a'), None)
+
+    def testProbeDelay(self):
+        """ Tests that lookups wait for probes as long as their contacts' RTTs suggest """
+        kademliaProtocol = protocol.KademliaProtocol(
+            None, streamTransport=False, coalesceMessages=False)
+        kademliaProtocol._rtt.sample('fast', 0.001)
+        kademliaProtocol._rtt.sample('slow', 0.2)
+        self.failUnlessEqual(kademliaProtocol.probeDelay(['fast']),
+                             constants.iterativeLookupDelayMin)
+        self.failUnlessAlmostEqual(kademliaProtocol.probeDelay(['fast', 'slow']), 0.6)
+        self.failUnlessEqual(kademliaProtocol.probeDelay(['fast', 'unknown']),
+                             constants.iterativeLookupDelay)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(RTTEstimatorTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
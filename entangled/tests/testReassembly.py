@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import unittest
+
+from twisted.internet import task
+
+import entangled.kademlia.reassembly as reassembly
+
+class ReassemblerTest(unittest.TestCase):
+    """ Test case for the reassembly of multi-packet messages """
+    def setUp(self):
+        self.clock = task.Clock()
+        self.reassembler = reassembly.Reassembler(
+            4, maxBytes=40, maxBytesPerPeer=24, timeout=5, clock=self.clock)
+
+    def testOutOfOrder(self):
+        """ Tests that fragments are put together in sequence, whatever order they arrive in """
+        self.failUnlessEqual(self.reassembler.add('msg', 2, 3, 'ij', 'peer'), None)
+        self.failUnlessEqual(self.reassembler.add('msg', 0, 3, 'abcd', 'peer'), None)
+        self.failUnlessEqual(self.reassembler.received('msg'), 2)
+        self.clock.advance(1)
+        self.failUnlessEqual(self.reassembler.add('msg', 1, 3, 'efgh', 'peer'), 'abcdefghij')
+        self.failIf('msg' in self.reassembler, 'A complete message should not be kept')
+        stats = self.reassembler.stats()
+        self.failUnlessEqual(stats['completed'], 1)
+        self.failUnlessEqual(stats['bytes'], 0)
+        self.failUnlessEqual(stats['maxLatency'], 1)
+
+    def testMissing(self):
+        """ Tests that missing fragments are reported, and late ones ignored once complete """
+        for seqNumber in (0, 2, 5):
+            self.reassembler.add('msg', seqNumber, 6, 'abcd', 'peer')
+        self.failUnlessEqual(self.reassembler.missing('msg'), [1, 3, 4])
+        self.failUnlessEqual(self.reassembler.missing('msg', 2), [1, 3])
+        self.failUnlessEqual(self.reassembler.missing('unknown'), [])
+        for seqNumber in (1, 3):
+            self.reassembler.add('msg', seqNumber, 6, 'abcd', 'peer')
+        self.failUnlessEqual(self.reassembler.add('msg', 4, 6, 'abcd', 'peer'), 'abcd' * 6)
+        self.reassembler.add('msg', 4, 6, 'abcd', 'peer')
+        self.failIf('msg' in self.reassembler, 'A late fragment should not start the message over')
+
+    def testDuplicatesAndMalformed(self):
+        """ Tests that duplicate and inconsistent fragments are dropped """
+        self.reassembler.add('msg', 0, 3, 'abcd', 'peer')
+        self.reassembler.add('msg', 0, 3, 'abcd', 'peer')
+        self.reassembler.add('msg', 1, 3, 'efg', 'peer')
+        self.reassembler.add('msg', 3, 3, 'ijkl', 'peer')
+        self.reassembler.add('msg', 1, 4, 'efgh', 'peer')
+        self.reassembler.add('other', 0, 2, 'abcde', 'peer')
+        self.failUnlessEqual(self.reassembler.received('msg'), 1)
+        drops = self.reassembler.stats()['drops']
+        self.failUnlessEqual(drops['duplicate'], 1)
+        self.failUnlessEqual(drops['malformed'], 4)
+
+    def testShortFragment(self):
+        """ Tests that a short fragment other than the last one is dropped without spoiling the message """
+        self.reassembler.add('msg', 1, 3, 'ef', 'peer')
+        self.failUnlessEqual(self.reassembler.received('msg'), 0)
+        self.reassembler.add('msg', 0, 3, 'abcd', 'peer')
+        self.reassembler.add('msg', 1, 3, 'e', 'peer')
+        self.failUnlessEqual(self.reassembler.received('msg'), 1)
+        self.failUnlessEqual(self.reassembler.add('msg', 2, 3, 'ij', 'peer'), None)
+        self.failUnlessEqual(self.reassembler.add('msg', 1, 3, 'efgh', 'peer'), 'abcdefghij')
+        self.failUnlessEqual(self.reassembler.stats()['drops']['malformed'], 2)
+
+    def testMemoryCaps(self):
+        """ Tests that messages exceeding the per-peer or global cap are dropped """
+        self.reassembler.add('a', 0, 4, 'abcd', 'peer1')
+        self.reassembler.add('b', 0, 3, 'abcd', 'peer1')
+        self.failIf('b' in self.reassembler, 'The per-peer cap should have been enforced')
+        self.reassembler.add('c', 0, 4, 'abcd', 'peer2')
+        self.reassembler.add('d', 0, 3, 'abcd', 'peer3')
+        self.failIf('d' in self.reassembler, 'The global cap should have been enforced')
+        drops = self.reassembler.stats()['drops']
+        self.failUnlessEqual(drops['peerCap'], 1)
+        self.failUnlessEqual(drops['globalCap'], 1)
+        self.reassembler.discard('a')
+        self.reassembler.add('b', 0, 3, 'abcd', 'peer1')
+        self.failUnless('b' in self.reassembler, 'Discarding a message should free its memory')
+
+    def testExpiry(self):
+        """ Tests that messages without progress are evicted """
+        self.reassembler.add('old', 0, 2, 'abcd', 'peer')
+        self.clock.advance(3)
+        self.reassembler.add('new', 0, 2, 'abcd', 'peer')
+        self.clock.advance(3)
+        self.reassembler.expire()
+        self.failIf('old' in self.reassembler)
+        self.failUnless('new' in self.reassembler)
+        self.reassembler.add('new', 1, 2, 'ef', 'peer')
+        self.clock.advance(4)
+        self.reassembler.expire()
+        stats = self.reassembler.stats()
+        self.failUnlessEqual(stats['drops']['expired'], 1)
+        self.failUnlessEqual(stats['pending'], 0)
+        self.failUnlessEqual(stats['bytes'], 0)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ReassemblerTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import unittest
+
+from twisted.internet import task
+
+import entangled.kademlia.retransmit as retransmit
+
+class RetransmitBufferTest(unittest.TestCase):
+    """ Test case for the buffer of recently sent multi-packet messages """
+    def setUp(self):
+        self.clock = task.Clock()
+        self.buffer = retransmit.RetransmitBuffer(
+            maxBytes=10, timeout=5, maxRequests=2, clock=self.clock)
+        self.address = ('127.0.0.1', 4000)
+
+    def testRequest(self):
+        """ Tests that a message is served to its receiver only, and only so often """
+        self.buffer.add('rpc', self.address, 'abcd', 1)
+        self.failUnlessEqual(self.buffer.request('rpc', ('127.0.0.1', 4001)), None,
+                             'Another address should not get the message')
+        self.failUnlessEqual(self.buffer.request('rpc', self.address), ('abcd', 1))
+        self.failUnlessEqual(self.buffer.request('rpc', self.address), ('abcd', 1))
+        self.failUnlessEqual(self.buffer.request('rpc', self.address), None,
+                             'Requests beyond the limit should be refused')
+        self.failUnlessEqual(self.buffer.stats()['retransmitted'], 2)
+
+    def testAcknowledge(self):
+        """ Tests that acknowledged messages are dropped """
+        self.buffer.add('rpc', self.address, 'abcd', 1)
+        self.buffer.acknowledge('rpc', self.address)
+        self.failIf(('rpc', self.address) in self.buffer)
+        stats = self.buffer.stats()
+        self.failUnlessEqual(stats['acknowledged'], 1)
+        self.failUnlessEqual(stats['bytes'], 0)
+
+    def testLimits(self):
+        """ Tests that messages are dropped when the buffer is full, or when they are too old """
+        self.buffer.add('a', self.address, 'abcd', 1)
+        self.clock.advance(2)
+        self.buffer.add('b', self.address, 'efgh', 1)
+        self.buffer.add('c', self.address, 'ijkl', 1)
+        self.failIf(('a', self.address) in self.buffer, 'The oldest message should have made room')
+        self.failUnlessEqual(self.buffer.stats()['bytes'], 8)
+        self.buffer.add('big', self.address, 'x' * 11, 1)
+        self.failIf(('big', self.address) in self.buffer, 'A message larger than the buffer should not be kept')
+        self.clock.advance(5)
+        self.failUnlessEqual(self.buffer.request('b', self.address), None)
+        self.failUnlessEqual(len(self.buffer), 0)
+        self.failUnlessEqual(self.buffer.stats()['evicted'], 3)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(RetransmitBufferTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
@@ -124,7 +124,52 @@ class TreeRoutingTableTest(unittest.TestCase):
         self.failIfEqual(self.routingTable._buckets[0].rangeMax, 2**160, 'K-bucket was split, but its range was not properly adjusted')
         self.failUnlessEqual(self.routingTable._buckets[1].rangeMax, 2**160, 'K-bucket was split, but the second (new) bucket\'s max range was not set properly')
         self.failUnlessEqual(self.routingTable._buckets[0].rangeMax, self.routingTable._buckets[1].rangeMin, 'K-bucket was split, but the min/max ranges were not divided properly')
-        
+
+    def testKBucketIndex(self):
+        """ Tests that the k-bucket of a key is found after many splits """
+        parentID = long(self.nodeID.encode('hex'), 16)
+        # k contacts at every other distance from the parent node split the
+        # k-bucket holding it over and over again
+        for bit in range(0, 160, 2):
+            for i in range(entangled.kademlia.constants.k):
+                nodeID = ('%040x' % (parentID ^ (1 << bit) ^ i)).decode('hex')
+                self.routingTable.addContact(entangled.kademlia.contact.Contact(nodeID, '127.0.0.1', 91824, self.protocol))
+        buckets = self.routingTable._buckets
+        self.failUnless(len(buckets) > 100, 'Only %d k-buckets' % len(buckets))
+        self.failUnlessEqual(self.routingTable._bucketBounds, [bucket.rangeMin for bucket in buckets])
+        keys = [self.nodeID, 20 * '\x00', 20 * '\xff']
+        for i in range(100):
+            h = hashlib.sha1()
+            h.update('key %d' % i)
+            keys.append(h.digest())
+        keys.extend([('%040x' % bucket.rangeMin).decode('hex') for bucket in buckets])
+        for key in keys:
+            index = self.routingTable._kbucketIndex(key)
+            self.failUnless(buckets[index].keyInRange(key),
+                            'Key %s is not in the range of k-bucket %d' % (key.encode('hex'), index))
+
+    def testFindCloseNodes(self):
+        """ Tests that the k contacts closest to a key are found, closest first """
+        contacts = []
+        for i in range(200):
+            h = hashlib.sha1()
+            h.update('remote node %d' % i)
+            contacts.append(entangled.kademlia.contact.Contact(h.digest(), '127.0.0.1', 91824, self.protocol))
+            self.routingTable.addContact(contacts[-1])
+        self.failUnless(len(self.routingTable._buckets) > 2)
+        known = []
+        for bucket in self.routingTable._buckets:
+            known.extend(bucket._contacts)
+        for i in range(50):
+            h = hashlib.sha1()
+            h.update('key %d' % i)
+            key = h.digest()
+            expected = sorted(known, key=lambda contact: self.routingTable.distance(key, contact.id))
+            closestNodes = self.routingTable.findCloseNodes(key, entangled.kademlia.constants.k)
+            self.failUnlessEqual(closestNodes, expected[:entangled.kademlia.constants.k])
+            closestNodes = self.routingTable.findCloseNodes(key, entangled.kademlia.constants.k, expected[0].id)
+            self.failUnlessEqual(closestNodes, expected[1:entangled.kademlia.constants.k + 1],
+                                 'The RPC sender should be left out')
 
     def testFullBucketNoSplit(self):
         """ Test that a bucket is not split if it full, but does not cover the range containing the parent node's ID """
@@ -148,9 +193,32 @@ class TreeRoutingTableTest(unittest.TestCase):
         self.failUnlessEqual(len(self.routingTable._buckets[0]._contacts), entangled.kademlia.constants.k, 'Bucket should have k contacts; expected %d got %d' % (entangled.kademlia.constants.k, len(self.routingTable._buckets[0]._contacts)))
         self.failIf(contact in self.routingTable._buckets[0]._contacts, 'New contact should have been discarded (since RPC is faked in this test)')
 
+class OptimizedTreeRoutingTableTest(unittest.TestCase):
+    """ Test case for the OptimizedTreeRoutingTable class """
+    def setUp(self):
+        h = hashlib.sha1()
+        h.update('node1')
+        self.nodeID = h.digest()
+        self.protocol = FakeRPCProtocol()
+        self.routingTable = entangled.kademlia.routingtable.OptimizedTreeRoutingTable(self.nodeID)
+
+    def testReplacementCache(self):
+        """ Tests that contacts for a full bucket are cached, up to k of them per bucket """
+        self.routingTable._parentNodeID = 21*'a' # not in the range of any k-bucket, so none is split
+        contacts = []
+        for i in range(3 * entangled.kademlia.constants.k):
+            h = hashlib.sha1()
+            h.update('remote node %d' % i)
+            contacts.append(entangled.kademlia.contact.Contact(h.digest(), '127.0.0.1', 91824, self.protocol))
+            self.routingTable.addContact(contacts[-1])
+        self.failUnlessEqual(len(self.routingTable._buckets[0]._contacts), entangled.kademlia.constants.k)
+        self.failUnlessEqual(self.routingTable._replacementCache[0], contacts[-entangled.kademlia.constants.k:],
+                             'The replacement cache should hold the k most recently seen contacts')
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(TreeRoutingTableTest))
+    suite.addTest(unittest.makeSuite(OptimizedTreeRoutingTableTest))
     return suite
 
 if __name__ == '__main__':
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import unittest
+
+from twisted.internet import task
+
+import entangled.kademlia.scheduler as scheduler
+
+class SendSchedulerTest(unittest.TestCase):
+    """ Test case for the token bucket send scheduler """
+    def setUp(self):
+        self.clock = task.Clock()
+        self.sent = []
+        self.scheduler = scheduler.SendScheduler(
+            lambda data, address: self.sent.append(data),
+            packetsPerSecond=10, packetBurst=2, bytesPerSecond=None,
+            byteBurst=0, clock=self.clock)
+
+    def testBurst(self):
+        """ Tests that a full bucket sends a burst right away, and paces the rest """
+        for i in range(5):
+            self.scheduler.enqueue(str(i), None)
+        self.failUnlessEqual(self.sent, [], 'Packets should only be sent once the reactor gets to it')
+        self.clock.advance(0)
+        self.failUnlessEqual(self.sent, ['0', '1'], 'Only the burst should have been sent, got: %s' % self.sent)
+        self.failUnlessEqual(self.scheduler.queueDepth(), 3)
+        self.failUnlessEqual(len(self.clock.getDelayedCalls()), 1, 'The queue should be drained by a single timer')
+        self.clock.advance(0.1)
+        self.failUnlessEqual(self.sent, ['0', '1', '2'])
+        self.clock.advance(0.1)
+        self.clock.advance(0.1)
+        self.failUnlessEqual(self.sent, ['0', '1', '2', '3', '4'])
+        self.failUnlessEqual(self.clock.getDelayedCalls(), [], 'No timer should be left once the queue is empty')
+
+    def testWaitResolution(self):
+        """ Tests that the timer moves the clock on when only a sliver of a token is missing """
+        self.clock.advance(1e9)
+        self.scheduler._refill(self.clock.seconds())
+        self.scheduler._packetTokens = 1 - 1e-7
+        self.scheduler.enqueue('0', None)
+        self.clock.advance(0)
+        self.failUnlessEqual(self.sent, [])
+        self.failUnless(self.scheduler._timer.getTime() > self.clock.seconds(),
+                        'The timer should not fire again at the same time')
+        self.clock.advance(1e-6)
+        self.failUnlessEqual(self.sent, ['0'])
+
+    def testResponsesFirst(self):
+        """ Tests that queued responses go ahead of queued requests """
+        for i in range(4):
+            self.scheduler.enqueue('request%d' % i, None)
+        self.clock.advance(0)
+        self.scheduler.enqueue('response', None, scheduler.priorityResponse)
+        self.clock.advance(0.1)
+        self.failUnlessEqual(self.sent, ['request0', 'request1', 'response'])
+
+    def testBandwidth(self):
+        """ Tests the byte rate limit, including packets larger than the bucket """
+        self.scheduler = scheduler.SendScheduler(
+            lambda data, address: self.sent.append(data),
+            packetsPerSecond=1000, packetBurst=10, bytesPerSecond=100,
+            byteBurst=100, clock=self.clock)
+        self.scheduler.enqueue('a' * 60, None)
+        self.scheduler.enqueue('b' * 60, None)
+        self.clock.advance(0)
+        self.failUnlessEqual(len(self.sent), 1)
+        self.clock.advance(0.2)
+        self.failUnlessEqual(len(self.sent), 2)
+        self.scheduler.enqueue('c' * 500, None)
+        self.clock.advance(0.5)
+        self.failUnlessEqual(len(self.sent), 2, 'An oversized packet should wait for a full bucket')
+        self.clock.advance(0.6)
+        self.failUnlessEqual(len(self.sent), 3)
+
+    def testStats(self):
+        """ Tests that the queue depth and pacing delay are reported """
+        for i in range(4):
+            self.scheduler.enqueue(str(i), None)
+        for delay in (0, 0.1, 0.1):
+            self.clock.advance(delay)
+        stats = self.scheduler.stats()
+        self.failUnlessEqual(stats['queueDepth'], 0)
+        self.failUnlessEqual(stats['maxQueueDepth'], 4)
+        self.failUnlessEqual(stats['sent'], 4)
+        self.failUnlessAlmostEqual(stats['maxDelay'], 0.2)
+        self.failUnlessAlmostEqual(stats['meanDelay'], 0.075)
+
+    def testWriteErrors(self):
+        """ Tests that a failing write doesn't hold up the other packets """
+        def write(data, address):
+            if data == 'bad':
+                raise ValueError('unreachable')
+            self.sent.append(data)
+        self.scheduler._write = write
+        self.scheduler.enqueue('bad', None)
+        self.scheduler.enqueue('good', None)
+        self.clock.advance(0)
+        self.failUnlessEqual(self.sent, ['good'])
+
+    def testStop(self):
+        """ Tests that stopping drops queued packets and the timer """
+        for i in range(4):
+            self.scheduler.enqueue(str(i), None)
+        self.scheduler.stop()
+        self.failUnlessEqual(self.scheduler.queueDepth(), 0)
+        self.failUnlessEqual(self.clock.getDelayedCalls(), [])
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SendSchedulerTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import pickle
+import unittest
+
+import Crypto.PublicKey.RSA
+
+import session
+import util
+
+class SessionTableTest(unittest.TestCase):
+    """ Test case for the session keys of Tinfoil nodes """
+    def setUp(self):
+        self.idA = 'a' * 20
+        self.idB = 'b' * 20
+        self.key = 'k' * 16
+        # Each node's view of the session it shares with the other
+        self.tableA = session.SessionTable()
+        self.tableB = session.SessionTable()
+        self.tableA.accept(self.idA, self.idB, self.key)
+        self.tableB.accept(self.idB, self.idA, self.key)
+
+    def testVerify(self):
+        """ Tests that a MAC verifies at the node it was meant for """
+        mac = session.sign(self.key, self.idA, self.idB, session.directionRequest, 'rpc1')
+        self.failUnless(self.tableB.verify(self.idA, self.idB, session.directionRequest, 'rpc1', mac))
+        self.failIf(self.tableB.verify(self.idA, self.idB, session.directionRequest, 'rpc2', mac),
+                    'A MAC must not verify other data')
+
+    def testReflectedMessage(self):
+        """ Tests that a message reflected back to its sender is rejected """
+        request = session.sign(self.key, self.idA, self.idB, session.directionRequest, 'rpc1')
+        self.failIf(self.tableA.verify(self.idB, self.idA, session.directionRequest, 'rpc1', request),
+                    'A request reflected back to its sender was accepted')
+        response = session.sign(self.key, self.idB, self.idA, session.directionResponse, 'rpc1')
+        self.failIf(self.tableB.verify(self.idA, self.idB, session.directionResponse, 'rpc1', response),
+                    'A response reflected back to its sender was accepted')
+
+    def testDirection(self):
+        """ Tests that a request's MAC is no good on a response, and vice versa """
+        request = session.sign(self.key, self.idA, self.idB, session.directionRequest, 'rpc1')
+        self.failIf(self.tableB.verify(self.idA, self.idB, session.directionResponse, 'rpc1', request))
+        response = session.sign(self.key, self.idA, self.idB, session.directionResponse, 'rpc1')
+        self.failIf(self.tableB.verify(self.idA, self.idB, session.directionRequest, 'rpc1', response))
+
+class KeyExchangeTest(unittest.TestCase):
+    """ Test case for offering a session key encrypted with the receiver's public key """
+    rsaKey = None
+
+    def setUp(self):
+        if KeyExchangeTest.rsaKey is None:
+            KeyExchangeTest.rsaKey = Crypto.PublicKey.RSA.generate(1024)
+        self.key = '\x00' + 'k' * 31
+        self.sender = 'f' * 20
+        self.ciphertext = session.encryptKey(self.rsaKey.publickey(), self.key, self.sender)
+
+    def testRoundTrip(self):
+        """ Tests that the receiver gets the offered key, leading zero bytes included """
+        self.failUnlessEqual(session.decryptKey(self.rsaKey, self.ciphertext, self.sender), self.key)
+        self.failIfEqual(session.encryptKey(self.rsaKey.publickey(), self.key, self.sender), self.ciphertext,
+                         'Encryption must be randomized')
+
+    def testReceivedKey(self):
+        """ Tests offering a key to a node whose public key came off the wire """
+        peerKey = pickle.loads(pickle.dumps(self.rsaKey.publickey()))
+        ciphertext = session.encryptKey(peerKey, self.key, self.sender)
+        self.failUnlessEqual(session.decryptKey(self.rsaKey, ciphertext, self.sender), self.key)
+
+    def testOtherSender(self):
+        """ Tests that a key offered by one node can't be passed off as offered by another """
+        self.failUnlessEqual(session.decryptKey(self.rsaKey, self.ciphertext, 'g' * 20), None)
+
+    def testMalformed(self):
+        """ Tests that tampered, blinded, oversized and short ciphertexts are all just no key """
+        n = self.rsaKey.n
+        c = util.bin2int(self.ciphertext)
+        blinded = util.int2bin(c * pow(2, self.rsaKey.e, n) % n, len(self.ciphertext))
+        tampered = self.ciphertext[:-1] + chr(ord(self.ciphertext[-1]) ^ 1)
+        oversized = util.int2bin(n + 1, len(self.ciphertext))
+        for ciphertext in (blinded, tampered, oversized, '\xff' * len(self.ciphertext), 'short', '', 42):
+            self.failUnlessEqual(session.decryptKey(self.rsaKey, ciphertext, self.sender), None)
+        # A key of the wrong length is no key either
+        ciphertext = session.encryptKey(self.rsaKey.publickey(), 'k' * 16, self.sender)
+        self.failUnlessEqual(session.decryptKey(self.rsaKey, ciphertext, self.sender), None)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SessionTableTest))
+    suite.addTest(unittest.makeSuite(KeyExchangeTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import unittest
+
+import twisted.internet.error
+import twisted.internet.protocol
+import twisted.python.log
+
+import simulation
+
+class RecordingProtocol(twisted.internet.protocol.DatagramProtocol):
+    """ Records the datagrams it receives, with the virtual time they arrived at """
+    def __init__(self, reactor):
+        self.reactor = reactor
+        self.received = []
+
+    def datagramReceived(self, data, address):
+        self.received.append((self.reactor.seconds(), data, address))
+
+class SimulatedReactorTest(unittest.TestCase):
+    """ Test case for the virtual clock of the simulated reactor """
+    def setUp(self):
+        self.reactor = simulation.SimulatedReactor()
+        self.calls = []
+
+    def record(self, name):
+        self.calls.append((self.reactor.seconds(), name))
+
+    def testOrder(self):
+        """ Tests that calls run in order of their time, and of scheduling within the same time """
+        for delay, name in ((3, 'c'), (1, 'a'), (2, 'b1'), (2, 'b2'), (0, 'now'), (-1, 'past')):
+            self.reactor.callLater(delay, self.record, name)
+        self.reactor.run()
+        self.failUnlessEqual(self.calls, [(0, 'now'), (0, 'past'), (1, 'a'), (2, 'b1'), (2, 'b2'), (3, 'c')])
+        self.failUnlessEqual(self.reactor.stats()['pending'], 0)
+
+    def testNested(self):
+        """ Tests that calls scheduled by running calls are relative to the virtual time they run at """
+        self.reactor.callLater(5, lambda: self.reactor.callLater(1, self.record, 'inner'))
+        self.reactor.callLater(5.5, self.record, 'outer')
+        self.reactor.run()
+        self.failUnlessEqual(self.calls, [(5.5, 'outer'), (6, 'inner')])
+
+    def testCancel(self):
+        """ Tests that cancelled calls don't run, and that reset calls run at their new time """
+        cancelled = self.reactor.callLater(1, self.record, 'cancelled')
+        delayed = self.reactor.callLater(2, self.record, 'delayed')
+        reset = self.reactor.callLater(3, self.record, 'reset')
+        self.reactor.callLater(4, self.record, 'kept')
+        cancelled.cancel()
+        delayed.delay(3)
+        reset.reset(0.5)
+        self.failIf(cancelled in self.reactor.getDelayedCalls())
+        self.failUnlessEqual(self.reactor.stats()['pending'], 4)
+        self.reactor.run()
+        self.failUnlessEqual(self.calls, [(0.5, 'reset'), (4, 'kept'), (5, 'delayed')])
+        self.failIf(cancelled.called)
+
+    def testRunUntil(self):
+        """ Tests that a reactor can be run in phases, and stopped from a call """
+        self.reactor.callLater(1, self.record, 'first')
+        self.reactor.callLater(2, self.reactor.stop)
+        self.reactor.callLater(3, self.record, 'second')
+        self.reactor.callLater(10, self.record, 'third')
+        self.reactor.run(until=0.5)
+        self.failUnlessEqual((self.calls, self.reactor.seconds()), ([], 0.5))
+        self.reactor.run()
+        self.failUnlessEqual((self.calls, self.reactor.seconds()), ([(1, 'first')], 2))
+        self.reactor.run(until=5)
+        self.failUnlessEqual((self.calls[-1], self.reactor.seconds()), ((3, 'second'), 5))
+        self.reactor.run()
+        self.failUnlessEqual(self.calls[-1], (10, 'third'))
+
+    def testErrors(self):
+        """ Tests that an error raised by a call is counted, and doesn't stop the reactor """
+        self.reactor.callLater(1, lambda: 1 / 0)
+        self.reactor.callLater(2, self.record, 'after')
+        logged = []
+        twisted.python.log.addObserver(logged.append)
+        try:
+            self.reactor.run()
+        finally:
+            twisted.python.log.removeObserver(logged.append)
+        self.failUnlessEqual([event['failure'].type for event in logged if event.get('isError')], [ZeroDivisionError])
+        self.failUnlessEqual(self.calls, [(2, 'after')])
+        self.failUnlessEqual(self.reactor.stats()['errors'], 1)
+
+class SimulatedNetworkTest(unittest.TestCase):
+    """ Test case for the delivery of datagrams by the simulated network """
+    def setUp(self):
+        self.reactor = simulation.SimulatedReactor()
+
+    def makeNetwork(self, **kwargs):
+        network = simulation.SimulatedNetwork(self.reactor, **kwargs)
+        self.reactor.network = network
+        self.sender = RecordingProtocol(self.reactor)
+        self.receiver = RecordingProtocol(self.reactor)
+        self.senderPort = self.reactor.listenUDP(0, self.sender)
+        self.receiverPort = self.reactor.listenUDP(4000, self.receiver)
+        return network
+
+    def send(self, count):
+        for i in range(count):
+            self.sender.transport.write(str(i), ('127.0.0.1', 4000))
+        self.reactor.run()
+
+    def testDelivery(self):
+        """ Tests that datagrams arrive after the latency, from the sender's address """
+        network = self.makeNetwork(latency=0.1, jitter=0, loss=0)
+        self.send(3)
+        source = ('127.0.0.1', self.senderPort.getHost().port)
+        self.failUnlessEqual(self.receiver.received, [(0.1, str(i), source) for i in range(3)])
+        self.failUnlessEqual(network.stats()['delivered'], 3)
+        self.failUnlessRaises(twisted.internet.error.CannotListenError,
+                              self.reactor.listenUDP, 4000, RecordingProtocol(self.reactor))
+
+    def testDelay(self):
+        """ Tests that delays stay within the latency and jitter, and repeat under the same seed """
+        arrivals = []
+        for run in range(2):
+            self.reactor = simulation.SimulatedReactor()
+            self.makeNetwork(latency=0.05, jitter=0.02, loss=0, seed=7)
+            self.send(100)
+            times = [when for when, data, address in self.receiver.received]
+            self.failUnlessEqual(len(times), 100)
+            self.failUnless(min(times) >= 0.05 and max(times) <= 0.07, (min(times), max(times)))
+            self.failUnless(len(set(times)) > 1, 'Datagrams were not jittered')
+            arrivals.append(self.receiver.received)
+        self.failUnlessEqual(arrivals[0], arrivals[1])
+
+    def testLoss(self):
+        """ Tests that the fraction of datagrams lost follows the loss rate, the same way under the same seed """
+        received = []
+        for seed in (3, 3, 4):
+            self.reactor = simulation.SimulatedReactor()
+            network = self.makeNetwork(loss=0.25, seed=seed)
+            self.send(1000)
+            stats = network.stats()
+            self.failUnlessEqual(stats['sent'], 1000)
+            self.failUnlessEqual(stats['delivered'] + stats['lost'], 1000)
+            self.failUnless(200 < stats['lost'] < 300, stats['lost'])
+            received.append([data for when, data, address in self.receiver.received])
+        self.failUnlessEqual(received[0], received[1])
+        self.failIfEqual(received[0], received[2])
+
+    def testOffline(self):
+        """ Tests that offline nodes neither send nor receive, and detached ones are unreachable """
+        network = self.makeNetwork(loss=0)
+        source = ('127.0.0.1', self.senderPort.getHost().port)
+        network.setOnline(source, False)
+        self.send(1)
+        network.setOnline(source, True)
+        network.setOnline(('127.0.0.1', 4000), False)
+        self.send(1)
+        self.failUnlessEqual(network.stats()['offline'], 2)
+        network.setOnline(('127.0.0.1', 4000), True)
+        self.receiverPort.stopListening()
+        self.send(1)
+        self.failUnlessEqual(self.receiver.received, [])
+        self.failUnlessEqual(network.stats()['unreachable'], 1)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SimulatedReactorTest))
+    suite.addTest(unittest.makeSuite(SimulatedNetworkTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import struct
+import unittest
+
+from twisted.internet import address
+from twisted.test import proto_helpers
+
+import entangled.kademlia.constants as constants
+import entangled.kademlia.stream as stream
+
+def frame(data):
+    return struct.pack('!I', len(data)) + data
+
+def hello(port, token=20 * 't'):
+    return frame(struct.pack('!H', port) + token)
+
+class StreamPoolTest(unittest.TestCase):
+    """ Test case for the pool of TCP connections used for large messages """
+    def setUp(self):
+        self.reactor = proto_helpers.MemoryReactorClock()
+        self.received = []
+        self.fellBack = []
+        self.tokensSent = []
+        self.pool = stream.StreamPool(
+            lambda data, address: self.received.append((data, address)),
+            lambda data, rpcID, address, priority: self.fellBack.append(data),
+            lambda token, address: self.tokensSent.append((token, address)),
+            maxConnections=4, maxConnectionsPerPeer=2, idleTimeout=60,
+            retryInterval=300, handshakeTimeout=2, reactor=self.reactor)
+        self.pool.listen(4000)
+
+    def _connectOut(self):
+        """ Completes the most recent outgoing connection """
+        factory = self.reactor.tcpClients[-1][2]
+        connection = factory.buildProtocol(None)
+        transport = proto_helpers.StringTransport()
+        connection.makeConnection(transport)
+        return connection, transport
+
+    def _connectIn(self, host, port, confirm=True):
+        """ Accepts a connection from the node at the given UDP address, which
+        confirms it by returning the token over UDP """
+        connection = self.pool.buildProtocol(None)
+        transport = proto_helpers.StringTransport(
+            peerAddress=address.IPv4Address('TCP', host, 50000))
+        connection.makeConnection(transport)
+        connection.dataReceived(hello(port))
+        if confirm:
+            self.pool.confirm(connection.token, (host, port))
+        return connection, transport
+
+    def testListen(self):
+        """ Tests that the pool listens on the UDP port's number """
+        self.failUnlessEqual(self.reactor.tcpServers[0][0], 4000)
+
+    def testOutgoing(self):
+        """ Tests that messages queue until the connection is made, and the connection is reused """
+        self.failUnless(self.pool.send('first', 'rpc1', ('10.0.0.1', 5000), 1))
+        self.failUnless(self.pool.send('second', 'rpc2', ('10.0.0.1', 5000), 1))
+        self.failUnlessEqual(len(self.reactor.tcpClients), 1)
+        self.failUnlessEqual(self.reactor.tcpClients[0][:2], ('10.0.0.1', 5000))
+        connection, transport = self._connectOut()
+        self.failUnlessEqual(transport.value(), hello(4000, connection.token))
+        transport.clear()
+        # The node's token goes back over UDP...
+        connection.dataReceived(hello(5000, 'x' * 20))
+        self.failUnlessEqual(self.tokensSent, [('x' * 20, ('10.0.0.1', 5000))])
+        self.failUnlessEqual(transport.value(), '')
+        # ...and once the node confirmed our UDP address, the messages follow
+        connection.dataReceived(frame(''))
+        self.failUnlessEqual(transport.value(), frame('first') + frame('second'))
+        transport.clear()
+        self.pool.send('third', 'rpc3', ('10.0.0.1', 5000), 1)
+        self.failUnlessEqual(transport.value(), frame('third'))
+        self.failUnlessEqual(len(self.reactor.tcpClients), 1, 'The connection should have been reused')
+        connection.dataReceived(frame('reply'))
+        self.failUnlessEqual(self.received, [('reply', ('10.0.0.1', 5000))])
+        self.reactor.advance(2)
+        self.failIf(transport.disconnecting)
+
+    def testIncoming(self):
+        """ Tests that incoming messages are attributed to the sender's UDP address, and replies reuse the connection """
+        connection, transport = self._connectIn('10.0.0.2', 6000)
+        self.failUnlessEqual(transport.value(), hello(4000, connection.token) + frame(''))
+        connection.dataReceived(frame('request'))
+        self.failUnlessEqual(self.received, [('request', ('10.0.0.2', 6000))])
+        transport.clear()
+        self.pool.send('response', 'rpc', ('10.0.0.2', 6000), 0)
+        self.failUnlessEqual(transport.value(), frame('response'))
+        self.failUnlessEqual(self.reactor.tcpClients, [])
+
+    def testUnconfirmedPort(self):
+        """ Tests that a connection is not attributed to a UDP port it didn't prove to own """
+        connection, transport = self._connectIn('10.0.0.2', 6000, confirm=False)
+        self.pool.confirm(connection.token, ('10.0.0.2', 6001))
+        self.pool.confirm(connection.token, ('10.0.0.3', 6000))
+        self.pool.confirm('y' * 20, ('10.0.0.2', 6000))
+        self.failUnlessEqual(self.pool.connectionCount(), 0)
+        connection.dataReceived(frame('request'))
+        self.failUnless(transport.disconnecting, 'A message before the handshake should close the connection')
+        self.failUnlessEqual(self.received, [])
+        connection.connectionLost()
+        self.pool.confirm(connection.token, ('10.0.0.2', 6000))
+        self.failUnlessEqual(self.pool.connectionCount(), 0)
+        # An unconfirmed connection is closed once the handshake timed out
+        connection, transport = self._connectIn('10.0.0.2', 6000, confirm=False)
+        self.reactor.advance(2)
+        self.failUnless(transport.disconnecting)
+
+    def testNotANode(self):
+        """ Tests that messages fall back to UDP if the TCP port isn't a node's """
+        for reply in ('', 'HTTP/1.1 400 Bad Request\r\n\r\n', hello(5001)):
+            self.reactor.advance(300)
+            self.pool.send('data', 'rpc', ('10.0.0.1', 5000), 1)
+            connection, transport = self._connectOut()
+            connection.dataReceived(reply)
+            self.reactor.advance(2)
+            self.failUnless(transport.disconnecting)
+            connection.connectionLost()
+            self.failUnlessEqual(self.fellBack, ['data'])
+            self.failIf(self.pool.send('more', 'rpc', ('10.0.0.1', 5000), 1),
+                        'The node should not be connected to again right away')
+            self.fellBack = []
+
+    def testConnectionLimits(self):
+        """ Tests the per-node and the overall connection limit """
+        self._connectIn('10.0.0.2', 6000)
+        self._connectIn('10.0.0.2', 6000)
+        connection, transport = self._connectIn('10.0.0.2', 6000)
+        self.failUnless(transport.disconnecting, 'A third connection from the same node should be rejected')
+        self.failUnlessEqual(self.pool.stats()['rejected'], 1)
+        self.reactor.advance(1)
+        oldest, oldestTransport = self._connectIn('10.0.0.3', 6000)
+        self.reactor.advance(1)
+        self._connectIn('10.0.0.4', 6000)
+        self.failUnlessEqual(self.pool.connectionCount(), 4)
+        self.reactor.advance(1)
+        self._connectIn('10.0.0.5', 6000)
+        self.failUnlessEqual(self.pool.connectionCount(), 4)
+        self.failUnlessEqual(self.pool.stats()['evicted'], 1)
+
+    def testIdleEviction(self):
+        """ Tests that idle connections are closed """
+        connection, transport = self._connectIn('10.0.0.2', 6000)
+        self.reactor.advance(30)
+        connection.dataReceived(frame('request'))
+        self.reactor.advance(30)
+        self.failIf(transport.disconnecting, 'A recently used connection should be kept')
+        self.reactor.advance(30)
+        self.failUnless(transport.disconnecting, 'An idle connection should be closed')
+        self.failUnlessEqual(self.pool.connectionCount(), 0)
+
+    def testUnreachable(self):
+        """ Tests that messages fall back to UDP if the node can't be connected to """
+        self.pool.send('data', 'rpc', ('10.0.0.1', 5000), 1)
+        factory = self.reactor.tcpClients[0][2]
+        factory.clientConnectionFailed(None, None)
+        self.failUnlessEqual(self.fellBack, ['data'])
+        self.failIf(self.pool.send('more', 'rpc', ('10.0.0.1', 5000), 1),
+                    'The node should not be connected to again right away')
+        self.reactor.advance(300)
+        self.failUnless(self.pool.send('more', 'rpc', ('10.0.0.1', 5000), 1))
+
+    def testOversized(self):
+        """ Tests that messages larger than the receiver accepts are left to UDP """
+        data = 'x' * (constants.streamMaxMessageSize + 1)
+        self.failIf(self.pool.send(data, 'rpc', ('10.0.0.1', 5000), 1))
+        self.failUnlessEqual(self.reactor.tcpClients, [])
+        self.failUnless(self.pool.send(data[:-1], 'rpc', ('10.0.0.1', 5000), 1))
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(StreamPoolTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
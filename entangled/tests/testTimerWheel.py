@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import unittest
+
+from twisted.internet import error, task
+
+import entangled.kademlia.timerwheel as timerwheel
+
+class TimerWheelTest(unittest.TestCase):
+    """ Test case for the timer wheel that runs RPC timeouts """
+    def setUp(self):
+        self.clock = task.Clock()
+        self.wheel = timerwheel.TimerWheel(resolution=0.25, clock=self.clock)
+        self.fired = []
+
+    def fire(self, name):
+        self.fired.append((name, self.clock.seconds()))
+
+    def testCallLater(self):
+        """ Tests that timers fire at the end of the tick their delay ends in """
+        self.wheel.callLater(1.1, self.fire, 'a')
+        self.clock.advance(1.2)
+        self.failUnlessEqual(self.fired, [], 'The timer fired too early')
+        self.clock.advance(0.05)
+        self.failUnlessEqual(self.fired, [('a', 1.25)])
+        self.failUnlessEqual(len(self.wheel), 0)
+        self.failUnlessEqual(self.clock.getDelayedCalls(), [],
+                             'An empty wheel should not keep a reactor call pending')
+
+    def testBatch(self):
+        """ Tests that the timers of one tick run together, in order, from one reactor call """
+        for i in range(100):
+            self.wheel.callLater(0.49 - i * 0.001, self.fire, i)
+        self.failUnlessEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(0.5)
+        self.failUnlessEqual([name for name, time in self.fired], range(99, -1, -1))
+        stats = self.wheel.stats()
+        self.failUnlessEqual(stats['expired'], 100)
+        self.failUnlessEqual(stats['batches'], 1)
+
+    def testCancel(self):
+        """ Tests that cancelled timers don't fire """
+        first = self.wheel.callLater(1, self.fire, 'first')
+        second = self.wheel.callLater(2, self.fire, 'second')
+        first.cancel()
+        self.failIf(first.active())
+        self.failUnlessRaises(error.AlreadyCancelled, first.cancel)
+        self.clock.advance(2)
+        self.failUnlessEqual(self.fired, [('second', 2)])
+        self.failUnlessRaises(error.AlreadyCalled, second.cancel)
+        third = self.wheel.callLater(1, self.fire, 'third')
+        third.cancel()
+        self.failUnlessEqual(self.clock.getDelayedCalls(), [])
+        self.failUnlessEqual(self.wheel.stats()['cancelled'], 2)
+
+    def testCancelWithinBatch(self):
+        """ Tests that a timer can cancel another one due in the same tick """
+        timers = []
+        def cancelOther():
+            self.fire('first')
+            timers[1].cancel()
+        timers.append(self.wheel.callLater(0.1, cancelOther))
+        timers.append(self.wheel.callLater(0.2, self.fire, 'second'))
+        self.clock.advance(0.25)
+        self.failUnlessEqual(self.fired, [('first', 0.25)])
+        self.failUnlessEqual(len(self.wheel), 0)
+
+    def testCascade(self):
+        """ Tests that timers beyond the first level fire on time """
+        # 400 ticks (second level), and 80000 ticks (third level) away
+        for delay in (20000, 100):
+            self.wheel.callLater(delay, self.fire, delay)
+        self.clock.advance(99.5)
+        self.failUnlessEqual(self.fired, [])
+        self.clock.advance(0.5)
+        self.failUnlessEqual(self.fired, [(100, 100)])
+        self.clock.advance(19899.5)
+        self.failUnlessEqual(len(self.fired), 1)
+        self.clock.advance(0.5)
+        self.failUnlessEqual(self.fired, [(100, 100), (20000, 20000)])
+        self.failUnlessEqual(len(self.clock.getDelayedCalls()), 0)
+
+    def testCascadeAfterRun(self):
+        """ Tests that a cascade due right after the wheel ran isn't skipped """
+        wheel = timerwheel.TimerWheel(resolution=1, clock=self.clock)
+        # Filed on the second level, to be cascaded at tick 256
+        wheel.callLater(300, self.fire, 'later')
+        # The last tick before the cascade
+        wheel.callLater(255, self.fire, 'first')
+        self.clock.advance(255)
+        self.clock.advance(45)
+        self.failUnlessEqual(self.fired, [('first', 255), ('later', 300)])
+
+    def testScheduleFromTimer(self):
+        """ Tests that timers scheduled by a running timer fire on time """
+        def reschedule():
+            self.fire('first')
+            self.wheel.callLater(1, self.fire, 'second')
+        self.wheel.callLater(0.5, reschedule)
+        self.wheel.callLater(5, self.fire, 'third')
+        self.clock.pump([0.25] * 24)
+        self.failUnlessEqual(self.fired, [('first', 0.5), ('second', 1.5), ('third', 5)])
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TimerWheelTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
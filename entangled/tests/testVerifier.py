@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+# This library is free software, distributed under the terms of
+# the GNU Lesser General Public License Version 3, or any later version.
+# See the COPYING file included in this archive
+
+import unittest
+
+import stats
+import verifier
+
+class ManualPipeline(verifier.VerificationPipeline):
+    """ Pipeline whose jobs are only verified when the test says so """
+    def __init__(self, **kwargs):
+        verifier.VerificationPipeline.__init__(self, threads=1, **kwargs)
+        self.started = []
+
+    def _dispatch(self, sender):
+        self.started.append(sender)
+
+    def finish(self, sender):
+        """ Verifies the job at the head of the sender's queue """
+        self._done(self._run(self._queues[sender][0]), sender)
+
+class VerificationPipelineTest(unittest.TestCase):
+    """ Test case for the queueing of message verification jobs """
+    def setUp(self):
+        self.results = []
+
+    def record(self, result, name):
+        self.results.append((name, result))
+
+    def testInline(self):
+        """ Tests that with no threads jobs are verified on submit, and recorded """
+        pipeline = verifier.VerificationPipeline(threads=0)
+        self.failUnless(pipeline.submit('a', lambda x: x * 2, (21,), self.record, ('job',)))
+        self.failUnlessEqual(self.results, [('job', 42)])
+        self.failIf(pipeline.busy('a'))
+        summary = pipeline.stats()
+        self.failUnlessEqual((summary['pending'], summary['dropped']), (0, 0))
+        self.failUnlessEqual((summary['queueWait']['count'], summary['verifyTime']['count']), (1, 1))
+        self.failUnlessEqual(pipeline.verifyInline(lambda: 'ok', ()), 'ok')
+        self.failUnlessEqual(pipeline.queueWait.count, 2)
+
+    def testInlineFailure(self):
+        """ Tests that with no threads an error in verification rejects the job without blocking its sender """
+        pipeline = verifier.VerificationPipeline(threads=0)
+        self.failUnless(pipeline.submit('a', lambda: 1 / 0, (), self.record, ('bad',)))
+        self.failIf(pipeline.busy('a'), 'The failed job was left queued')
+        self.failUnlessEqual(pipeline.pending, 0)
+        pipeline.submit('a', lambda: True, (), self.record, ('good',))
+        self.failUnlessEqual(self.results, [('bad', None), ('good', True)])
+
+    def testSenderOrder(self):
+        """ Tests that a sender's jobs are verified one at a time and in order, independently of other senders """
+        pipeline = ManualPipeline()
+        for name in ('a1', 'a2', 'a3'):
+            pipeline.submit('a', lambda: True, (), self.record, (name,))
+        pipeline.submit('b', lambda: True, (), self.record, ('b1',))
+        self.failUnlessEqual(pipeline.started, ['a', 'b'])
+        pipeline.finish('b')
+        pipeline.finish('a')
+        self.failUnlessEqual(pipeline.started, ['a', 'b', 'a'])
+        pipeline.finish('a')
+        pipeline.finish('a')
+        self.failUnlessEqual([name for name, result in self.results], ['b1', 'a1', 'a2', 'a3'])
+        self.failIf(pipeline.busy('a') or pipeline.busy('b'))
+        self.failUnlessEqual(pipeline.pending, 0)
+
+    def testOverload(self):
+        """ Tests that jobs are dropped while the queue is full, and accepted again once it drains """
+        pipeline = ManualPipeline(maxQueueDepth=2)
+        self.failUnless(pipeline.submit('a', lambda: True, (), self.record, ('a1',)))
+        self.failUnless(pipeline.submit('b', lambda: True, (), self.record, ('b1',)))
+        self.failIf(pipeline.submit('c', lambda: True, (), self.record, ('c1',)))
+        self.failIf(pipeline.busy('c'))
+        self.failUnlessEqual(pipeline.stats()['dropped'], 1)
+        pipeline.finish('a')
+        self.failUnless(pipeline.submit('c', lambda: True, (), self.record, ('c2',)))
+        self.failUnlessEqual(pipeline.stats()['pending'], 2)
+
+class HistogramTest(unittest.TestCase):
+    """ Test case for the histograms of the verification times """
+    def testEmpty(self):
+        """ Tests the summary of a histogram without samples """
+        self.failUnlessEqual(stats.Histogram().summary(),
+                             {'count': 0, 'mean': 0.0, 'p50': 0.0, 'p99': 0.0, 'max': 0.0})
+
+    def testPercentiles(self):
+        """ Tests that percentiles report the upper bound of their bucket, and the maximum for overflows """
+        histogram = stats.Histogram([1, 10, 100])
+        for value in [0.5] * 50 + [5] * 40 + [50] * 9 + [500]:
+            histogram.record(value)
+        self.failUnlessEqual(histogram.counts, [50, 40, 9, 1])
+        self.failUnlessEqual(histogram.percentile(0.5), 1)
+        self.failUnlessEqual(histogram.percentile(0.9), 10)
+        self.failUnlessEqual(histogram.percentile(0.99), 100)
+        self.failUnlessEqual(histogram.percentile(1.0), 500)
+        summary = histogram.summary()
+        self.failUnlessEqual((summary['count'], summary['max']), (100, 500))
+        self.failUnlessAlmostEqual(summary['mean'], (25 + 200 + 450 + 500) / 100.0)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(VerificationPipelineTest))
+    suite.addTest(unittest.makeSuite(HistogramTest))
+    return suite
+
+if __name__ == '__main__':
+    # If this module is executed from the commandline, run all its tests
+    unittest.TextTestRunner().run(suite())
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Remembers which (node ID, X) pairs solved the crypto puzzles."""
+
+import constants
+
+import collections
+import threading
+
+
+class VerifiedIDCache(object):
+  '''Bounded LRU caches of puzzle verification results.
+
+  Valid and invalid pairs are kept apart, so a flood of bogus IDs can only
+  evict other bogus IDs. The cache is shared by the verification threads and
+  the reactor, hence the lock.
+  '''
+
+  def __init__(
+      self,
+      capacity = constants.VERIFIED_ID_CACHE_SIZE,
+      negativeCapacity = constants.REJECTED_ID_CACHE_SIZE):
+    self.capacity = capacity
+    self.negativeCapacity = negativeCapacity
+    self._valid = collections.OrderedDict()
+    self._invalid = collections.OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def lookup(self, nodeID, x):
+    """Returns the cached result for (nodeID, x), or None if unknown."""
+    pair = (nodeID, x)
+    with self._lock:
+      for table in (self._valid, self._invalid):
+        if pair in table:
+          self.hits += 1
+          table[pair] = table.pop(pair)
+          return table is self._valid
+      self.misses += 1
+      return None
+
+  def rejected(self, nodeID, x):
+    """Returns whether (nodeID, x) is known to be invalid."""
+    with self._lock:
+      return (nodeID, x) in self._invalid
+
+  def record(self, nodeID, x, valid):
+    if valid:
+      table, capacity = self._valid, self.capacity
+    else:
+      table, capacity = self._invalid, self.negativeCapacity
+    with self._lock:
+      table[(nodeID, x)] = True
+      while len(table) > capacity:
+        table.popitem(last = False)
+
+  def stats(self):
+    with self._lock:
+      return {
+        'valid': len(self._valid),
+        'invalid': len(self._invalid),
+        'hits': self.hits,
+        'misses': self.misses,
+      }
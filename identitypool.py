@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Node identities for running many nodes in one process."""
+
+import Crypto.Hash.SHA
+import Crypto.PublicKey.RSA
+import Crypto.Random
+
+import constants
+import keystore
+import puzzle
+import util
+
+import random
+
+
+class SharedIdentities(object):
+  '''Hands out (node ID, RSA key, X) identities.
+
+  Without a keystore all identities share one RSA key, generated when the
+  first identity is handed out, and get IDs that satisfy the crypto puzzles'
+  hash conditions - which is all TintangledProtocol._verifyID checks - so
+  they cost next to nothing. With a keystore every identity is a pre-solved
+  one claimed from it, with a key of its own.
+
+  With a seed the same identities are handed out on every run.
+  '''
+
+  def __init__(
+      self, seed = None, rsaBits = constants.RSA_BITS, keystorePath = None):
+    if seed is None:
+      self._read = Crypto.Random.new().read
+    else:
+      rng = random.Random(seed)
+      self._read = lambda n: ('%0*x' % (2 * n, rng.getrandbits(8 * n))).decode('hex')
+    self.rsaBits = rsaBits
+    self._keystore = None
+    if keystorePath is not None:
+      self._keystore = keystore.Keystore(keystorePath)
+    self._rsaKey = None
+    self.handedOut = 0
+
+  @property
+  def sharedKey(self):
+    """Whether the identities share one key, so their IDs are not their
+    keys' fingerprints: nodes using them need constants.BIND_KEY_TO_ID off."""
+    return self._keystore is None
+
+  def rsaKey(self):
+    """Returns the shared RSA key, generating it on first use."""
+    if self._rsaKey is None:
+      self._rsaKey = Crypto.PublicKey.RSA.generate(self.rsaBits, self._read)
+    return self._rsaKey
+
+  def next(self):
+    """Returns a new identity as (node ID, RSA key, X)."""
+    self.handedOut += 1
+    if self._keystore is not None:
+      return self._keystore.claim()[1]
+    rsaKey = self.rsaKey()
+    while True:
+      nodeID = self._read(constants.ID_LENGTH)
+      if util.hasNZeroBitPrefix(
+          util.hsh2int(Crypto.Hash.SHA.new(nodeID)),
+          constants.CRYPTO_CHALLENGE_C1):
+        break
+    x = None
+    while x is None:
+      x = puzzle.dynamicAttempt(self._read, nodeID)
+    return nodeID, rsaKey, x
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Bounded cache of parsed RSA public keys."""
+
+import Crypto.Hash.SHA
+
+import constants
+
+import collections
+import pickle
+
+
+class KeyCache(object):
+  '''LRU cache of public keys, by user ID (i.e. key fingerprint).
+
+  It also interns keys received in serialized form: bytes seen before map to
+  the key object already parsed for them, so frequent peers don't cost an
+  unpickle per message. Both tables are bounded by capacity and evict the
+  least recently used entry.
+  '''
+
+  def __init__(self, capacity = constants.KEY_CACHE_SIZE):
+    self.capacity = capacity
+    self._keys = collections.OrderedDict()
+    self._interned = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.internHits = 0
+    self.internMisses = 0
+
+  # -*- Dictionary interface (user ID -> key) -*-
+
+  def __contains__(self, userID):
+    return userID in self._keys
+
+  def __getitem__(self, userID):
+    rsaKey = self.get(userID)
+    if rsaKey is None:
+      raise KeyError(userID)
+    return rsaKey
+
+  def __setitem__(self, userID, rsaKey):
+    self._put(self._keys, userID, rsaKey)
+
+  def __delitem__(self, userID):
+    del self._keys[userID]
+
+  def __len__(self):
+    return len(self._keys)
+
+  def get(self, userID, default = None):
+    rsaKey = self._keys.pop(userID, None)
+    if rsaKey is None:
+      self.misses += 1
+      return default
+    self.hits += 1
+    self._keys[userID] = rsaKey
+    return rsaKey
+
+  def clear(self):
+    self._keys.clear()
+    self._interned.clear()
+
+  # -*- Interning of serialized keys -*-
+
+  def intern(self, serializedKey, parse = pickle.loads):
+    """Returns the key object for a serialized key, parsing it only once."""
+    digest = Crypto.Hash.SHA.new(serializedKey).digest()
+    rsaKey = self._interned.pop(digest, None)
+    if rsaKey is None:
+      self.internMisses += 1
+      rsaKey = parse(serializedKey)
+    else:
+      self.internHits += 1
+    self._put(self._interned, digest, rsaKey)
+    return rsaKey
+
+  def stats(self):
+    """Returns sizes and hit/miss counters of both tables."""
+    return {
+      'keys': len(self._keys),
+      'hits': self.hits,
+      'misses': self.misses,
+      'interned': len(self._interned),
+      'internHits': self.internHits,
+      'internMisses': self.internMisses,
+    }
+
+  def _put(self, table, key, value):
+    table.pop(key, None)
+    table[key] = value
+    while len(table) > self.capacity:
+      table.popitem(last = False)
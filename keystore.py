@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""A single-file store of pre-solved node identities (id, RSA key, X).
+
+The file starts with a fixed header followed by fixed-size records, so any
+bundle can be read - and the next unused one claimed - in O(1):
+
+    | magic   | version | record count | next unclaimed |
+    |(4 bytes)|(1 byte) |  (4 bytes)   |   (4 bytes)    |
+
+    | node ID   | X         | key length | DER-exported RSA key (padded) |
+    |(20 bytes) |(20 bytes) | (2 bytes)  |     (KEY_SLOT_SIZE bytes)     |
+"""
+
+import Crypto.PublicKey.RSA
+
+import constants
+import util
+
+import errno
+import fcntl
+import os
+import struct
+
+
+MAGIC = 'TFKS'
+VERSION = 1
+HEADER = struct.Struct('!4sBII')
+RECORD_HEADER = struct.Struct('!%ds%dsH' % (
+    constants.ID_LENGTH, constants.ID_LENGTH))
+# Room for a DER-exported RSA_BITS private key (n, d and the CRT values).
+KEY_SLOT_SIZE = 5 * constants.RSA_BITS / 8 + 64
+RECORD_SIZE = RECORD_HEADER.size + KEY_SLOT_SIZE
+
+
+class KeystoreError(Exception):
+  """Raised when a keystore file is malformed."""
+
+class KeystoreExhausted(KeystoreError):
+  """Raised when every bundle in the keystore has already been claimed."""
+
+
+class Keystore(object):
+  '''Indexed file of identity bundles.
+
+  All access goes through an exclusive flock, so several node processes can
+  claim bundles from the same file concurrently.
+  '''
+
+  def __init__(self, path):
+    """Opens (and if needed creates) the keystore at path."""
+    self.path = path
+    try:
+      os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_RDWR))
+    except OSError, e:
+      if e.errno != errno.EEXIST:
+        raise
+    else:
+      # The header is written under the lock, see _open
+      self._close(self._open())
+
+  def __len__(self):
+    f = self._open()
+    try:
+      return self._readHeader(f)[0]
+    finally:
+      self._close(f)
+
+  def append(self, bundles):
+    """Appends a list of (id, rsaKey, x) bundles to the keystore."""
+    f = self._open()
+    try:
+      count, nextUnclaimed = self._readHeader(f)
+      f.seek(HEADER.size + count * RECORD_SIZE)
+      for bundle in bundles:
+        f.write(self._packRecord(*bundle))
+      self._writeHeader(f, count + len(bundles), nextUnclaimed)
+    finally:
+      self._close(f)
+
+  def get(self, index):
+    """Returns the (id, rsaKey, x) bundle stored at index."""
+    f = self._open()
+    try:
+      count = self._readHeader(f)[0]
+      if not 0 <= index < count:
+        raise IndexError('No bundle %d in keystore of %d' % (index, count))
+      return self._readRecord(f, index)
+    finally:
+      self._close(f)
+
+  def claim(self):
+    """Claims the next unused bundle, returning (index, (id, rsaKey, x))."""
+    f = self._open()
+    try:
+      count, nextUnclaimed = self._readHeader(f)
+      if nextUnclaimed >= count:
+        raise KeystoreExhausted(
+            'All %d bundles in %s are claimed' % (count, self.path))
+      self._writeHeader(f, count, nextUnclaimed + 1)
+      return nextUnclaimed, self._readRecord(f, nextUnclaimed)
+    finally:
+      self._close(f)
+
+  def unclaimed(self):
+    """Returns the number of bundles still available."""
+    f = self._open()
+    try:
+      count, nextUnclaimed = self._readHeader(f)
+      return count - nextUnclaimed
+    finally:
+      self._close(f)
+
+  # -*- File helpers -*-
+
+  def _open(self):
+    f = open(self.path, 'r+b')
+    fcntl.flock(f, fcntl.LOCK_EX)
+    if not os.fstat(f.fileno()).st_size:
+      # Just created, by us or a concurrent process that hasn't locked it yet
+      self._writeHeader(f, 0, 0)
+    return f
+
+  def _close(self, f):
+    f.flush()
+    fcntl.flock(f, fcntl.LOCK_UN)
+    f.close()
+
+  def _readHeader(self, f):
+    f.seek(0)
+    data = f.read(HEADER.size)
+    if len(data) != HEADER.size:
+      raise KeystoreError('Truncated keystore header in %s' % self.path)
+    magic, version, count, nextUnclaimed = HEADER.unpack(data)
+    if magic != MAGIC or version != VERSION:
+      raise KeystoreError('%s is not a version %d keystore' % (
+          self.path, VERSION))
+    return count, nextUnclaimed
+
+  def _writeHeader(self, f, count, nextUnclaimed):
+    f.seek(0)
+    f.write(HEADER.pack(MAGIC, VERSION, count, nextUnclaimed))
+
+  def _packRecord(self, id, rsaKey, x):
+    exportedKey = rsaKey.exportKey('DER')
+    if len(exportedKey) > KEY_SLOT_SIZE:
+      raise KeystoreError('Exported key does not fit in a keystore record')
+    return (
+        RECORD_HEADER.pack(id, util.int2bin(x), len(exportedKey)) +
+        exportedKey.ljust(KEY_SLOT_SIZE, '\x00'))
+
+  def _readRecord(self, f, index):
+    f.seek(HEADER.size + index * RECORD_SIZE)
+    data = f.read(RECORD_SIZE)
+    if len(data) != RECORD_SIZE:
+      raise KeystoreError('Truncated record %d in %s' % (index, self.path))
+    id, x, keyLength = RECORD_HEADER.unpack(data[:RECORD_HEADER.size])
+    exportedKey = data[RECORD_HEADER.size:(RECORD_HEADER.size + keyLength)]
+    return (
+        id,
+        Crypto.PublicKey.RSA.importKey(exportedKey),
+        util.bin2int(x))
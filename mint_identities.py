@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Mints pre-solved node identities in bulk into a keystore file.
+
+Every identity solves both crypto puzzles exactly as TintangledNode would, so
+nodes started from the keystore are indistinguishable from ones that solved
+their own puzzles at boot.
+"""
+
+import Crypto.PublicKey.RSA
+import Crypto.Random
+
+import keystore
+import puzzle
+
+import multiprocessing
+import sys
+import time
+
+
+def _mintIdentity(seed):
+  """Solves both puzzles once, returning an (id, exported key, x) bundle.
+
+  Runs in a pool worker; the key is shipped back DER-exported.
+  """
+  Crypto.Random.atfork()
+  solver = puzzle.PuzzleSolver(workers = 1, seed = seed)
+  rsaKey, nodeID = solver.solveStatic()
+  x = solver.solveDynamic(nodeID)
+  return nodeID, rsaKey.exportKey('DER'), x
+
+def mint(path, amount, workers = None, seed = None, batchSize = 16):
+  """Mints amount identities into the keystore at path, in parallel."""
+  store = keystore.Keystore(path)
+  offset = len(store)
+  if workers is None:
+    workers = multiprocessing.cpu_count()
+  seeds = [
+      (None if seed is None else '%s:%d' % (seed, (offset + i)))
+      for i in range(amount)]
+  pool = multiprocessing.Pool(workers)
+  batch = []
+  minted = 0
+  startTime = time.time()
+  try:
+    for nodeID, exportedKey, x in pool.imap(_mintIdentity, seeds):
+      batch.append((nodeID, Crypto.PublicKey.RSA.importKey(exportedKey), x))
+      if len(batch) >= batchSize:
+        store.append(batch)
+        minted += len(batch)
+        batch = []
+        sys.stdout.write('\rMinted %d/%d identities' % (minted, amount))
+        sys.stdout.flush()
+    if batch:
+      store.append(batch)
+      minted += len(batch)
+  finally:
+    pool.terminate()
+  elapsed = time.time() - startTime
+  print('\rMinted %d identities into %s in %.1fs (%.2f/s)' % (
+      minted, path, elapsed, (minted / elapsed) if elapsed > 0 else 0.0))
+  return minted
+
+
+if __name__ == '__main__':
+  if len(sys.argv) < 3:
+    print('Usage:\n%s KEYSTORE_FILE AMOUNT [WORKERS] [SEED]' % sys.argv[0])
+    print('\nAppends AMOUNT freshly minted identities to KEYSTORE_FILE.')
+    sys.exit(1)
+  try:
+    amount = int(sys.argv[2])
+    workers = int(sys.argv[3]) if len(sys.argv) >= 4 else None
+  except ValueError:
+    print('\nAMOUNT and WORKERS must be integer values.\n')
+    sys.exit(1)
+  seed = sys.argv[4] if len(sys.argv) >= 5 else None
+  mint(sys.argv[1], amount, workers, seed)
@@ -2,9 +2,15 @@
 
 import msgtypes
 from entangled.kademlia.msgformat import MessageTranslator
+from entangled.kademlia.encoding import DecodeError
+import binaryencoding
+import compression
+import keycache
 import util
 import Crypto
+import Crypto.PublicKey.RSA
 import pickle
+import struct
 
 class TintangledDefaultFormat(MessageTranslator):
   """ The default on-the-wire message format for this library """
@@ -22,19 +28,87 @@ class TintangledDefaultFormat(MessageTranslator):
     headerPublicKey,
     headerSignedValue, 
     headerPayload, 
-    headerArgs
-  ) = range(8)
+    headerArgs,
+    headerSessionKey,
+    headerMAC,
+    headerKeyFingerprint,
+    headerCompressed,
+    headerAcceptsCompression,
+    headerAcceptsEnvelopes
+  ) = range(14)
+
+  def __init__(self, keyCache = None, compressor = None):
+    # Shared with the node, so keys parsed here are the ones it caches
+    if keyCache is None:
+      keyCache = keycache.KeyCache()
+    self.keyCache = keyCache
+    if compressor is None:
+      compressor = compression.Compressor()
+    self.compressor = compressor
+
+  def compress(self, message):
+    """Compresses the payload of an outgoing message that may be compressed,
+    if that shrinks it.
+
+    The signature or MAC covers the compressed payload, so this has to happen
+    before the message is signed; toPrimitive() does it otherwise.
+    """
+    if not message.compress or message.compressedPayload is not None:
+      return
+    compressed = None
+    if isinstance(message, msgtypes.RequestMessage):
+      compressed = self.compressor.compress(
+          message.request, self._dumpPayload(message.args))
+    elif (isinstance(message, msgtypes.ResponseMessage) and
+        not isinstance(message, msgtypes.ErrorMessage)):
+      compressed = self.compressor.compress(
+          'response', self._dumpPayload(message.response))
+    if compressed is None:
+      message.compress = False
+    else:
+      message.compressedPayload = compressed
+
+  def decompress(self, message):
+    """Inflates the compressed payload of an incoming message, which
+    fromPrimitive() leaves alone, into its arguments or response.
+
+    Only to be called once the sender is authenticated.
+
+    @raise DecodeError: if the payload is malformed or too large
+    """
+    if message.compressedPayload is None:
+      return
+    if type(message.compressedPayload) != str:
+      raise DecodeError('Compressed payload is not a string')
+    if isinstance(message, msgtypes.RequestMessage):
+      message.args = self._loadPayload(self.compressor.decompress(
+          message.request, message.compressedPayload))
+    else:
+      message.response = self._loadPayload(self.compressor.decompress(
+          'response', message.compressedPayload))
+
+  def _dumpPayload(self, payload):
+    return pickle.dumps(payload)
+
+  def _loadPayload(self, data):
+    return pickle.loads(data)
   
   def fromPrimitive(self, msgPrimitive):
     
     msgType = msgPrimitive[self.headerType]
 
-    rsaKey = pickle.loads(msgPrimitive[self.headerPublicKey])
+    # Full keys only travel on first contact; otherwise the receiver resolves
+    # the fingerprint itself.
+    if self.headerPublicKey in msgPrimitive:
+      rsaKey = self.keyCache.intern(msgPrimitive[self.headerPublicKey])
+    else:
+      rsaKey = None
 
+    compressed = bool(msgPrimitive.get(self.headerCompressed))
     if msgType == self.typeRequest:
       msg = msgtypes.RequestMessage(nodeID = msgPrimitive[self.headerNodeID],
         method = msgPrimitive[self.headerPayload], 
-        methodArgs = pickle.loads(msgPrimitive[self.headerArgs]),
+        methodArgs = self._payload(msgPrimitive, self.headerArgs, compressed),
         rsaKey = rsaKey,
         cryptoChallengeX = msgPrimitive[self.headerCryptoChallengeX], 
         rpcID = msgPrimitive[self.headerMsgID],
@@ -44,7 +118,7 @@ class TintangledDefaultFormat(MessageTranslator):
         nodeID = msgPrimitive[self.headerNodeID], 
         rsaKey = rsaKey, 
         cryptoChallengeX = msgPrimitive[self.headerCryptoChallengeX],
-        response = pickle.loads(msgPrimitive[self.headerPayload]),
+        response = self._payload(msgPrimitive, self.headerPayload, compressed),
         signedValue = msgPrimitive[self.headerSignedValue])
     elif msgType == self.typeError:
       msg = msgtypes.ErrorMessage(msgPrimitive[self.headerMsgID], 
@@ -61,23 +135,199 @@ class TintangledDefaultFormat(MessageTranslator):
         rsaKey, 
         msgPrimitive[self.headerCryptoChallengeX],
         msgPrimitive[self.headerSignedValue])
+    msg.sessionKey = msgPrimitive.get(self.headerSessionKey)
+    msg.mac = msgPrimitive.get(self.headerMAC)
+    msg.keyFingerprint = msgPrimitive.get(self.headerKeyFingerprint)
+    msg.includeKey = rsaKey is not None
+    msg.acceptsCompression = bool(
+        msgPrimitive.get(self.headerAcceptsCompression))
+    msg.acceptsEnvelopes = bool(msgPrimitive.get(self.headerAcceptsEnvelopes))
+    if compressed and msgType == self.typeRequest:
+      msg.compressedPayload = msgPrimitive[self.headerArgs]
+    elif compressed and msgType == self.typeResponse:
+      msg.compressedPayload = msgPrimitive[self.headerPayload]
     return msg
 
+  def _payload(self, msgPrimitive, header, compressed):
+    """Returns the unpickled payload, or None if it is compressed."""
+    if compressed:
+      return None
+    return pickle.loads(msgPrimitive[header])
+
   def toPrimitive(self, message):    
     msg = {self.headerMsgID:  message.id,
       self.headerNodeID: message.nodeID,
       self.headerCryptoChallengeX: message.cryptoChallengeX,
-      self.headerPublicKey: pickle.dumps(message.rsaKey),
+      self.headerKeyFingerprint: message.keyFingerprint,
       self.headerSignedValue: message.signedValue,}
+    if message.includeKey:
+      msg[self.headerPublicKey] = pickle.dumps(message.rsaKey)
+    if message.sessionKey is not None:
+      msg[self.headerSessionKey] = message.sessionKey
+    if message.mac is not None:
+      msg[self.headerMAC] = message.mac
+    if message.acceptsCompression:
+      msg[self.headerAcceptsCompression] = 1
+    if message.acceptsEnvelopes:
+      msg[self.headerAcceptsEnvelopes] = 1
+    self.compress(message)
+    compressed = message.compressedPayload
     if isinstance(message, msgtypes.RequestMessage):
       msg[self.headerType] = self.typeRequest
       msg[self.headerPayload] = message.request
-      msg[self.headerArgs] = pickle.dumps(message.args)
+      msg[self.headerArgs] = compressed or pickle.dumps(message.args)
     elif isinstance(message, msgtypes.ErrorMessage):
       msg[self.headerType] = self.typeError
       msg[self.headerPayload] = message.exceptionType
       msg[self.headerArgs] = message.response
     elif isinstance(message, msgtypes.ResponseMessage):
       msg[self.headerType] = self.typeResponse
-      msg[self.headerPayload] = pickle.dumps(message.response)
-    return msg
\ No newline at end of file
+      msg[self.headerPayload] = compressed or pickle.dumps(message.response)
+    if compressed is not None:
+      msg[self.headerCompressed] = 1
+    return msg
+
+class TintangledBinaryFormat(TintangledDefaultFormat):
+  """ Compact message format, to be used with binaryencoding.BinaryEncoding
+
+  The primitive of a message is a (header, payload) tuple. The header packs
+  the fixed fields - format version, type, flags, RPC ID, node ID, X and key
+  fingerprint - followed by the fields the flags mark as present, each with a
+  2-byte length. The payload holds the RPC arguments, response or error
+  message as they are, for the encoding to serialize; nothing is pickled.
+  Compressed payloads are encoded by the translator itself, and the payload
+  is then the compressed string.
+  """
+  version = 1
+
+  header = struct.Struct('!BBB20s20s20s20s')
+  fieldLength = struct.Struct('!H')
+
+  # Optional header fields, in the order they follow the fixed ones
+  (
+    flagPublicKey,
+    flagSignedValue,
+    flagMAC,
+    flagSessionKey,
+    flagName,
+    flagCompressed,
+    flagAcceptsCompression,
+    flagAcceptsEnvelopes
+  ) = [1 << i for i in range(8)]
+
+  def __init__(self, keyCache = None, compressor = None):
+    TintangledDefaultFormat.__init__(self, keyCache, compressor)
+    self._payloadEncoding = binaryencoding.BinaryEncoding()
+
+  def fromPrimitive(self, msgPrimitive):
+    try:
+      return self._fromPrimitive(msgPrimitive)
+    except (KeyError, ValueError, TypeError, struct.error), e:
+      raise DecodeError(e)
+
+  def _fromPrimitive(self, msgPrimitive):
+    header, payload = msgPrimitive
+    (version, msgType, flags, rpcID, nodeID, x,
+        fingerprint) = self.header.unpack_from(header)
+    if version != self.version:
+      raise ValueError('Unsupported message version %d' % version)
+    fields = {}
+    index = self.header.size
+    for flag in (self.flagPublicKey, self.flagSignedValue, self.flagMAC,
+        self.flagSessionKey, self.flagName):
+      if flags & flag:
+        length = self.fieldLength.unpack_from(header, index)[0]
+        index += self.fieldLength.size
+        fields[flag] = header[index:index + length]
+        index += length
+    if index != len(header):
+      raise ValueError('Malformed message header')
+    compressedPayload = None
+    if flags & self.flagCompressed:
+      if type(payload) != str:
+        raise ValueError('Compressed payload is not a string')
+      compressedPayload, payload = payload, None
+
+    rsaKey = None
+    if self.flagPublicKey in fields:
+      rsaKey = self.keyCache.intern(
+          fields[self.flagPublicKey], Crypto.PublicKey.RSA.importKey)
+    signedValue = None
+    if self.flagSignedValue in fields:
+      signedValue = (util.bin2int(fields[self.flagSignedValue]),)
+    x = util.bin2int(x)
+
+    if msgType == self.typeRequest:
+      msg = msgtypes.RequestMessage(nodeID, fields[self.flagName], payload,
+          rsaKey, x, rpcID, signedValue)
+    elif msgType == self.typeResponse:
+      msg = msgtypes.ResponseMessage(rpcID, nodeID, rsaKey, x, payload,
+          signedValue)
+    elif msgType == self.typeError:
+      msg = msgtypes.ErrorMessage(rpcID, nodeID, rsaKey, x,
+          fields[self.flagName], payload, signedValue)
+    else:
+      msg = msgtypes.Message(rpcID, nodeID, rsaKey, x, signedValue)
+    msg.sessionKey = fields.get(self.flagSessionKey)
+    msg.mac = fields.get(self.flagMAC)
+    msg.keyFingerprint = fingerprint
+    msg.includeKey = rsaKey is not None
+    msg.acceptsCompression = bool(flags & self.flagAcceptsCompression)
+    msg.acceptsEnvelopes = bool(flags & self.flagAcceptsEnvelopes)
+    if msgType in (self.typeRequest, self.typeResponse):
+      msg.compressedPayload = compressedPayload
+    return msg
+
+  def toPrimitive(self, message):
+    if len(message.id) != 20:
+      raise ValueError('RPC IDs must be 20 bytes long')
+    fields = []
+    if message.includeKey:
+      fields.append((self.flagPublicKey, message.rsaKey.exportKey('DER')))
+    if message.signedValue is not None:
+      fields.append((self.flagSignedValue,
+          util.int2bytes(message.signedValue[0])))
+    if message.mac is not None:
+      fields.append((self.flagMAC, message.mac))
+    if message.sessionKey is not None:
+      fields.append((self.flagSessionKey, message.sessionKey))
+
+    payload = None
+    self.compress(message)
+    if isinstance(message, msgtypes.RequestMessage):
+      msgType = self.typeRequest
+      fields.append((self.flagName, message.request))
+      payload = message.args
+    elif isinstance(message, msgtypes.ErrorMessage):
+      msgType = self.typeError
+      fields.append((self.flagName, message.exceptionType))
+      payload = message.response
+    elif isinstance(message, msgtypes.ResponseMessage):
+      msgType = self.typeResponse
+      payload = message.response
+    else:
+      msgType = 0xff
+
+    flags = 0
+    if message.compressedPayload is not None:
+      flags |= self.flagCompressed
+      payload = message.compressedPayload
+    if message.acceptsCompression:
+      flags |= self.flagAcceptsCompression
+    if message.acceptsEnvelopes:
+      flags |= self.flagAcceptsEnvelopes
+    chunks = [None]
+    for flag, value in fields:
+      flags |= flag
+      chunks.append(self.fieldLength.pack(len(value)))
+      chunks.append(value)
+    chunks[0] = self.header.pack(self.version, msgType, flags, message.id,
+        message.nodeID, util.int2bin(long(message.cryptoChallengeX)),
+        message.keyFingerprint or '')
+    return (''.join(chunks), payload)
+
+  def _dumpPayload(self, payload):
+    return self._payloadEncoding.encode(payload)
+
+  def _loadPayload(self, data):
+    return self._payloadEncoding.decode(data)
@@ -11,8 +11,31 @@ class Message(object):
         self.rsaKey = rsaKey
         self.cryptoChallengeX = cryptoChallengeX
         self.signedValue = signedValue
+        # Set instead of signedValue once a session key is established
+        self.mac = None
+        # A new session key, encrypted for the receiver (handshake only)
+        self.sessionKey = None
+        # Identifies rsaKey, see util.keyFingerprint
+        self.keyFingerprint = None
+        # Whether the full rsaKey goes on the wire, or just its fingerprint
+        self.includeKey = True
+        # The received bytes the signature or MAC covers, if it doesn't
+        # cover stringToSign()
+        self.signedBytes = None
+        # Whether the sender accepts compressed payloads
+        self.acceptsCompression = False
+        # Whether the payload may be compressed (outgoing messages only)
+        self.compress = False
+        # The payload as compressed on the wire, if it is; the signature or
+        # MAC covers it instead of the payload. Incoming payloads are only
+        # inflated once the sender is authenticated.
+        self.compressedPayload = None
+        # Whether the sender accepts several messages in one datagram
+        self.acceptsEnvelopes = False
 
     def stringToSign(self):
+        if self.sessionKey is not None:
+            return "%s%s" % (self.id, self.sessionKey)
         return "%s" % (self.id)
 
 class RequestMessage(Message):
@@ -20,13 +43,16 @@ class RequestMessage(Message):
     def __init__(self, nodeID, method, methodArgs, rsaKey, 
         cryptoChallengeX, rpcID=None, signedValue = None):
         if rpcID == None:
-            rpcID = util.generateRandomString(160)
+            rpcID = util.generateRandomString(20)
         Message.__init__(self, rpcID, nodeID, rsaKey, cryptoChallengeX, 
                 signedValue)
         self.request = method
         self.args = methodArgs
 
     def stringToSign(self):
+        if self.compressedPayload is not None:
+            return "%s%s%s" % (self.request, self.compressedPayload,
+                    Message.stringToSign(self))
         #Args have some problems with encoding
         return "%s%s%s" % (self.request, 
                 self.args, ###TODO: fix error with args encoding
@@ -41,6 +67,8 @@ class ResponseMessage(Message):
         self.response = response
 
     def stringToSign(self):
+        if self.compressedPayload is not None:
+            return "%s%s" % (self.compressedPayload, Message.stringToSign(self))
         #Response does also have problems with the encoding
         return "%s%s" % (str(self.response), Message.stringToSign(self))
 
@@ -3,14 +3,20 @@
 
 
 import entangled
+import entangled.kademlia.admission
 import entangled.kademlia.constants
 import entangled.kademlia.contact
+import entangled.kademlia.encoding
 import entangled.kademlia.protocol
 import twisted.internet.reactor
 import twisted.internet.threads
 import twisted.internet.defer
 
+import binaryencoding
+import keycache
+import msgformat
 import protocol
+import puzzle
 import util
 
 import binascii
@@ -31,14 +37,35 @@ class TintangledNode(entangled.EntangledNode):
 
   def __init__(
       self, id = None, udpPort = 4000, dataStore = None, routingTable = None, 
-      vanillaEntangled = False):
-    """ Initializes a TintangledNode."""
-    self.keyCache = {}
+      vanillaEntangled = False, puzzleSolver = None,
+      useSessions = constants.USE_SESSIONS,
+      binaryMessages = constants.BINARY_MESSAGES,
+      verificationPipeline = None,
+      bindKeyToID = constants.BIND_KEY_TO_ID):
+    """ Initializes a TintangledNode.
+
+    Nodes run in one process may share a verificationPipeline; by default
+    every node gets one of its own. Nodes whose IDs are not their keys'
+    fingerprints only work with bindKeyToID off, see constants.BIND_KEY_TO_ID.
+    """
+    self.keyCache = keycache.KeyCache()
     self.rsaKey = None
+    if puzzleSolver is None:
+      puzzleSolver = puzzle.PuzzleSolver()
+    self.puzzleSolver = puzzleSolver
     if vanillaEntangled:
       networkProtocol = entangled.kademlia.protocol.KademliaProtocol(self)
     else:
-      networkProtocol = protocol.TintangledProtocol(self)
+      if binaryMessages:
+        msgEncoder = binaryencoding.BinaryEncoding()
+        msgTranslator = msgformat.TintangledBinaryFormat(self.keyCache)
+      else:
+        msgEncoder = entangled.kademlia.encoding.Bencode()
+        msgTranslator = msgformat.TintangledDefaultFormat(self.keyCache)
+      networkProtocol = protocol.TintangledProtocol(
+          self, msgEncoder, msgTranslator, useSessions = useSessions,
+          verificationPipeline = verificationPipeline,
+          bindKeyToID = bindKeyToID)
     if id == None:
       print('Generating a crypto ID...')
       id = self._generateRandomID()
@@ -49,7 +76,8 @@ class TintangledNode(entangled.EntangledNode):
         # It doesn't seem to store in the network - only locally at the orig node
         networkProtocol = networkProtocol)
 
-  def _iterativeFind(self, key, startupShortlist=None, rpc='findNode'):
+  def _iterativeFind(self, key, startupShortlist=None, rpc='findNode',
+      priority=entangled.kademlia.admission.priorityLookup):
     """ The basic Kademlia iterative lookup operation (for nodes/values)
 
     This builds a list of k "closest" contacts through iterative use of
@@ -70,6 +98,9 @@ class TintangledNode(entangled.EntangledNode):
           other operations that piggy-back on the basic Kademlia
           lookup operation (Entangled's "delete" RPC, for instance).
     @type rpc: str
+    @param priority: The priority of the RPCs issued (see
+          L{entangled.kademlia.admission})
+    @type priority: int
 
     @return: If C{findValue} is C{True}, the algorithm will stop as soon
          as a data value for C{key} is found, and return a dictionary
@@ -157,14 +188,16 @@ class TintangledNode(entangled.EntangledNode):
         #This node can't provide us with better results then return
         if result is not None:
           for contactTriple in result:
-            if isinstance(contactTriple, (list, tuple)) and len(contactTriple) == 3:
-              testContact = entangled.kademlia.contact.Contact(
-                  contactTriple[0],
-                  contactTriple[1],
-                  contactTriple[2],
-                  self._protocol)
-              if testContact not in alreadyContacted:
-                contactsGateheredFromNode.append(testContact)
+            # Only build contacts for nodes we haven't asked yet
+            if (isinstance(contactTriple, (list, tuple)) and
+                len(contactTriple) == 3 and
+                contactTriple[0] not in alreadyContacted):
+              contactsGateheredFromNode.append(
+                  entangled.kademlia.contact.Contact(
+                      contactTriple[0],
+                      contactTriple[1],
+                      contactTriple[2],
+                      self._protocol))
           if len(contactsGateheredFromNode):
             contactsGateheredFromNode.sort(
                 lambda firstContact, secondContact, targetKey=key:
@@ -192,7 +225,7 @@ class TintangledNode(entangled.EntangledNode):
         # Schedule the next iteration if there are any active calls
         #  (Kademlia uses loose parallelism)
         twisted.internet.reactor.callLater(
-            entangled.kademlia.constants.iterativeLookupDelay,
+            self._protocol.probeDelay(activeProbes),
             checkIfWeAreDone) #IGNORE:E1101
       # Check for a quick contact response that made an update to the shortList
       elif key in findValueResult:
@@ -208,7 +241,7 @@ class TintangledNode(entangled.EntangledNode):
       if nodeToContact.id not in alreadyContacted:
         activeProbes.append(nodeToContact.id)
         rpcMethod = getattr(nodeToContact, rpc)
-        df = rpcMethod(key, rawResponse=True)
+        df = rpcMethod(key, rawResponse=True, priority=priority)
         df.addCallback(nodeResponds)
         df.addErrback(nodeFailedToRespond, candidateNodesToContact)
         df.addCallback(cancelActiveProbe, nodeToContact)
@@ -243,34 +276,24 @@ class TintangledNode(entangled.EntangledNode):
       c2 = constants.CRYPTO_CHALLENGE_C2):
     """Generates the NodeID by solving two cryptographic puzzles."""
     # Solve the static cryptographic puzzle.
-    rsaKey = None
-    p = 0x1 # non-zero value
-    pub = None
-
-    randomStream = Crypto.Random.new().read
-    while not util.hasNZeroBitPrefix(p, c1):
-      rsaKey = Crypto.PublicKey.RSA.generate(constants.RSA_BITS, randomStream)
-      pub = str(rsaKey.n) + str(rsaKey.e)
-      p = util.hsh2int(Crypto.Hash.SHA.new(Crypto.Hash.SHA.new(pub).digest()))
-
+    rsaKey, nodeID = self.puzzleSolver.solveStatic(c1)
+    self._printPuzzleStats('static')
     # created correct NodeID
     self.rsaKey = rsaKey
-    nodeID = Crypto.Hash.SHA.new(pub)
 
     # Solve the dynamic cryptographic puzzle.
-    p, x = 0x1, None
-
-    while not util.hasNZeroBitPrefix(p, c2):
-      x = util.bin2int(util.generateRandomString(constants.ID_LENGTH))
-      # This is madness!
-      p = util.hsh2int(
-          Crypto.Hash.SHA.new(
-              util.int2bin(
-                  (util.hsh2int(nodeID) ^ x))))
-
-    # Found a correct value of X and nodeID
-    self.x = x
-    return nodeID.digest()
+    self.x = self.puzzleSolver.solveDynamic(nodeID, c2)
+    self._printPuzzleStats('dynamic')
+    return nodeID
+
+  def _printPuzzleStats(self, puzzleName):
+    stats = self.puzzleSolver.lastStats
+    print('Solved %s puzzle: %d attempts in %.2fs (%.1f/s, %d workers)' % (
+        puzzleName,
+        stats['attempts'],
+        stats['seconds'],
+        stats['attemptsPerSecond'],
+        stats['workers']))
 
   def getNameID(self, name):
     '''Calculate and return 160-bit ID for a given name.'''
@@ -290,6 +313,14 @@ class TintangledNode(entangled.EntangledNode):
     hashValue = Crypto.Hash.SHA.new(message).digest()
     return rsaKey.verify(hashValue, signature)
 
+  @rpcmethod
+  def getPublicKey(self, **kwargs):
+    '''Returns this node's (exported) public key, for nodes that only got its
+    fingerprint.'''
+    if '_rpcNodeID' in kwargs:
+      self._protocol.keyRequested(kwargs['_rpcNodeID'])
+    return self.rsaKey.publickey().exportKey()
+
   # -*- Logging Decorators -*-
 
   def addContact(self, contact):
@@ -297,8 +328,6 @@ class TintangledNode(entangled.EntangledNode):
 #        binascii.hexlify(self.id),
 #        binascii.hexlify(contact.id)))
 #    print('addContact : %s adds: %s' % (self.port, contact.port))
-    if contact.rsaKey is not None:
-      self.keyCache[contact.id] = contact.rsaKey
     entangled.EntangledNode.addContact(self, contact)
 
 #  def publishData(self, name, data):
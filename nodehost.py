@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Runs many Tinfoil nodes in one process, on real UDP sockets.
+
+Unlike create_network.py, which starts one process per node, all nodes share
+this process' reactor, one verification pipeline and - unless a keystore is
+given - one RSA key (see identitypool.py), so a single core can carry
+hundreds of them for load and soak tests. Each node has a port of its own.
+
+Nodes can be added and removed while running, through a NodeHost or through
+the control port, which takes one command per line (e.g. with netcat):
+
+  add [COUNT]          starts COUNT (default 1) more nodes
+  remove PORT [...]    stops the nodes on the given ports
+  list                 lists the nodes' ports and IDs
+  stats                shows the node count and message totals
+  shutdown             stops all nodes and exits
+"""
+
+import twisted.internet.error
+import twisted.internet.protocol
+import twisted.internet.reactor
+import twisted.protocols.basic
+
+from node import TintangledNode
+import constants
+import identitypool
+import tinfoil
+import verifier
+
+import sys
+
+
+class NodeHost(object):
+  '''Starts and stops nodes on the reactor of this process.
+
+  Nodes join through knownNodes if given, and otherwise through the first
+  node of the host still running. With clients, each node is wrapped in a
+  tinfoil.Client (which also publishes its public key on joining).
+  '''
+
+  def __init__(
+      self, startPort = 4000, knownNodes = None, clients = False,
+      vanillaEntangled = False, identities = None,
+      verifyThreads = constants.VERIFY_THREADS, interface = '127.0.0.1'):
+    self.startPort = startPort
+    self.knownNodes = knownNodes
+    self.clients = clients
+    self.vanillaEntangled = vanillaEntangled
+    if identities is None:
+      identities = identitypool.SharedIdentities()
+    self.identities = identities
+    self.interface = interface
+    self.verifier = verifier.VerificationPipeline(threads = verifyThreads)
+    # port -> TintangledNode, or tinfoil.Client with clients
+    self.nodes = {}
+    self._nextPort = startPort
+    self.added = 0
+    self.removed = 0
+
+  def addNode(self, port = None):
+    """Starts a node and has it join the network.
+
+    Without a port, the next free one from startPort on is used.
+
+    @return: the node's port
+    """
+    identity = self.identities.next()
+    while True:
+      if port is None:
+        tryPort = self._nextPort
+        while tryPort in self.nodes:
+          tryPort += 1
+        self._nextPort = tryPort + 1
+      else:
+        tryPort = port
+      try:
+        self.nodes[tryPort] = self._start(tryPort, identity)
+      except twisted.internet.error.CannotListenError:
+        if port is not None:
+          raise
+        continue
+      self.added += 1
+      return tryPort
+
+  def removeNode(self, port):
+    """Stops the node on the given port."""
+    if port not in self.nodes:
+      raise KeyError('No node on port %d' % port)
+    node = self._node(self.nodes.pop(port))
+    node.leaveNetwork()
+    self.removed += 1
+
+  def node(self, port):
+    """Returns the TintangledNode on the given port."""
+    return self._node(self.nodes[port])
+
+  def stop(self):
+    for port in sorted(self.nodes):
+      self.removeNode(port)
+    self.verifier.stop()
+
+  def stats(self):
+    """Returns the node count, and the datagrams sent, RPCs in flight and
+    waiting to be sent, and coalesced lookups over all nodes."""
+    sent = 0
+    inFlight = 0
+    queued = 0
+    coalesced = 0
+    for entry in self.nodes.values():
+      node = self._node(entry)
+      sent += node._protocol._scheduler.sent
+      inFlight += len(node._protocol._sentMessages)
+      queued += node._protocol._limiter.queued
+      coalesced += node.coalescedLookups
+    return {
+      'nodes': len(self.nodes),
+      'added': self.added,
+      'removed': self.removed,
+      'datagramsSent': sent,
+      'rpcsInFlight': inFlight,
+      'rpcsQueued': queued,
+      'coalescedLookups': coalesced,
+      'verifier': self.verifier.stats(),
+    }
+
+  def _start(self, port, identity):
+    knownNodes = self.knownNodes
+    if knownNodes is None and self.nodes:
+      knownNodes = [(self.interface, min(self.nodes))]
+    if self.clients:
+      client = tinfoil.Client(
+          udpPort = port, vanillaEntangled = self.vanillaEntangled,
+          identity = identity, verificationPipeline = self.verifier,
+          bindKeyToID = not self.identities.sharedKey)
+      client.join(knownNodes, runReactor = False)
+      return client
+    nodeID, rsaKey, x = identity
+    node = TintangledNode(
+        id = nodeID, udpPort = port, vanillaEntangled = self.vanillaEntangled,
+        verificationPipeline = self.verifier,
+        bindKeyToID = not self.identities.sharedKey)
+    node.rsaKey = rsaKey
+    node.x = x
+    node.keyCache[node.id] = rsaKey
+    node.joinNetwork(knownNodes)
+    return node
+
+  def _node(self, entry):
+    if isinstance(entry, tinfoil.Client):
+      return entry.node
+    return entry
+
+
+class ControlProtocol(twisted.protocols.basic.LineReceiver):
+  '''Line-based control connection to a NodeHost; see the module docstring.'''
+  delimiter = '\n'
+
+  def lineReceived(self, line):
+    words = line.strip().split()
+    if not words:
+      return
+    handler = getattr(self, 'do_%s' % words[0], None)
+    if handler is None:
+      self.sendLine('error unknown command %s' % words[0])
+      return
+    try:
+      self.sendLine('ok %s' % handler(*words[1:]))
+    except Exception, e:
+      self.sendLine('error %s' % ' '.join(map(str, e.args)))
+
+  def do_add(self, count = '1'):
+    return ' '.join(
+        [str(self.factory.host.addNode()) for i in range(int(count))])
+
+  def do_remove(self, *ports):
+    for port in ports:
+      self.factory.host.removeNode(int(port))
+    return ' '.join(ports)
+
+  def do_list(self):
+    host = self.factory.host
+    return ' '.join(['%d:%s' % (port, host.node(port).id.encode('hex'))
+        for port in sorted(host.nodes)])
+
+  def do_stats(self):
+    stats = self.factory.host.stats()
+    return ('nodes=%(nodes)d added=%(added)d removed=%(removed)d '
+        'datagramsSent=%(datagramsSent)d rpcsInFlight=%(rpcsInFlight)d '
+        'rpcsQueued=%(rpcsQueued)d coalescedLookups=%(coalescedLookups)d' % stats +
+        ' verifyPending=%(pending)d verifyDropped=%(dropped)d' % stats['verifier'])
+
+  def do_shutdown(self):
+    twisted.internet.reactor.callLater(0, twisted.internet.reactor.stop)
+    return 'shutting down'
+
+
+class ControlFactory(twisted.internet.protocol.ServerFactory):
+  protocol = ControlProtocol
+
+  def __init__(self, host):
+    self.host = host
+
+
+class _NullWriter(object):
+  def write(self, data):
+    pass
+
+  def flush(self):
+    pass
+
+
+def _option(name, default, convert = int):
+  for arg in sys.argv[1:]:
+    if arg.startswith('--%s=' % name):
+      return convert(arg[len(name) + 3:])
+  return default
+
+if __name__ == '__main__':
+  args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+  if not args:
+    print('Usage:\n%s AMOUNT_OF_NODES [KNOWN_NODE_IP KNOWN_NODE_PORT] '
+        '[--start-port=PORT] [--control-port=PORT] [--add-interval=SECONDS] '
+        '[--clients] [--vanilla] [--keystore=FILE] [--rsa-bits=BITS] '
+        '[--verbose]' % sys.argv[0])
+    print('\nWithout a known node, the nodes join through the first of them.')
+    sys.exit(1)
+  amount = int(args[0])
+  knownNodes = [(args[1], int(args[2]))] if len(args) >= 3 else None
+  startPort = _option('start-port', 4000)
+  controlPort = _option('control-port', startPort - 1)
+  addInterval = _option('add-interval', 0.05, float)
+  identities = identitypool.SharedIdentities(
+      rsaBits = _option('rsa-bits', constants.RSA_BITS),
+      keystorePath = _option('keystore', None, str))
+  host = NodeHost(
+      startPort, knownNodes, clients = '--clients' in sys.argv,
+      vanillaEntangled = '--vanilla' in sys.argv, identities = identities)
+  reactor = twisted.internet.reactor
+  reactor.listenTCP(controlPort, ControlFactory(host), interface = '127.0.0.1')
+
+  output = sys.stdout
+  if '--verbose' not in sys.argv:
+    # Nodes print on every message they handle.
+    sys.stdout = _NullWriter()
+
+  def addNodes(remaining):
+    host.addNode()
+    if remaining > 1:
+      reactor.callLater(addInterval, addNodes, remaining - 1)
+    else:
+      output.write('%d nodes running on ports %d-%d; control port %d\n' % (
+          len(host.nodes), min(host.nodes), max(host.nodes), controlPort))
+      output.flush()
+
+  if amount:
+    reactor.callWhenRunning(addNodes, amount)
+  reactor.addSystemEventTrigger('before', 'shutdown', host.stop)
+  reactor.run()
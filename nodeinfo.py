@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Packed node info: contact triples as fixed-size binary records.
+
+A contact triple (node ID, address, port) packs into the 20-byte ID, the
+4-byte IPv4 or 16-byte IPv6 address and a 2-byte port - 26, resp. 38 bytes.
+Lists of triples of one address family are packed and unpacked in bulk.
+"""
+
+import socket
+import struct
+
+(
+  IPV4,
+  IPV6
+) = (socket.AF_INET, socket.AF_INET6)
+
+_recordFormat = {IPV4: '20s4sH', IPV6: '20s16sH'}
+recordSize = {
+  IPV4: struct.calcsize('!' + _recordFormat[IPV4]),
+  IPV6: struct.calcsize('!' + _recordFormat[IPV6]),
+}
+
+
+def packedAddress(address):
+  """Returns the family and packed form of an address, if it is an IPv4 or
+  IPv6 address in its canonical notation; otherwise (None, None)."""
+  if type(address) != str:
+    return None, None
+  family = IPV6 if ':' in address else IPV4
+  try:
+    packed = socket.inet_pton(family, address)
+  except (socket.error, ValueError):
+    return None, None
+  if socket.inet_ntop(family, packed) != address:
+    return None, None
+  return family, packed
+
+def tripleFamily(triple):
+  """Returns the address family a triple packs with, or None if it isn't a
+  packable contact triple."""
+  if (len(triple) == 3 and
+      type(triple[0]) == str and len(triple[0]) == 20 and
+      type(triple[2]) in (int, long) and 0 <= triple[2] <= 0xffff):
+    return packedAddress(triple[1])[0]
+  return None
+
+def listFamily(triples):
+  """Returns the address family all triples pack with, or None."""
+  if not triples:
+    return None
+  first = tripleFamily(triples[0]) if type(triples[0]) == tuple else None
+  if first is None:
+    return None
+  for triple in triples:
+    if type(triple) != tuple or tripleFamily(triple) != first:
+      return None
+  return first
+
+def pack(triples, family):
+  """Packs a list of triples of the given address family."""
+  values = []
+  for nodeID, address, port in triples:
+    values.append(nodeID)
+    values.append(socket.inet_pton(family, address))
+    values.append(port)
+  return struct.pack('!' + _recordFormat[family] * len(triples), *values)
+
+def unpack(data, family, count, offset = 0):
+  """Unpacks count triples of the given address family at offset.
+
+  @raise ValueError: if count is negative, or data ends before the last
+      triple does.
+  """
+  if count < 0 or offset < 0:
+    raise ValueError('Negative count or offset')
+  if offset + count * recordSize[family] > len(data):
+    raise ValueError('Truncated node info')
+  values = struct.unpack_from(
+      '!' + _recordFormat[family] * count, data, offset)
+  if family == IPV4:
+    toAddress = socket.inet_ntoa
+  else:
+    toAddress = lambda packed: socket.inet_ntop(IPV6, packed)
+  return [(values[i], toAddress(values[i + 1]), values[i + 2])
+      for i in xrange(0, len(values), 3)]
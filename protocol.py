@@ -9,9 +9,17 @@ import twisted.internet.reactor
 import util, time
 import constants
 
+import collections
+
 from entangled.kademlia import encoding
+from entangled.kademlia import lru
+from entangled.kademlia import rtt
+from entangled.kademlia import scheduler
+import idcache
 import msgtypes
 import msgformat
+import session
+import verifier
 from entangled.kademlia.contact import Contact
 import Crypto.Hash.SHA
 
@@ -19,11 +27,50 @@ reactor = twisted.internet.reactor
 
 class TintangledProtocol(KademliaProtocol):
   def __init__(self, node, msgEncoder = encoding.Bencode(), 
-    msgTranslator = msgformat.TintangledDefaultFormat()):
+    msgTranslator = msgformat.TintangledDefaultFormat(),
+    useSessions = constants.USE_SESSIONS, verificationPipeline = None,
+    canonicalSigning = constants.CANONICAL_SIGNING,
+    compression = constants.COMPRESSION,
+    bindKeyToID = constants.BIND_KEY_TO_ID):
         KademliaProtocol.__init__(self,node, msgEncoder, msgTranslator)
+        self._rtt = rtt.RTTEstimator(
+            initialTimeout = constants.rpcTimeout,
+            maxTimeout = constants.rpcTimeout)
+        # Whether to accept (and send) compressed payloads
+        self._compression = compression
+        # IDs of nodes that said they accept compressed payloads
+        self._compressionPeers = lru.LRUSet(constants.COMPRESSION_PEERS_SIZE)
+        # Sign the encoded message instead of msg.stringToSign()
+        self._canonicalSigning = canonicalSigning
+        # None falls back to RSA-signing every single message
+        self._sessions = session.SessionTable() if useSessions else None
+        if verificationPipeline is None:
+          verificationPipeline = verifier.VerificationPipeline()
+        self._verifier = verificationPipeline
+        # IDs of nodes known to hold our public key; they only get its
+        # fingerprint
+        self._keyHolders = lru.LRUSet(constants.KEY_HOLDERS_SIZE)
+        # fingerprint -> messages waiting for that key to be fetched
+        self._awaitingKey = {}
+        self._fingerprint = None
+        self._verifiedIDs = idcache.VerifiedIDCache()
+        # Whether a node's ID must be its key's fingerprint. If not, the
+        # fingerprints last seen from each node are kept here instead.
+        self._bindKeyToID = bindKeyToID
+        self._peerFingerprints = collections.OrderedDict()
 
   def _verifyID(self, nodeID, x):
-    '''Verifies if a user's ID has been generated using the '''
+    '''Verifies if a user's ID has been generated using the crypto puzzles.
+
+    A (nodeID, x) pair never changes its verdict, so results are cached.
+    '''
+    valid = self._verifiedIDs.lookup(nodeID, x)
+    if valid is None:
+      valid = self._solvesPuzzles(nodeID, x)
+      self._verifiedIDs.record(nodeID, x, valid)
+    return valid
+
+  def _solvesPuzzles(self, nodeID, x):
     p1 = util.hsh2int(Crypto.Hash.SHA.new(nodeID))
     p2 = util.hsh2int(Crypto.Hash.SHA.new(
         util.int2bin((util.bin2int(nodeID) ^ x))))
@@ -31,71 +78,157 @@ class TintangledProtocol(KademliaProtocol):
     return (
         util.hasNZeroBitPrefix(p1, constants.CRYPTO_CHALLENGE_C1) and
         util.hasNZeroBitPrefix(p2, constants.CRYPTO_CHALLENGE_C2))
-   
+
+  def _authenticate(self, msg, contact):
+    '''Prepares the authentication of an outgoing message to the specified
+    contact.
+
+    Picks the session key shared with the contact if there is one. Otherwise
+    the message is to be signed with our RSA key - offering a new session key
+    along with it, if this is a request and we know the contact's public key.
+
+    @return: the session key to MAC the message with, or None to sign it
+    '''
+    msg.keyFingerprint = self._ownKeyFingerprint()
+    msg.includeKey = contact.id not in self._keyHolders
+    if self._sessions is not None:
+      key = self._sessions.sendingKey(contact.id)
+      if key is not None:
+        return key
+      peerKey = self._node.keyCache.get(self._peerFingerprint(contact.id))
+      if isinstance(msg, msgtypes.RequestMessage) and peerKey is not None:
+        key = self._sessions.offer(contact.id)
+        if key is not None:
+          msg.sessionKey = session.encryptKey(peerKey, key, msg.keyFingerprint)
+    return None
+
+  def _sign(self, msg, contact, macKey, data):
+    if macKey is not None:
+      msg.mac = session.sign(
+          macKey, self._node.id, contact.id, self._direction(msg), data)
+    else:
+      msg.signedValue = self._node._signMessage(data)
+
+  def _encodeMessage(self, msg, contact):
+    '''Authenticates a message to the specified contact and encodes it.
+
+    With canonical signing the encoded message itself is signed, and sent
+    wrapped in an envelope along with the signature: [body, signature, MAC].
+    '''
+    msg.acceptsCompression = self._compression
+    msg.compress = self._compression and contact.id in self._compressionPeers
+    msg.acceptsEnvelopes = True
+    macKey = self._authenticate(msg, contact)
+    # The signature covers the payload as it goes on the wire
+    self._translator.compress(msg)
+    if not self._canonicalSigning:
+      self._sign(msg, contact, macKey, msg.stringToSign())
+      return self._encoder.encode(self._translator.toPrimitive(msg))
+    body = self._encoder.encode(self._translator.toPrimitive(msg))
+    self._sign(msg, contact, macKey, body)
+    return self._encoder.encode([body, msg.signedValue, msg.mac])
+
+  def _direction(self, message):
+    if isinstance(message, msgtypes.ResponseMessage):
+      return session.directionResponse
+    return session.directionRequest
+
+  def _signedData(self, message):
+    '''Returns what the sender of an incoming message signed.'''
+    if message.signedBytes is not None:
+      return message.signedBytes
+    return message.stringToSign()
+
+  def _ownKeyFingerprint(self):
+    rsaKey = self._node.rsaKey
+    if self._fingerprint is None or self._fingerprint[0] is not rsaKey:
+      self._fingerprint = (rsaKey, util.keyFingerprint(rsaKey))
+    return self._fingerprint[1]
+
+  def _peerFingerprint(self, nodeID):
+    '''Returns the fingerprint of the key nodeID signs with, if known.'''
+    if self._bindKeyToID:
+      return nodeID
+    fingerprint = self._peerFingerprints.pop(nodeID, None)
+    if fingerprint is not None:
+      self._peerFingerprints[nodeID] = fingerprint
+    return fingerprint
+
+  def _notePeerFingerprint(self, nodeID, fingerprint):
+    if self._bindKeyToID:
+      return
+    self._peerFingerprints.pop(nodeID, None)
+    self._peerFingerprints[nodeID] = fingerprint
+    while len(self._peerFingerprints) > constants.KEY_CACHE_SIZE:
+      self._peerFingerprints.popitem(last = False)
+
+  def keyRequested(self, nodeID):
+    '''Called when nodeID asked for our public key: it evidently doesn't hold
+    it, so send the full key to it again.'''
+    self._keyHolders.discard(nodeID)
+
+  def _verifyCredentials(self, message):
+    '''Checks the crypto ID and RSA signature of an incoming message.
+
+    Runs on a verification worker, so it must not touch protocol state.
+    MACs are checked afterwards on the reactor, see _verifyMAC.
+
+    @return: (valid, session key offered by the sender or None)
+    '''
+    if not self._verifyID(message.nodeID, message.cryptoChallengeX):
+      print 'Id not verified - rejects RPC'
+      return False, None
+    if self._bindKeyToID and message.keyFingerprint != message.nodeID:
+      print 'Key does not belong to the node ID - rejects RPC'
+      return False, None
+    if (message.includeKey and
+        util.keyFingerprint(message.rsaKey) != message.keyFingerprint):
+      print 'Key does not match its fingerprint - rejects RPC'
+      return False, None
+    if message.mac is not None:
+      return True, None
+    if not self._node._verifyMessage(
+        self._signedData(message), message.signedValue, message.rsaKey):
+      print '##### - - - - - Did not verify message - rejects RPC: %s' % message
+      return False, None
+    if message.sessionKey is not None and self._sessions is not None:
+      return True, session.decryptKey(
+          self._node.rsaKey, message.sessionKey, message.keyFingerprint)
+    return True, None
+
   def _sendResponse(self, contact, rpcID, response):
     """ Send a RPC response to the specified contact"""
     msg = msgtypes.ResponseMessage(rpcID, self._node.id,
       self._node.rsaKey.publickey(), self._node.x, response)
-    msg.signedValue = self._node._signMessage(msg.stringToSign())
-    msgPrimitive = self._translator.toPrimitive(msg)
-    encodedMsg = self._encoder.encode(msgPrimitive)
-    self._send(encodedMsg, rpcID, (contact.address, contact.port))
+    encodedMsg = self._encodeMessage(msg, contact)
+    self._send(encodedMsg, rpcID, (contact.address, contact.port),
+        scheduler.priorityResponse)
 
   def _sendError(self, contact, rpcID, exceptionType, exceptionMessage):
     """ Send an RPC error message to the specified contact"""
     msg = msgtypes.ErrorMessage(rpcID, self._node.id,self._node.rsaKey.publickey(), 
       self._node.x, exceptionType, exceptionMessage)
-    msg.signedValue = self._node._signMessage(msg.stringToSign())
-    msgPrimitive = self._translator.toPrimitive(msg)
-    encodedMsg = self._encoder.encode(msgPrimitive)
-    self._send(encodedMsg, rpcID, (contact.address, contact.port))
+    encodedMsg = self._encodeMessage(msg, contact)
+    self._send(encodedMsg, rpcID, (contact.address, contact.port),
+        scheduler.priorityResponse)
   
-  def sendRPC(self, contact, method, args, rawResponse=False):
-    """ Sends an RPC to the specified contact
-
-    @param contact: The contact (remote node) to send the RPC to
-    @type contact: kademlia.contacts.Contact
-    @param method: The name of remote method to invoke
-    @type method: str
-    @param args: A list of (non-keyword) arguments to pass to the remote 
-      method, in the correct order
-    @type args: tuple
-    @param rawResponse: If this is set to C{True}, the caller of this RPC
-                            will receive a tuple containing the actual response
-                            message object and the originating address tuple as
-                            a result; in other words, it will not be
-                            interpreted by this class. Unless something special
-                            needs to be done with the metadata associated with
-                            the message, this should remain C{False}.
-    @type rawResponse: bool
-
-    @return: This immediately returns a deferred object, which will return
-                 the result of the RPC call, or raise the relevant exception
-                 if the remote node raised one. If C{rawResponse} is set to
-                 C{True}, however, it will always return the actual response
-                 message (which may be a C{ResponseMessage} or an
-                 C{ErrorMessage}).
-    @rtype: twisted.internet.defer.Deferred
-        """
+  def _sendRPC(self, contact, method, args, df):
+    """ Signs and transmits an RPC once the limiter admitted it
+
+    @param df: The deferred returned by L{sendRPC}
+    @type df: twisted.internet.defer.Deferred
+    """
     msg = msgtypes.RequestMessage(nodeID = self._node.id, method = method,
         methodArgs = args, rsaKey = self._node.rsaKey.publickey(), 
         cryptoChallengeX = self._node.x)
-    msg.signedValue = self._node._signMessage(msg.stringToSign())
-
-    msgPrimitive = self._translator.toPrimitive(msg)
-    encodedMsg = self._encoder.encode(msgPrimitive)
-
-    df = defer.Deferred()
-    if rawResponse:
-      df._rpcRawResponse = True
+    encodedMsg = self._encodeMessage(msg, contact)
 
     # Set the RPC timeout timer
-    timeoutCall = reactor.callLater(constants.rpcTimeout, 
-      self._msgTimeout, msg.id) #IGNORE:E1101
+    timeoutCall = self._timers.callLater(self._rtt.timeout(contact.id),
+      self._msgTimeout, msg.id)
     # Transmit the data
     self._send(encodedMsg, msg.id, (contact.address, contact.port))
-    self._sentMessages[msg.id] = (contact.id, df, timeoutCall)
-    return df
+    self._sentMessages[msg.id] = (contact.id, df, timeoutCall, reactor.seconds())
 
   def datagramReceived(self, datagram, address):
     """ Handles and parses incoming RPC messages (and responses)
@@ -103,40 +236,125 @@ class TintangledProtocol(KademliaProtocol):
     @note: This is automatically called by Twisted when the protocol
      receives a UDP datagram
     """
-    if datagram[0] == '\x00' and datagram[25] == '\x00':
-      totalPackets = (ord(datagram[1]) << 8) | ord(datagram[2])
-      msgID = datagram[5:25]
-      seqNumber = (ord(datagram[3]) << 8) | ord(datagram[4])
-      if msgID not in self._partialMessages:
-        self._partialMessages[msgID] = {}
-      self._partialMessages[msgID][seqNumber] = datagram[26:]
-      if len(self._partialMessages[msgID]) == totalPackets:
-        keys = self._partialMessages[msgID].keys()
-        keys.sort()
-        data = ''
-        for key in keys:
-          data += self._partialMessages[msgID][key]
-          datagram = data
-        del self._partialMessages[msgID]
-      else:
-        return
+    datagram = self._reassemble(datagram, address)
+    if datagram is None:
+      return
+    signedBytes = None
     try:
       msgPrimitive = self._encoder.decode(datagram)
-    except encoding.DecodeError:
+      if type(msgPrimitive) == list:
+        # Canonically signed message: [body, signature, MAC]
+        signedBytes, signedValue, mac = msgPrimitive
+        msgPrimitive = self._encoder.decode(signedBytes)
+      message = self._translator.fromPrimitive(msgPrimitive)
+    except (encoding.DecodeError, ValueError):
       # We received some rubbish here
       return
 
-    message = self._translator.fromPrimitive(msgPrimitive)
-    remoteContact = Contact(message.nodeID, address[0], address[1], self)
-    remoteContact.rsaKey = message.rsaKey
-    #print 'Receied RPC from: %s to: %s' % (remoteContact.port, self._node.port)
-    if not self._verifyID(remoteContact.id, message.cryptoChallengeX):
-      print 'Id not verified - rejects RPC'
+    if signedBytes is not None:
+      message.signedBytes = signedBytes
+      message.signedValue = signedValue
+      message.mac = mac
+    if self._verifiedIDs.rejected(message.nodeID, message.cryptoChallengeX):
+      # Known bogus ID - not even worth a verification job
       return
+    if message.rsaKey is None and message.mac is None:
+      message.rsaKey = self._node.keyCache.get(message.keyFingerprint)
+      if message.rsaKey is None:
+        self._awaitPublicKey(message, address)
+        return
+    self._verify(message, address)
 
-    if not self._node._verifyMessage(message.stringToSign(), message.signedValue, message.rsaKey):
-      print '##### - - - - - Did not verify message - rejects RPC: %s' % message
+  def _verify(self, message, address):
+    """ Checks the credentials of an incoming message, on or off the
+    reactor thread """
+    if message.mac is not None and not self._verifier.busy(message.nodeID):
+      # Nothing from this sender is queued and MACs are cheap to check, so
+      # there is no need to leave the reactor thread.
+      verdict = self._verifier.verifyInline(self._verifyInline, (message,))
+      self._messageVerified(verdict, message, address)
+    elif not self._verifier.submit(
+        message.nodeID, self._verifyCredentials, (message,),
+        self._credentialsVerified, (message, address)):
+      print 'Verification queue full - drops RPC'
+
+  def _verifyInline(self, message):
+    return self._verifyMAC(self._verifyCredentials(message), message)
+
+  def _credentialsVerified(self, verdict, message, address):
+    """ Called on the reactor thread once a verification worker is done """
+    if verdict is not None:
+      verdict = self._verifyMAC(verdict, message)
+    self._messageVerified(verdict, message, address)
+
+  def _verifyMAC(self, verdict, message):
+    """ Checks the MAC of a message whose other credentials were found valid
+
+    Runs on the reactor thread, as a valid MAC may complete a session.
+
+    @return: the verdict on the whole message
+    """
+    valid, sessionKey = verdict
+    if valid and message.mac is not None:
+      valid = (
+          self._sessions is not None and
+          self._sessions.verify(
+              message.nodeID, self._node.id, self._direction(message),
+              self._signedData(message), message.mac))
+      if not valid:
+        print '##### - - - - - Did not verify MAC - rejects RPC: %s' % message
+    return valid, sessionKey
+
+  def _awaitPublicKey(self, message, address):
+    """ Parks a message from a sender whose key we don't know, and asks the
+    sender for it """
+    fingerprint = message.keyFingerprint
+    if fingerprint in self._awaitingKey:
+      if len(self._awaitingKey[fingerprint]) < constants.MAX_AWAITING_KEY:
+        self._awaitingKey[fingerprint].append((message, address))
+      return
+    self._awaitingKey[fingerprint] = [(message, address)]
+    sender = Contact(message.nodeID, address[0], address[1], self)
+    df = sender.getPublicKey()
+    df.addBoth(self._publicKeyFetched, fingerprint)
+
+  def _publicKeyFetched(self, result, fingerprint):
+    """ Verifies the messages that waited for a public key """
+    # The key itself was cached when the (full key) response was verified.
+    rsaKey = self._node.keyCache.get(fingerprint)
+    for message, address in self._awaitingKey.pop(fingerprint, []):
+      if rsaKey is not None:
+        message.rsaKey = rsaKey
+        self._verify(message, address)
+
+  def _messageVerified(self, verdict, message, address):
+    """ Handles an incoming message once its credentials were checked """
+    if verdict is None:
       return
+    valid, sessionKey = verdict
+    if not valid:
+      return
+    try:
+      # Not before now, so that only authenticated senders get us to inflate
+      # their payloads
+      self._translator.decompress(message)
+    except (encoding.DecodeError, ValueError):
+      return
+    if sessionKey is not None:
+      self._sessions.accept(self._node.id, message.nodeID, sessionKey)
+    if message.includeKey:
+      self._node.keyCache[message.keyFingerprint] = message.rsaKey
+    self._notePeerFingerprint(message.nodeID, message.keyFingerprint)
+    if message.acceptsCompression:
+      self._compressionPeers.add(message.nodeID)
+    else:
+      self._compressionPeers.discard(message.nodeID)
+    self._noteEnvelopes(message, address)
+    if isinstance(message, msgtypes.ResponseMessage):
+      # It verified our request, so it holds our key by now.
+      self._keyHolders.add(message.nodeID)
+    remoteContact = Contact(message.nodeID, address[0], address[1], self)
+    #print 'Receied RPC from: %s to: %s' % (remoteContact.port, self._node.port)
     # As written in s/kademlia the message is signed and actively valid, 
     #  if the sender address is valid and comes from a RPC response.
     # Actively valid sender addresses are immediately added to their 
@@ -156,9 +374,12 @@ class TintangledProtocol(KademliaProtocol):
 
       if self._sentMessages.has_key(message.id):
           # Cancel timeout timer for this RPC
-          df, timeoutCall = self._sentMessages[message.id][1:3]
+          remoteContactID, df, timeoutCall, sentAt = (
+              self._sentMessages[message.id])
           timeoutCall.cancel()
           del self._sentMessages[message.id]
+          self._rtt.sample(remoteContactID, reactor.seconds() - sentAt)
+          self._limiter.release(remoteContactID)
 
           if hasattr(df, '_rpcRawResponse'):
             # The RPC requested that the raw response message and 
@@ -191,4 +412,13 @@ class TintangledProtocol(KademliaProtocol):
       else:
         # If the original message isn't found, it must have timed out
         #TODO: we should probably do something with this...
-        pass
\ No newline at end of file
+        pass
+
+  def _msgTimeout(self, messageID):
+    """ Called when an RPC request message times out """
+    if (self._sessions is not None and
+        messageID in self._sentMessages and
+        messageID not in self._reassembler):
+      # The contact may have restarted and lost our session; renegotiate.
+      self._sessions.drop(self._sentMessages[messageID][0])
+    KademliaProtocol._msgTimeout(self, messageID)
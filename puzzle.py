@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Parallel solver for the S/Kademlia crypto puzzles used to mint node IDs."""
+
+import Crypto.Hash.SHA
+import Crypto.PublicKey.RSA
+import Crypto.Random
+
+import constants
+import util
+
+import functools
+import multiprocessing
+import random
+import sys
+import time
+
+
+def _randomSource(seed, attempt):
+  """Returns a randfunc(n) for the given attempt.
+
+  If seed is None the randfunc is a cryptographically secure stream, otherwise
+  it is a deterministic stream derived from (seed, attempt), so that a seeded
+  run always finds the same solution no matter how many workers are used.
+  """
+  if seed is None:
+    return Crypto.Random.new().read
+  rng = random.Random(util.hsh2int(
+      Crypto.Hash.SHA.new('%s:%d' % (seed, attempt))))
+  def _read(n):
+    return ('%0*x' % (2 * n, rng.getrandbits(8 * n))).decode('hex')
+  return _read
+
+def staticAttempt(randfunc, c1 = constants.CRYPTO_CHALLENGE_C1):
+  """One try at the static puzzle.
+
+  Returns the exported RSA key if H(H(pub)) has c1 zero bits, or None.
+  """
+  rsaKey = Crypto.PublicKey.RSA.generate(constants.RSA_BITS, randfunc)
+  pub = str(rsaKey.n) + str(rsaKey.e)
+  p = util.hsh2int(Crypto.Hash.SHA.new(Crypto.Hash.SHA.new(pub).digest()))
+  if util.hasNZeroBitPrefix(p, c1):
+    return rsaKey.exportKey()
+  return None
+
+def dynamicAttempt(randfunc, nodeID, c2 = constants.CRYPTO_CHALLENGE_C2):
+  """One try at the dynamic puzzle.
+
+  Returns X if H(nodeID ^ X) has c2 zero bits, or None.
+  """
+  x = util.bin2int(randfunc(constants.ID_LENGTH))
+  p = util.hsh2int(
+      Crypto.Hash.SHA.new(
+          util.int2bin(
+              (util.bin2int(nodeID) ^ x))))
+  if util.hasNZeroBitPrefix(p, c2):
+    return x
+  return None
+
+def _worker(attempt, seed, workerIndex, workers, best, current, attempts, conn):
+  """Runs attempts workerIndex, workerIndex + workers, ... until one wins.
+
+  Stops as soon as a lower attempt index than our next one has won.
+  """
+  Crypto.Random.atfork()
+  index = workerIndex
+  while index < best.value:
+    current[workerIndex] = index
+    solution = attempt(_randomSource(seed, index))
+    attempts[workerIndex] += 1
+    if solution is not None:
+      if index < best.value:
+        best.value = index
+      conn.send((index, solution))
+      break
+    index += workers
+  conn.close()
+
+
+class PuzzleSolver(object):
+  '''Splits the crypto puzzles across a pool of worker processes.
+
+  The first worker to find a solution cancels every worker busy with a later
+  attempt. Statistics for the last solve are kept in lastStats.
+  '''
+
+  pollInterval = 0.01
+
+  def __init__(self, workers = None, seed = None):
+    """Initializes a PuzzleSolver.
+
+    @param workers: number of worker processes, defaults to one per CPU.
+    @param seed: optional seed making the solutions reproducible.
+    """
+    if workers is None:
+      workers = constants.PUZZLE_WORKERS
+    if workers is None:
+      workers = multiprocessing.cpu_count()
+    self.workers = max(1, workers)
+    self.seed = seed
+    self.lastStats = None
+
+  def solveStatic(self, c1 = constants.CRYPTO_CHALLENGE_C1):
+    """Solves the static puzzle, returning (rsaKey, nodeID)."""
+    exportedKey = self.solve(functools.partial(staticAttempt, c1 = c1))
+    rsaKey = Crypto.PublicKey.RSA.importKey(exportedKey)
+    pub = str(rsaKey.n) + str(rsaKey.e)
+    return rsaKey, Crypto.Hash.SHA.new(pub).digest()
+
+  def solveDynamic(self, nodeID, c2 = constants.CRYPTO_CHALLENGE_C2):
+    """Solves the dynamic puzzle for nodeID, returning X."""
+    return self.solve(functools.partial(dynamicAttempt, nodeID = nodeID, c2 = c2))
+
+  def solve(self, attempt):
+    """Runs attempt(randfunc) until it returns something other than None."""
+    startTime = time.time()
+    if self.workers == 1:
+      index, solution, attempts = self._solveInline(attempt)
+    else:
+      index, solution, attempts = self._solveParallel(attempt)
+    elapsed = time.time() - startTime
+    self.lastStats = {
+      'attempts': attempts,
+      'seconds': elapsed,
+      'attemptsPerSecond': (attempts / elapsed) if elapsed > 0 else 0.0,
+      'workers': self.workers,
+      'winningAttempt': index,
+    }
+    return solution
+
+  def _solveInline(self, attempt):
+    index = 0
+    while True:
+      solution = attempt(_randomSource(self.seed, index))
+      if solution is not None:
+        return index, solution, index + 1
+      index += 1
+
+  def _solveParallel(self, attempt):
+    # Lock-free on purpose: workers may be terminated at any point, and a stale
+    # value only delays cancellation, the lowest solution still wins.
+    best = multiprocessing.RawValue('l', sys.maxint)
+    current = multiprocessing.Array('l', self.workers, lock = False)
+    attempts = multiprocessing.Array('l', self.workers, lock = False)
+    processes, readers = [], []
+    for workerIndex in range(self.workers):
+      reader, writer = multiprocessing.Pipe(duplex = False)
+      process = multiprocessing.Process(
+          target = _worker,
+          args = (attempt, self.seed, workerIndex, self.workers,
+                  best, current, attempts, writer))
+      process.daemon = True
+      process.start()
+      writer.close()
+      processes.append(process)
+      readers.append(reader)
+    solutions = []
+    pending = set(range(self.workers))
+    while pending:
+      for workerIndex in list(pending):
+        process, reader = processes[workerIndex], readers[workerIndex]
+        if reader.poll() or not process.is_alive():
+          try:
+            solutions.append(reader.recv())
+          except EOFError:
+            # The worker gave up without a solution.
+            pass
+          pending.discard(workerIndex)
+        elif current[workerIndex] > best.value:
+          # A lower attempt already won; this worker can never beat it.
+          process.terminate()
+          pending.discard(workerIndex)
+      if pending:
+        time.sleep(self.pollInterval)
+    for process in processes:
+      process.join()
+    index, solution = min(solutions)
+    return index, solution, sum(attempts)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Symmetric session keys negotiated on top of the RSA-signed handshake.
+
+The first request to a contact is RSA-signed as usual and additionally carries
+a fresh session key encrypted with the contact's public key (RSA-OAEP). Once
+the contact answers with a message authenticated by that key, both sides
+switch to HMACs for every further message until the session expires and is
+renegotiated.
+"""
+
+import constants
+import util
+
+import Crypto.Cipher.PKCS1_OAEP
+import Crypto.PublicKey.RSA
+
+import hashlib
+import hmac
+import time
+
+
+# Which way a MAC'd message travels; part of what its MAC covers
+(
+  directionRequest,
+  directionResponse
+) = ('q', 'r')
+
+
+class Session(object):
+  """The shared key of one peer, and how far its negotiation has come."""
+
+  (
+    stateOffered,
+    stateEstablished
+  ) = range(2)
+
+  def __init__(self, key, state, expires):
+    self.key = key
+    self.state = state
+    self.expires = expires
+
+
+class SessionTable(object):
+  '''Session keys of all peers of a node, indexed by the peer's node ID.
+
+  Only one key is ever shared with a given peer. If both sides offer a key at
+  the same time, the offer of the node with the lower ID wins.
+  '''
+
+  def __init__(
+      self,
+      lifetime = constants.SESSION_LIFETIME,
+      grace = constants.SESSION_GRACE):
+    self.lifetime = lifetime
+    self.grace = grace
+    self._sessions = {}
+
+  def __len__(self):
+    return len(self._sessions)
+
+  def sendingKey(self, peerID):
+    """Returns the key to MAC outgoing messages to peerID with, if any."""
+    session = self._sessions.get(peerID)
+    if (session is not None and
+        session.state == Session.stateEstablished and
+        session.expires > time.time()):
+      return session.key
+    return None
+
+  def offer(self, peerID):
+    """Starts a new session with peerID, unless an offer is still pending.
+
+    @return: the new key to hand to the peer, or None.
+    """
+    now = time.time()
+    session = self._sessions.get(peerID)
+    if (session is not None and
+        session.state == Session.stateOffered and
+        session.expires > now):
+      return None
+    key = util.generateRandomString(constants.SESSION_KEY_LENGTH)
+    # An unanswered offer is retried after one RPC timeout.
+    self._sessions[peerID] = Session(
+        key, Session.stateOffered, now + constants.rpcTimeout)
+    return key
+
+  def accept(self, ownID, peerID, key):
+    """Accepts a key offered by peerID in an RSA-verified message.
+
+    @return: True if the key is now the session key for peerID.
+    """
+    session = self._sessions.get(peerID)
+    if (session is not None and
+        session.state == Session.stateOffered and
+        session.expires > time.time() and
+        ownID < peerID):
+      # We offered a key ourselves, and ours wins.
+      return False
+    self._sessions[peerID] = Session(
+        key, Session.stateEstablished, time.time() + self.lifetime)
+    return True
+
+  def verify(self, peerID, ownID, direction, data, mac):
+    """Checks a MAC that peerID sent to ownID, on a message travelling in the
+    given direction.
+
+    A valid MAC under a key we offered completes that offer.
+    """
+    session = self._sessions.get(peerID)
+    if session is None:
+      return False
+    now = time.time()
+    if session.state == Session.stateEstablished:
+      # Tolerate the peer's clock running slightly behind ours.
+      if session.expires + self.grace <= now:
+        return False
+    elif session.expires <= now:
+      return False
+    if not hmac.compare_digest(
+        sign(session.key, peerID, ownID, direction, data), mac):
+      return False
+    if session.state == Session.stateOffered:
+      session.state = Session.stateEstablished
+      session.expires = now + self.lifetime
+    return True
+
+  def drop(self, peerID):
+    """Forgets the session with peerID, e.g. because it stopped answering."""
+    if peerID in self._sessions:
+      del self._sessions[peerID]
+
+
+def sign(key, senderID, receiverID, direction, data):
+  """Returns the HMAC of data under the session key.
+
+  Both node IDs and the direction are covered as well: the key is shared by
+  both ends, so otherwise a request or response could be reflected back to
+  its sender, or passed off as travelling the other way.
+  """
+  header = '%d:%s%d:%s%s' % (
+      len(senderID), senderID, len(receiverID), receiverID, direction)
+  return hmac.new(key, header + data, hashlib.sha1).digest()
+
+
+def encryptKey(peerKey, key, senderFingerprint):
+  """Encrypts a session key offered to the holder of peerKey with RSA-OAEP.
+
+  The sender's key fingerprint is the OAEP label, so that the key can't be
+  passed off as offered by anybody else.
+  """
+  # Keys unpickled off the wire lack the random source OAEP needs
+  peerKey = Crypto.PublicKey.RSA.construct((peerKey.n, peerKey.e))
+  return Crypto.Cipher.PKCS1_OAEP.new(
+      peerKey, label = senderFingerprint).encrypt(key)
+
+
+def decryptKey(ownKey, ciphertext, senderFingerprint):
+  """Decrypts a session key offered by the holder of senderFingerprint.
+
+  Every malformed ciphertext gets the same answer, so that the receiver
+  doesn't reveal which part of the decryption failed.
+
+  @return: the session key, or None.
+  """
+  try:
+    key = Crypto.Cipher.PKCS1_OAEP.new(
+        ownKey, label = senderFingerprint).decrypt(ciphertext)
+  except (ValueError, TypeError):
+    return None
+  if len(key) != constants.SESSION_KEY_LENGTH:
+    return None
+  return key
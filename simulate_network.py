@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Simulates a network of many nodes in a single process, in virtual time.
+
+Unlike create_network.py, which starts one process per node, all nodes run on
+one simulated reactor and exchange datagrams over a simulated network (see
+simulation.py), so a run of thousands of nodes takes seconds to minutes and
+is reproducible: the same seed gives the same numbers.
+
+Nodes join one after the other, bootstrapping off the first node. Then each
+lookup stores a value from one random node, and retrieves it from another;
+the report shows how many lookups found their value, how long they took in
+virtual time and how many RPCs and hops the retrievals took (all of them,
+failed ones included), and on how many of the k closest nodes the values
+ended up.
+
+Tinfoil nodes share one RSA key and verification pipeline, and get IDs that
+merely solve the puzzles' hash conditions (see identitypool.py), so that
+thousands of them can be set up quickly. Signing dominates their run time; a
+smaller key (--rsa-bits) speeds it up.
+"""
+
+import simulation
+# Must come before anything imports the reactor, which entangled does. The
+# virtual clock starts at a plausible time.time(), as timestamps of 0 mean
+# "never" to the routing table.
+START = 1e9
+reactor = simulation.install(start = START, virtualTime = True)
+
+import entangled
+import entangled.kademlia.constants
+import twisted.internet.defer
+import twisted.python.log
+
+from node import TintangledNode
+import constants
+import identitypool
+import util
+import verifier
+
+import hashlib
+import random
+import sys
+import time
+
+
+class _NullWriter(object):
+  def write(self, data):
+    pass
+
+  def flush(self):
+    pass
+
+
+def makeNodes(amount, tinfoil, rng, rsaBits = constants.RSA_BITS,
+    startPort = 4000):
+  nodes = []
+  if not tinfoil:
+    for i in range(amount):
+      nodeID = util.int2bin(rng.getrandbits(8 * constants.ID_LENGTH))
+      nodes.append(entangled.EntangledNode(id = nodeID, udpPort = startPort + i))
+    return nodes
+  identities = identitypool.SharedIdentities(
+      seed = rng.getrandbits(64), rsaBits = rsaBits)
+  # Verification threads would run outside of the simulated reactor.
+  pipeline = verifier.VerificationPipeline(threads = 0)
+  for i in range(amount):
+    nodeID, rsaKey, x = identities.next()
+    node = TintangledNode(
+        id = nodeID, udpPort = startPort + i, verificationPipeline = pipeline,
+        bindKeyToID = not identities.sharedKey)
+    node.rsaKey = rsaKey
+    node.x = x
+    node.keyCache[node.id] = rsaKey
+    nodes.append(node)
+  return nodes
+
+class LookupTracer(object):
+  '''Counts the RPCs and hops of lookups.
+
+  A lookup's hops are the length of the longest chain of contacts it queried,
+  each learned from the response of the one before; contacts it started out
+  with from the routing table are one hop away.
+  '''
+
+  def __init__(self):
+    # (node ID, key) -> {'rpcs': ..., 'hops': ..., 'depths': contact ID -> hops}
+    self._traces = {}
+    self._traced = set()
+
+  def start(self, node, key):
+    """Traces the lookups of the node for the key from now on."""
+    if node.id not in self._traced:
+      self._wrap(node)
+      self._traced.add(node.id)
+    self._traces[(node.id, key)] = {'rpcs': 0, 'hops': 0, 'depths': {}}
+
+  def stop(self, node, key):
+    """Returns the RPCs and hops of the node's lookups for the key."""
+    trace = self._traces.pop((node.id, key))
+    return trace['rpcs'], trace['hops']
+
+  def _wrap(self, node):
+    protocol = node._protocol
+    sendRPC = protocol.sendRPC
+    def tracedSendRPC(contact, method, args, **kwargs):
+      df = sendRPC(contact, method, args, **kwargs)
+      if method in ('findNode', 'findValue'):
+        trace = self._traces.get((node.id, args[0]))
+        if trace is not None:
+          trace['rpcs'] += 1
+          hops = trace['depths'].setdefault(contact.id, 1)
+          trace['hops'] = max(trace['hops'], hops)
+          df.addCallback(self._learned, trace, hops)
+      return df
+    protocol.sendRPC = tracedSendRPC
+
+  def _learned(self, result, trace, hops):
+    response = result
+    if isinstance(result, tuple):
+      # The raw response message, and its address
+      response = result[0].response
+    if isinstance(response, list):
+      for contactTriple in response:
+        if isinstance(contactTriple, (list, tuple)) and len(contactTriple) == 3:
+          trace['depths'].setdefault(contactTriple[0], hops + 1)
+    return result
+
+
+def closestNodes(nodes, key, k = entangled.kademlia.constants.k):
+  keyValue = util.bin2int(key)
+  return sorted(
+      nodes, key = (lambda node: util.bin2int(node.id) ^ keyValue))[:k]
+
+def simulate(nodes, lookups, rng, joinInterval, churn = None):
+  network = reactor.network
+  # rpcs and hops are those of all retrievals, foundRPCs those of the ones
+  # that found their value
+  result = {'found': 0, 'times': [], 'rpcs': [], 'hops': [], 'foundRPCs': [],
+      'replicas': [], 'closestReplicas': []}
+  tracer = LookupTracer()
+
+  started = time.clock()
+  nodes[0].joinNetwork(None)
+  for i, node in enumerate(nodes[1:]):
+    reactor.callLater(
+        (i + 1) * joinInterval, node.joinNetwork,
+        [('127.0.0.1', nodes[0].port)])
+  # Settle: give the last node time for its join lookup.
+  reactor.run(until = reactor.seconds() + len(nodes) * joinInterval + 60)
+  result['joinSeconds'] = time.clock() - started
+  result['joinStats'] = network.stats()
+
+  if churn is not None:
+    network.churn(*churn)
+
+  def online(node):
+    return network.isOnline(('127.0.0.1', node.port))
+
+  @twisted.internet.defer.inlineCallbacks
+  def lookup(i, remaining):
+    key = hashlib.sha1('simulated-value-%d' % i).digest()
+    value = 'value %d' % i
+    publisher, reader = rng.sample([node for node in nodes if online(node)], 2)
+    try:
+      yield publisher.iterativeStore(key, value)
+      begun = reactor.seconds()
+      tracer.start(reader, key)
+      try:
+        found = yield reader.iterativeFindValue(key)
+      finally:
+        rpcs, hops = tracer.stop(reader, key)
+        result['rpcs'].append(rpcs)
+        result['hops'].append(hops)
+      if type(found) == dict and found.get(key) == value:
+        result['found'] += 1
+        result['times'].append(reactor.seconds() - begun)
+        result['foundRPCs'].append(rpcs)
+      holders = set(node.id for node in nodes if key in node._dataStore)
+      result['replicas'].append(len(holders))
+      result['closestReplicas'].append(len(
+          [node for node in closestNodes(nodes, key) if node.id in holders]))
+    finally:
+      remaining[0] -= 1
+      if remaining[0] == 0:
+        reactor.stop()
+
+  started = time.clock()
+  remaining = [lookups]
+  for i in range(lookups):
+    reactor.callLater(i * 0.1, lookup, i, remaining)
+  reactor.run(until = reactor.seconds() + lookups * 0.1 + 600)
+  result['lookupSeconds'] = time.clock() - started
+  result['stats'] = network.stats()
+  result['reactor'] = reactor.stats()
+  return result
+
+def _option(name, default, convert = float):
+  for arg in sys.argv[1:]:
+    if arg.startswith('--%s=' % name):
+      return convert(arg[len(name) + 3:])
+  return default
+
+if __name__ == '__main__':
+  args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+  if not args:
+    print('Usage:\n%s AMOUNT_OF_NODES [LOOKUPS] [--tinfoil] [--seed=N] '
+        '[--latency=SECONDS] [--jitter=SECONDS] [--loss=FRACTION] '
+        '[--join-interval=SECONDS] [--churn=MEAN_UPTIME:MEAN_DOWNTIME] '
+        '[--rsa-bits=BITS] [--verbose]' % sys.argv[0])
+    sys.exit(1)
+  amount = int(args[0])
+  lookups = int(args[1]) if len(args) > 1 else 100
+  tinfoil = '--tinfoil' in sys.argv
+  verbose = '--verbose' in sys.argv
+  seed = _option('seed', 0, int)
+  reactor.network.latency = _option('latency', constants.SIMULATION_LATENCY)
+  reactor.network.jitter = _option('jitter', constants.SIMULATION_JITTER)
+  reactor.network.loss = _option('loss', constants.SIMULATION_LOSS)
+  reactor.network.random.seed(seed)
+  joinInterval = _option('join-interval', 0.1)
+  rsaBits = _option('rsa-bits', constants.RSA_BITS, int)
+  churn = _option('churn', None, lambda value: map(float, value.split(':')))
+  # Message and node IDs are drawn from the random module.
+  random.seed(seed)
+  rng = random.Random(seed)
+
+  output = sys.stdout
+  if verbose:
+    twisted.python.log.startLogging(sys.stderr)
+  else:
+    # Nodes print on every message they handle, and leave the errors of
+    # failed RPCs unhandled.
+    sys.stdout = _NullWriter()
+    twisted.python.log.startLoggingWithObserver(
+        lambda event: None, setStdout = False)
+  try:
+    nodes = makeNodes(amount, tinfoil, rng, rsaBits)
+    result = simulate(nodes, lookups, rng, joinInterval, churn)
+  finally:
+    sys.stdout = output
+
+  stats = result['stats']
+  times = sorted(result['times']) or [0.0]
+  print('%d %s nodes joined in %.1fs (%d datagrams)' % (
+      amount, 'Tinfoil' if tinfoil else 'Entangled', result['joinSeconds'],
+      result['joinStats']['sent']))
+  print('%d of %d lookups found their value in %.1fs; virtual lookup time: '
+      'mean %.2fs, p50 %.2fs, max %.2fs' % (
+      result['found'], lookups, result['lookupSeconds'],
+      sum(times) / len(times), times[len(times) // 2], times[-1]))
+  rpcs = result['rpcs'] or [0]
+  hops = result['hops'] or [0]
+  failed = len(result['rpcs']) - len(result['foundRPCs'])
+  print('All %d lookups took: mean %.1f RPCs, mean %.2f hops (max %d); '
+      'the %d that failed took mean %.1f RPCs' % (
+      len(result['rpcs']), float(sum(rpcs)) / len(rpcs),
+      float(sum(hops)) / len(hops), max(hops), failed,
+      float(sum(rpcs) - sum(result['foundRPCs'])) / max(failed, 1)))
+  replicas = result['replicas'] or [0]
+  print('Replicas per value: mean %.1f, on %.1f of the %d closest nodes' % (
+      float(sum(replicas)) / len(replicas),
+      float(sum(result['closestReplicas'])) / max(len(result['closestReplicas']), 1),
+      entangled.kademlia.constants.k))
+  print('Datagrams: %(sent)d sent, %(delivered)d delivered, %(lost)d lost, '
+      '%(offline)d to or from offline nodes; %(online)d of %(nodes)d nodes '
+      'online' % stats)
+  print('Virtual time %.0fs, %d calls run, %d unhandled errors' % (
+      result['reactor']['seconds'] - START, result['reactor']['callsRun'],
+      result['reactor']['errors']))
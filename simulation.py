@@ -0,0 +1,460 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""A deterministic, in-memory stand-in for the Twisted reactor and network.
+
+SimulatedReactor runs on a virtual clock: run() jumps from one scheduled call
+to the next instead of waiting, so thousands of nodes can be simulated in one
+process far faster than real time. Datagrams never touch a socket; they are
+handed to the receiving protocol by SimulatedNetwork after a latency drawn
+from its seeded random generator, unless they are lost or the sender or the
+receiver is offline. A run with the same seed gives the same result.
+
+The reactor has to be installed before anything imports twisted.internet's
+reactor (which importing entangled does), see install().
+"""
+
+import twisted.internet.address
+import twisted.internet.base
+import twisted.internet.defer
+import twisted.internet.error
+import twisted.internet.interfaces
+import twisted.python.failure
+import twisted.python.log
+import zope.interface
+
+import constants
+
+import heapq
+import math
+import random
+import time
+
+
+def install(start = 0.0, virtualTime = False):
+  """Installs a SimulatedReactor as the global Twisted reactor.
+
+  With virtualTime, time.time() follows the virtual clock too, so that the
+  refresh and republish logic (which uses time.time()) runs in virtual time.
+
+  @return: the installed reactor
+  """
+  import twisted.internet.main
+  reactor = SimulatedReactor(start)
+  twisted.internet.main.installReactor(reactor)
+  if virtualTime:
+    time.time = reactor.seconds
+  return reactor
+
+
+@zope.interface.implementer(
+    twisted.internet.interfaces.IReactorTime,
+    twisted.internet.interfaces.IReactorCore,
+    twisted.internet.interfaces.IReactorUDP,
+    twisted.internet.interfaces.IReactorTCP,
+    twisted.internet.interfaces.IReactorThreads)
+class SimulatedReactor(object):
+  '''Runs delayed calls in order of their (virtual) time.
+
+  Cancelled calls stay in the heap until their time comes, unless they make
+  up most of it, in which case it is rebuilt. Calls due at the same time run
+  in the order they were scheduled. Threads aren't simulated: work handed to
+  the thread pool runs on the next turn of the clock instead.
+
+  TCP connections always fail, so that large messages go over UDP.
+  '''
+
+  def __init__(self, start = 0.0):
+    self._now = start
+    # Entries are [time, sequence number, call]
+    self._heap = []
+    self._sequence = 0
+    self._cancelled = 0
+    self._whenRunning = []
+    self._triggers = {}
+    self._stopping = False
+    self.running = False
+    self.network = SimulatedNetwork(self)
+    self.callsRun = 0
+    self.errors = 0
+
+  # IReactorTime
+
+  def seconds(self):
+    return self._now
+
+  def callLater(self, delay, func, *args, **kw):
+    call = twisted.internet.base.DelayedCall(
+        self._now + max(delay, 0), func, args, kw,
+        self._callCancelled, self._push, seconds = self.seconds)
+    self._push(call)
+    return call
+
+  def getDelayedCalls(self):
+    calls = set()
+    for entry in self._heap:
+      call = entry[2]
+      if call.active() and entry[0] == call.time:
+        calls.add(call)
+    return list(calls)
+
+  # IReactorCore
+
+  def callWhenRunning(self, func, *args, **kw):
+    if self.running:
+      func(*args, **kw)
+    else:
+      self._whenRunning.append((func, args, kw))
+
+  def run(self, until = None, installSignalHandlers = False):
+    """Runs scheduled calls until stop() is called, none are left, or the
+    virtual clock would pass until.
+
+    Unlike a real reactor, a simulated one can be run again after it stopped,
+    e.g. to run a simulation in phases.
+    """
+    if self.running:
+      raise twisted.internet.error.ReactorAlreadyRunning()
+    self.running = True
+    self._stopping = False
+    whenRunning, self._whenRunning = self._whenRunning, []
+    for func, args, kw in whenRunning:
+      self._call(func, args, kw)
+    heap = self._heap
+    while heap and not self._stopping:
+      when, sequence, call = heap[0]
+      if until is not None and when > until:
+        break
+      heapq.heappop(heap)
+      if when != call.time:
+        # Superseded by an entry pushed when the call was reset
+        continue
+      if call.cancelled:
+        self._cancelled -= 1
+        continue
+      if call.delayed_time:
+        call.activate_delay()
+        self._push(call)
+        continue
+      self._now = max(self._now, when)
+      call.called = 1
+      self._call(call.func, call.args, call.kw)
+    if until is not None and not self._stopping:
+      self._now = max(self._now, until)
+    self.running = False
+
+  def stop(self):
+    """Makes run() return once the current call is done."""
+    if not self.running:
+      raise twisted.internet.error.ReactorNotRunning()
+    self._stopping = True
+
+  def crash(self):
+    self._stopping = True
+
+  def iterate(self, delay = 0):
+    self.run(until = self._now + delay)
+
+  def fireSystemEvent(self, eventType):
+    for phase in ('before', 'during', 'after'):
+      for triggerID, func, args, kw in self._triggers.pop((phase, eventType), []):
+        self._call(func, args, kw)
+
+  def addSystemEventTrigger(self, phase, eventType, callable, *args, **kw):
+    self._sequence += 1
+    triggerID = (phase, eventType, self._sequence)
+    self._triggers.setdefault((phase, eventType), []).append(
+        (triggerID, callable, args, kw))
+    return triggerID
+
+  def removeSystemEventTrigger(self, triggerID):
+    phase, eventType = triggerID[:2]
+    self._triggers[(phase, eventType)] = [
+        trigger for trigger in self._triggers.get((phase, eventType), [])
+        if trigger[0] != triggerID]
+
+  def resolve(self, name, timeout = 10):
+    """Host names are not simulated; addresses resolve to themselves."""
+    return twisted.internet.defer.succeed(name)
+
+  # IReactorThreads
+
+  def callFromThread(self, func, *args, **kw):
+    self.callLater(0, func, *args, **kw)
+
+  def callInThread(self, func, *args, **kw):
+    self.callLater(0, func, *args, **kw)
+
+  def getThreadPool(self):
+    return _SimulatedThreadPool(self)
+
+  def suggestThreadPoolSize(self, size):
+    pass
+
+  # IReactorUDP
+
+  def listenUDP(self, port, protocol, interface = '', maxPacketSize = 8192):
+    return self.network.attach(port, protocol, interface)
+
+  # IReactorTCP
+
+  def listenTCP(self, port, factory, backlog = 50, interface = ''):
+    return _SimulatedTCPPort(
+        twisted.internet.address.IPv4Address('TCP', interface or '127.0.0.1', port))
+
+  def connectTCP(self, host, port, factory, timeout = 30, bindAddress = None):
+    connector = _SimulatedConnector(
+        twisted.internet.address.IPv4Address('TCP', host, port))
+    def refuse():
+      if not connector.stopped:
+        factory.clientConnectionFailed(connector, twisted.python.failure.Failure(
+            twisted.internet.error.ConnectionRefusedError()))
+    self.callLater(0, refuse)
+    return connector
+
+  def stats(self):
+    """Returns the virtual time and the number of calls run and pending."""
+    return {
+      'seconds': self._now,
+      'callsRun': self.callsRun,
+      'pending': len(self._heap) - self._cancelled,
+      'errors': self.errors,
+    }
+
+  def _push(self, call):
+    self._sequence += 1
+    heapq.heappush(self._heap, [call.time, self._sequence, call])
+
+  def _callCancelled(self, call):
+    self._cancelled += 1
+    if self._cancelled > 1024 and self._cancelled * 2 > len(self._heap):
+      self._heap[:] = [entry for entry in self._heap
+          if not (entry[2].cancelled or entry[2].called)
+          and entry[0] == entry[2].time]
+      heapq.heapify(self._heap)
+      self._cancelled = 0
+
+  def _call(self, func, args, kw):
+    self.callsRun += 1
+    try:
+      func(*args, **kw)
+    except:
+      self.errors += 1
+      twisted.python.log.err(None, 'Unhandled error in simulated call:')
+
+
+class _SimulatedThreadPool(object):
+  '''Runs "threaded" work on the next turn of the simulated clock.'''
+
+  def __init__(self, reactor):
+    self._reactor = reactor
+
+  def callInThreadWithCallback(self, onResult, func, *args, **kw):
+    def run():
+      try:
+        result = func(*args, **kw)
+      except:
+        onResult(False, twisted.python.failure.Failure())
+      else:
+        onResult(True, result)
+    self._reactor.callLater(0, run)
+
+  def callInThread(self, func, *args, **kw):
+    self._reactor.callLater(0, func, *args, **kw)
+
+
+class _SimulatedTCPPort(object):
+
+  def __init__(self, address):
+    self._address = address
+
+  def getHost(self):
+    return self._address
+
+  def stopListening(self):
+    pass
+
+
+class _SimulatedConnector(object):
+
+  def __init__(self, address):
+    self._address = address
+    self.stopped = False
+
+  def getDestination(self):
+    return self._address
+
+  def disconnect(self):
+    self.stopped = True
+
+  def stopConnecting(self):
+    self.stopped = True
+
+
+class SimulatedNetwork(object):
+  '''Carries datagrams between the protocols attached to it.
+
+  Every datagram is delayed by latency plus up to jitter seconds, and lost
+  with probability loss; override delay() for other latency models (e.g. a
+  fixed latency per pair of hosts). Nodes can be taken offline, by hand or by
+  churn(), in which case they neither send nor receive.
+  '''
+
+  def __init__(
+      self, reactor,
+      latency = constants.SIMULATION_LATENCY,
+      jitter = constants.SIMULATION_JITTER,
+      loss = constants.SIMULATION_LOSS,
+      seed = 0):
+    self._reactor = reactor
+    self.latency = latency
+    self.jitter = jitter
+    self.loss = loss
+    self.random = random.Random(seed)
+    # (host, port) -> _SimulatedUDPPort
+    self._ports = {}
+    self._offline = set()
+    self._nextPort = 30000
+    # address -> the call taking that address on- or offline next
+    self._churnCalls = {}
+    self.sent = 0
+    self.bytesSent = 0
+    self.delivered = 0
+    self.lost = 0
+    self.offline = 0
+    self.unreachable = 0
+
+  def attach(self, port, protocol, host = ''):
+    """Connects a datagram protocol to the network at (host, port)."""
+    host = host or '127.0.0.1'
+    if port == 0:
+      while (host, self._nextPort) in self._ports:
+        self._nextPort += 1
+      port = self._nextPort
+    address = (host, port)
+    if address in self._ports:
+      raise twisted.internet.error.CannotListenError(
+          host, port, 'Address already in use')
+    udpPort = _SimulatedUDPPort(self, address, protocol)
+    self._ports[address] = udpPort
+    protocol.makeConnection(udpPort)
+    return udpPort
+
+  def detach(self, address):
+    self._ports.pop(address, None)
+    self._offline.discard(address)
+    self._cancelChurn(address)
+
+  def addresses(self):
+    """Returns the addresses of the attached protocols, in a fixed order."""
+    return sorted(self._ports)
+
+  def isOnline(self, address):
+    return address in self._ports and address not in self._offline
+
+  def setOnline(self, address, online):
+    if online:
+      self._offline.discard(address)
+    else:
+      self._offline.add(address)
+
+  def churn(self, meanUptime, meanDowntime, addresses = None):
+    """Takes nodes off- and online again, with exponentially distributed
+    up- and downtimes of the given means (in seconds)."""
+    if addresses is None:
+      addresses = self.addresses()
+    for address in addresses:
+      self._cancelChurn(address)
+      self._scheduleChurn(address, meanUptime, meanDowntime)
+
+  def stopChurn(self):
+    """Stops churning, leaving nodes that are offline offline."""
+    for address in self._churnCalls.keys():
+      self._cancelChurn(address)
+
+  def delay(self, source, destination):
+    """Returns how long a datagram from source to destination takes."""
+    if self.jitter:
+      return self.latency + self.random.random() * self.jitter
+    return self.latency
+
+  def send(self, data, source, destination):
+    self.sent += 1
+    self.bytesSent += len(data)
+    if source in self._offline:
+      self.offline += 1
+      return
+    if self.loss and self.random.random() < self.loss:
+      self.lost += 1
+      return
+    self._reactor.callLater(
+        self.delay(source, destination), self._deliver, data, source,
+        destination)
+
+  def stats(self):
+    """Returns the datagram counts, and how many nodes are online."""
+    return {
+      'nodes': len(self._ports),
+      'online': len(self._ports) - len(self._offline),
+      'sent': self.sent,
+      'bytesSent': self.bytesSent,
+      'delivered': self.delivered,
+      'lost': self.lost,
+      'offline': self.offline,
+      'unreachable': self.unreachable,
+    }
+
+  def _deliver(self, data, source, destination):
+    udpPort = self._ports.get(destination)
+    if udpPort is None:
+      self.unreachable += 1
+    elif destination in self._offline:
+      self.offline += 1
+    else:
+      self.delivered += 1
+      udpPort.protocol.datagramReceived(data, source)
+
+  def _scheduleChurn(self, address, meanUptime, meanDowntime):
+    online = address not in self._offline
+    mean = meanUptime if online else meanDowntime
+    def toggle():
+      self.setOnline(address, not online)
+      self._scheduleChurn(address, meanUptime, meanDowntime)
+    self._churnCalls[address] = self._reactor.callLater(
+        -mean * math.log(1.0 - self.random.random()), toggle)
+
+  def _cancelChurn(self, address):
+    call = self._churnCalls.pop(address, None)
+    if call is not None and call.active():
+      call.cancel()
+
+
+@zope.interface.implementer(twisted.internet.interfaces.IUDPTransport)
+class _SimulatedUDPPort(object):
+  '''The transport of a protocol attached to a SimulatedNetwork.
+
+  Connected UDP (connect() and getPeer()) is not simulated.
+  '''
+
+  def __init__(self, network, address, protocol):
+    self._network = network
+    self._address = address
+    self.protocol = protocol
+
+  def write(self, packet, addr = None):
+    self._network.send(packet, self._address, tuple(addr))
+
+  def getHost(self):
+    return twisted.internet.address.IPv4Address(
+        'UDP', self._address[0], self._address[1])
+
+  def stopListening(self):
+    self._network.detach(self._address)
+    self.protocol.doStop()
+
+  def setBroadcastAllowed(self, enabled):
+    pass
+
+  def getBroadcastAllowed(self):
+    return False
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Lightweight counters and histograms for instrumenting the node."""
+
+import bisect
+
+
+class Histogram(object):
+  '''Histogram with fixed, exponentially growing bucket bounds.
+
+  The default bounds suit durations in seconds, from 10 microseconds up to
+  10 seconds; anything larger lands in a final overflow bucket.
+  '''
+
+  def __init__(self, bounds = None):
+    if bounds is None:
+      bounds = [10 ** (exponent / 2.0) for exponent in range(-10, 3)]
+    self.bounds = list(bounds)
+    self.counts = [0] * (len(self.bounds) + 1)
+    self.count = 0
+    self.total = 0.0
+    self.maximum = 0.0
+
+  def record(self, value):
+    """Adds a single sample."""
+    self.counts[bisect.bisect_left(self.bounds, value)] += 1
+    self.count += 1
+    self.total += value
+    if value > self.maximum:
+      self.maximum = value
+
+  def mean(self):
+    return (self.total / self.count) if self.count else 0.0
+
+  def percentile(self, fraction):
+    """Returns the upper bound of the bucket holding the given percentile."""
+    if not self.count:
+      return 0.0
+    wanted = fraction * self.count
+    seen = 0
+    for i, count in enumerate(self.counts):
+      seen += count
+      if seen >= wanted:
+        return self.bounds[i] if i < len(self.bounds) else self.maximum
+    return self.maximum
+
+  def summary(self):
+    """Returns a dict with the count, mean, p50, p99 and max."""
+    return {
+      'count': self.count,
+      'mean': self.mean(),
+      'p50': self.percentile(0.5),
+      'p99': self.percentile(0.99),
+      'max': self.maximum,
+    }
@@ -14,6 +14,7 @@ import Crypto.Random
 
 from node import TintangledNode
 import constants
+import keystore
 import util
 
 import binascii
@@ -26,9 +27,19 @@ class Client:
   Builds the "social" features ontop of the underlying network framework.
   '''
 
-  def __init__(self, udpPort = 4000, vanillaEntangled = False):
-    '''Initializes a Tinfoil Node.'''
+  def __init__(
+      self, udpPort = 4000, vanillaEntangled = False, keystorePath = None,
+      identity = None, verificationPipeline = None,
+      bindKeyToID = constants.BIND_KEY_TO_ID):
+    '''Initializes a Tinfoil Node.
+
+    An identity - (id, rsaKey, x) - given here is used as is, and not saved.
+    '''
     self.udpPort = udpPort
+    self.keystorePath = keystorePath
+    self.identity = identity
+    self.verificationPipeline = verificationPipeline
+    self.bindKeyToID = bindKeyToID
     self.postCache = {}
     # TODO(cskau): we need to ask the network for last known sequence number
     self.sequenceNumber = 0
@@ -38,7 +49,7 @@ class Client:
     self.postIDNameTuple = {}
     self.vanillaEntangled = vanillaEntangled
 
-  def join(self, knownNodes):
+  def join(self, knownNodes, runReactor = True):
     """Join the social network.
     Calculate our userID and join network at given place.
     This involves:
@@ -48,13 +59,20 @@ class Client:
     - notifying and requesting involved parties of the selected position.
     OR if the user has already created his ID in the past.
     - use the previously established private key to authenticate in network.
+    OR if a keystore was given.
+    - claim an unused, pre-solved identity from it.
+    OR if an identity was given.
+    - use that.
+    Unless runReactor is False, this runs the reactor until it is stopped.
     """
     # Check to see if we have already been authenticated with the network.
     id = None
     rsaKey = None
     x = None
 
-    if os.path.exists(constants.PATH_TO_ID % self.udpPort):
+    if self.identity is not None:
+      id, rsaKey, x = self.identity
+    elif os.path.exists(constants.PATH_TO_ID % self.udpPort):
       fID = open(constants.PATH_TO_ID % self.udpPort, 'r')
       id = fID.read()
       fID.close()
@@ -66,24 +84,20 @@ class Client:
       fX = open(constants.PATH_TO_X % self.udpPort, 'r')
       x = long(fX.read())
       fX.close()
+    elif self.keystorePath is not None:
+      index, (id, rsaKey, x) = keystore.Keystore(self.keystorePath).claim()
+      print('Claimed identity %d from %s' % (index, self.keystorePath))
+      self._saveIdentity(id, rsaKey, x)
 
     # Generate new node from scratch or based on already known values.
-    self.node = TintangledNode(id = id, udpPort = self.udpPort, vanillaEntangled = self.vanillaEntangled)
+    self.node = TintangledNode(
+        id = id, udpPort = self.udpPort, vanillaEntangled = self.vanillaEntangled,
+        verificationPipeline = self.verificationPipeline,
+        bindKeyToID = self.bindKeyToID)
 
     # Save node data to file if node is new.
     if id == None:
-      # Save ID, RSAKey and X to file.
-      fID = open(constants.PATH_TO_ID % self.udpPort, 'w')
-      fID.write(self.node.id)
-      fID.close()
-
-      fKey = open(constants.PATH_TO_RSAKEY % self.udpPort, 'w')
-      pickle.dump(self.node.rsaKey.exportKey(), fKey)
-      fKey.close()
-
-      fX = open(constants.PATH_TO_X % self.udpPort, 'w')
-      fX.write(str(self.node.x))
-      fX.close()
+      self._saveIdentity(self.node.id, self.node.rsaKey, self.node.x)
     else:
       self.node.rsaKey = rsaKey
       self.node.x = x
@@ -98,7 +112,22 @@ class Client:
     self.node.publishData(
         ('%s:publickey' % (self.node.id)),
         pickle.dumps(self._getUserPublicKey(self.node.id).publickey()))
-    twisted.internet.reactor.run()
+    if runReactor:
+      twisted.internet.reactor.run()
+
+  def _saveIdentity(self, id, rsaKey, x):
+    """Saves ID, RSAKey and X to file, so a restart reuses them."""
+    fID = open(constants.PATH_TO_ID % self.udpPort, 'w')
+    fID.write(id)
+    fID.close()
+
+    fKey = open(constants.PATH_TO_RSAKEY % self.udpPort, 'w')
+    pickle.dump(rsaKey.exportKey(), fKey)
+    fKey.close()
+
+    fX = open(constants.PATH_TO_X % self.udpPort, 'w')
+    fX.write(str(x))
+    fX.close()
 
   def share(self, resourceID, friendsID):
     """Share some stored resource with one or more users.
@@ -346,8 +375,14 @@ class Client:
 
 if __name__ == '__main__':
   import sys
+  # Optional pre-solved identity keystore, see mint_identities.py
+  keystorePath = None
+  for arg in sys.argv[1:]:
+    if arg.startswith('--keystore='):
+      keystorePath = arg[len('--keystore='):]
+      sys.argv.remove(arg)
   if len(sys.argv) < 2:
-    print('Usage:\n%s UDP_PORT [KNOWN_NODE_IP KNOWN_NODE_PORT] NODE_ID' %
+    print('Usage:\n%s UDP_PORT [KNOWN_NODE_IP KNOWN_NODE_PORT] NODE_ID [--keystore=FILE]' %
           sys.argv[0])
     sys.exit(1)
   else:
@@ -356,7 +391,7 @@ if __name__ == '__main__':
     except ValueError:
       print('\nUDP_PORT must be an integer value.\n')
       print(
-          'Usage:\n%s UDP_PORT [KNOWN_NODE_IP KNOWN_NODE_PORT] NODE_ID' %
+          'Usage:\n%s UDP_PORT [KNOWN_NODE_IP KNOWN_NODE_PORT] NODE_ID [--keystore=FILE]' %
           sys.argv[0])
       sys.exit(1)
   #Add vanilla argument
@@ -369,7 +404,10 @@ if __name__ == '__main__':
 
 
   # Create Tinfoil node, join network
-  client = Client(udpPort=usePort, vanillaEntangled = vanillaVersion)
+  client = Client(
+      udpPort=usePort,
+      vanillaEntangled = vanillaVersion,
+      keystorePath = keystorePath)
 
   # Add HTTP "GUI"
   import tinfront
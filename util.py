@@ -2,6 +2,7 @@
 # coding: UTF-8
 
 
+import Crypto.Hash.SHA
 import Crypto.Random
 import constants
 
@@ -21,6 +22,14 @@ def hasNZeroBitPrefix(value, n):
   """Check whether the first N bits in the specified value are all zero."""
   return ((value & ((2 ** n) - 1)) == 0)
 
+def keyFingerprint(rsaKey):
+  """Returns the 20-byte fingerprint of a public key.
+
+  This is the same hash the static crypto puzzle is solved over, so the
+  fingerprint of a node's key equals its node ID.
+  """
+  return Crypto.Hash.SHA.new(str(rsaKey.n) + str(rsaKey.e)).digest()
+
 def generateRandomString(length):
   """Generates a random string with a byte length of 'length'."""
   return Crypto.Random.get_random_bytes(length)
@@ -35,6 +44,11 @@ def int2bin(value, nbytes = 20):
   """Converts integer to binary."""
   return (hex(value)[2:-1].rjust((2 * nbytes), '0')).decode('hex')
 
+def int2bytes(value):
+  """Converts a non-negative integer to binary, without leading zero bytes."""
+  digits = '%x' % value
+  return ('0' * (len(digits) % 2) + digits).decode('hex')
+
 def hex2int(value):
   """Converts hex to integer."""
   return long(value, base = 16)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+
+"""Verifies incoming messages on worker threads instead of the reactor."""
+
+import twisted.internet.reactor
+import twisted.internet.threads
+import twisted.python.failure
+import twisted.python.threadpool
+
+import constants
+import stats
+
+import collections
+import time
+
+reactor = twisted.internet.reactor
+
+
+class VerificationPipeline(object):
+  '''Bounded pool of verification workers.
+
+  Jobs are queued per sender and only one job of a sender is verified at a
+  time, so a sender's messages are handled in the order they arrived. When
+  maxQueueDepth jobs are pending, new ones are dropped.
+
+  With threads = 0 every job is verified synchronously on submit.
+  '''
+
+  def __init__(
+      self,
+      threads = constants.VERIFY_THREADS,
+      maxQueueDepth = constants.VERIFY_QUEUE_DEPTH):
+    self.threads = threads
+    self.maxQueueDepth = maxQueueDepth
+    self.pending = 0
+    self.dropped = 0
+    self.queueWait = stats.Histogram()
+    self.verifyTime = stats.Histogram()
+    # sender -> deque of jobs; the head job is the one being verified
+    self._queues = {}
+    self._pool = None
+
+  def busy(self, sender):
+    """Returns whether jobs from sender are still pending."""
+    return sender in self._queues
+
+  def submit(self, sender, verify, args, callback, callbackArgs = ()):
+    """Queues verify(*args); callback(result, *callbackArgs) follows on the
+    reactor thread.
+
+    @return: False if the job was dropped because the queue is full.
+    """
+    if self.pending >= self.maxQueueDepth:
+      self.dropped += 1
+      return False
+    self.pending += 1
+    job = (time.time(), verify, args, callback, callbackArgs)
+    if sender in self._queues:
+      self._queues[sender].append(job)
+    else:
+      self._queues[sender] = collections.deque([job])
+      self._dispatch(sender)
+    return True
+
+  def verifyInline(self, verify, args):
+    """Returns verify(*args), run right away on the calling thread.
+
+    For checks too cheap to be worth a worker; they are recorded in the
+    histograms like a job that didn't have to wait.
+    """
+    started = time.time()
+    result = verify(*args)
+    self.queueWait.record(0.0)
+    self.verifyTime.record(time.time() - started)
+    return result
+
+  def stats(self):
+    """Returns the queue state and the queue-wait and verify-time histograms."""
+    return {
+      'pending': self.pending,
+      'dropped': self.dropped,
+      'queueWait': self.queueWait.summary(),
+      'verifyTime': self.verifyTime.summary(),
+    }
+
+  def stop(self):
+    if self._pool is not None:
+      self._pool.stop()
+      self._pool = None
+
+  def _dispatch(self, sender):
+    job = self._queues[sender][0]
+    if self.threads <= 0:
+      try:
+        outcome = self._run(job)
+      except Exception:
+        outcome = self._failed(twisted.python.failure.Failure(), job)
+      self._done(outcome, sender)
+      return
+    if self._pool is None:
+      self._pool = twisted.python.threadpool.ThreadPool(
+          1, self.threads, 'VerificationPipeline')
+      self._pool.start()
+      reactor.addSystemEventTrigger('during', 'shutdown', self.stop)
+    df = twisted.internet.threads.deferToThreadPool(
+        reactor, self._pool, self._run, job)
+    df.addErrback(self._failed, job)
+    df.addCallback(self._done, sender)
+
+  def _run(self, job):
+    """Runs on a worker thread."""
+    enqueued, verify, args = job[:3]
+    started = time.time()
+    result = verify(*args)
+    return result, (started - enqueued), (time.time() - started)
+
+  def _failed(self, failure, job):
+    print 'Verification raised %s - rejects RPC' % failure.getErrorMessage()
+    return None, (time.time() - job[0]), 0.0
+
+  def _done(self, outcome, sender):
+    result, wait, elapsed = outcome
+    self.queueWait.record(wait)
+    self.verifyTime.record(elapsed)
+    queue = self._queues[sender]
+    callback, callbackArgs = queue.popleft()[3:]
+    self.pending -= 1
+    try:
+      callback(result, *callbackArgs)
+    finally:
+      if queue:
+        self._dispatch(sender)
+      else:
+        del self._queues[sender]